@@ -0,0 +1,144 @@
+# Serves synthetic HLS videos with configurable latency and bandwidth, like a (busy) live.rbg.tum.de would
+# Usage: python benchmark/hls_server.py [--port 8000] [--videos 100] [--latency 0.05] [--bandwidth 2e6]
+import argparse
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHUNK_SIZE = 64 * 1024
+SEGMENT_DURATION = 6.0
+TS_PACKET = b"\x47" + b"\xff" * 187  # Sync byte and stuffing, looks like MPEG-TS to anyone who checks
+VARIANTS = {"low": (640, 360, 400_000), "high": (1920, 1080, 2_000_000)}  # name: (width, height, bandwidth)
+
+
+class Throttle:
+    # Hands out send times, so every connection gets at most connection_rate and all of them link_rate bytes/s
+
+    def __init__(self, connection_rate: float | None, link_rate: float | None):
+        self.connection_rate = connection_rate
+        self.link_rate = link_rate
+        self.lock = threading.Lock()
+        self.link_free_at = 0.0
+
+    def send(self, write, payload: bytes):
+        connection_free_at = time.monotonic()
+        for offset in range(0, len(payload), CHUNK_SIZE):
+            chunk = payload[offset:offset + CHUNK_SIZE]
+            start = max(time.monotonic(), connection_free_at)
+            if self.link_rate:
+                with self.lock:
+                    start = max(start, self.link_free_at)
+                    self.link_free_at = start + len(chunk) / self.link_rate
+            if self.connection_rate:
+                connection_free_at = start + len(chunk) / self.connection_rate
+            time.sleep(max(0.0, start - time.monotonic()))
+            write(chunk)
+
+
+class SyntheticHLSServer(ThreadingHTTPServer):
+    # /video_0000/master.m3u8 -> /video_0000/<variant>/playlist.m3u8 -> /video_0000/<variant>/segment_00000.ts
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, videos: int = 100, segments: int = 20, segment_size: int = 256 * 1024,
+                 latency: float = 0.0, bandwidth: float | None = None, link_bandwidth: float | None = None):
+        super().__init__(("127.0.0.1", port), SyntheticHLSHandler)
+        self.videos = videos
+        self.segments = segments
+        self.segment = (TS_PACKET * (segment_size // len(TS_PACKET) + 1))[:segment_size]
+        self.latency = latency  # Seconds before every response, like a round trip to a far away CDN node
+        self.throttle = Throttle(bandwidth, link_bandwidth)
+        self.requests = 0
+        self.sent_bytes = 0
+        self.statistics_lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def playlist_url(self, video: int) -> str:
+        return f"{self.url}/video_{video:04d}/master.m3u8"
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def master_playlist(self) -> bytes:
+        playlist = "#EXTM3U\n"
+        for name, (width, height, bandwidth) in VARIANTS.items():
+            playlist += f"#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION={width}x{height}\n{name}/playlist.m3u8\n"
+        return playlist.encode()
+
+    def media_playlist(self) -> bytes:
+        playlist = f"#EXTM3U\n#EXT-X-TARGETDURATION:{SEGMENT_DURATION:.0f}\n#EXT-X-VERSION:3\n"
+        playlist += "".join(f"#EXTINF:{SEGMENT_DURATION:.3f},\nsegment_{index:05d}.ts\n"
+                            for index in range(self.segments))
+        return (playlist + "#EXT-X-ENDLIST\n").encode()
+
+
+class SyntheticHLSHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like a real CDN
+    server: SyntheticHLSServer
+
+    def body(self) -> bytes | None:
+        match = re.fullmatch(r"/video_(\d+)/(?:(\w+)/)?([\w.]+)", self.path.split('?', 1)[0])
+        if not match or int(match.group(1)) >= self.server.videos:
+            return None
+        variant, name = match.group(2), match.group(3)
+        if variant is None:
+            return self.server.master_playlist() if name == "master.m3u8" else None
+        if variant not in VARIANTS:
+            return None
+        if name == "playlist.m3u8":
+            return self.server.media_playlist()
+        segment = re.fullmatch(r"segment_(\d+)\.ts", name)
+        if segment and int(segment.group(1)) < self.server.segments:
+            return self.server.segment
+        return None
+
+    def respond(self, send_body: bool):
+        time.sleep(self.server.latency)
+        body = self.body()
+        with self.server.statistics_lock:
+            self.server.requests += 1
+        if body is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.server.throttle.send(self.wfile.write, body)
+            with self.server.statistics_lock:
+                self.server.sent_bytes += len(body)
+
+    def do_GET(self):
+        self.respond(send_body=True)
+
+    def do_HEAD(self):
+        self.respond(send_body=False)
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve synthetic HLS videos")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--videos", type=int, default=100)
+    parser.add_argument("--segments", type=int, default=20, help="Segments per video")
+    parser.add_argument("--segment_size", type=int, default=256 * 1024, help="Bytes per segment")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds before every response")
+    parser.add_argument("--bandwidth", type=float, help="Bytes per second per connection")
+    parser.add_argument("--link_bandwidth", type=float, help="Bytes per second of all connections together")
+    args = parser.parse_args()
+
+    server = SyntheticHLSServer(args.port, args.videos, args.segments, args.segment_size,
+                                args.latency, args.bandwidth, args.link_bandwidth)
+    print(f"Serving {args.videos} videos, e.g. {server.playlist_url(0)}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
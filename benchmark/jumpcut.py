@@ -0,0 +1,76 @@
+# Compares the built-in jump-cut engine with auto-editor on synthetic tone/silence clips
+# Usage: python benchmark/jumpcut.py [--minutes 10] [--keep]
+import argparse
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+import jumpcut  # noqa: E402
+
+
+def synthetic_clip(path: Path, minutes: float, speech_seconds: int, pause_seconds: int):
+    # A test pattern with a tone for speech_seconds, followed by pause_seconds of silence, repeated
+    period = speech_seconds + pause_seconds
+    subprocess.run([
+        'ffmpeg', '-y',
+        '-f', 'lavfi', '-i', f'testsrc2=r=25:d={minutes * 60}:s=1280x720',
+        '-f', 'lavfi', '-i', f'aevalsrc=0.5*sin(440*2*PI*t)*lt(mod(t\\,{period})\\,{speech_seconds})'
+                             f':s=48000:d={minutes * 60}',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-c:a', 'aac', '-shortest',
+        path
+    ], capture_output=True, check=True)
+
+
+def duration(path: Path) -> float:
+    ffprobe = subprocess.run(['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', path],
+                             capture_output=True, check=True)
+    return float(ffprobe.stdout)
+
+
+def run_native(clip: Path, output: Path) -> float:
+    start_time = time.time()
+    if jumpcut.cut(clip, output, 0.04, 0.2, 8).returncode != 0:
+        raise RuntimeError("The native engine failed")
+    return time.time() - start_time
+
+
+def run_auto_editor(clip: Path, output: Path) -> float:
+    start_time = time.time()
+    subprocess.run(['auto-editor', clip, '--silent_speed', '8', '--video_codec', 'h264',
+                    '--video-bitrate', 'unset', '--no_open', '-o', output], capture_output=True, check=True)
+    return time.time() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the jump-cut engines")
+    parser.add_argument("--minutes", type=float, default=10, help="Length of the synthetic clips")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated files")
+    args = parser.parse_args()
+
+    work_directory = Path(tempfile.mkdtemp(prefix="jumpcut_benchmark_"))
+    engines = {"native": run_native}
+    if shutil.which("auto-editor"):
+        engines["auto-editor"] = run_auto_editor
+    try:
+        for speech_seconds, pause_seconds in [(20, 5), (5, 5), (2, 8)]:
+            clip = Path(work_directory, f"clip_{speech_seconds}_{pause_seconds}.mp4")
+            synthetic_clip(clip, args.minutes, speech_seconds, pause_seconds)
+            for engine, run in engines.items():
+                output = Path(work_directory, f"clip_{speech_seconds}_{pause_seconds}_{engine}_jc.mp4")
+                seconds = run(clip, output)
+                print(f"{engine:>12} | speech {speech_seconds:>2}s pause {pause_seconds:>2}s | "
+                      f"{seconds:6.1f}s | {duration(clip) / seconds:5.1f}x realtime | "
+                      f"{duration(output):7.1f}s of {duration(clip):.0f}s left | "
+                      f"{output.stat().st_size / 1e6:6.1f} MB")
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+# Runs the download and jump-cut pipeline against a local synthetic HLS server, with stubs for ffmpeg and auto-editor
+# Reports videos/hour, peak RSS, process count and the temp-disk high-water mark of each scenario,
+# so changes to the scheduler, the downloader or the worker counts can be compared with each other (Linux only)
+# Usage: python benchmark/pipeline.py [--videos 200] [--downloads 3] [--latency 0.02] [--bandwidth 4e6] [--keep]
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing import Process, Value
+from pathlib import Path
+
+import yaml
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import concurrency  # noqa: E402
+import downloader  # noqa: E402
+import main as scraper  # noqa: E402
+from browser_pool import process_tree, resident_bytes  # noqa: E402
+from concurrency import ConcurrencyLimit  # noqa: E402
+from disk_budget import DiskBudget  # noqa: E402
+from hls_server import SyntheticHLSServer  # noqa: E402
+from scheduler import Scheduler  # noqa: E402
+
+STUBS = Path(__file__).resolve().parent / "stubs"
+SAMPLE_INTERVAL = 0.2  # Seconds between two samples of the process tree and the temp folder
+
+
+def synthetic_videos(server: SyntheticHLSServer, videos: int, subjects: int) -> [(str, str, str, str)]:
+    # (subject_name, episode_name, playlist_m3u8_URL, video_id), like the scrapers yield them
+    per_subject = -(-videos // subjects)
+    return [(f"Subject {video // per_subject:02d}", f"{video % per_subject:03d}_Lecture {video % per_subject}",
+             server.playlist_url(video), server.playlist_url(video)) for video in range(videos)]
+
+
+def run_download_list(args: argparse.Namespace, videos: [(str, str, str, str)], work_directory: Path):
+    # Drives downloader.download_list_of_videos with the schedulers set up like main() does it
+    output_folder, tmp_folder = Path(work_directory, "output"), Path(work_directory, "tmp")
+    settings = downloader.DownloadSettings(tmp_directory=tmp_folder,
+                                           keep_original=not args.no_keep, jump_cut=not args.no_jump_cut,
+                                           download_mode=args.download_mode, segment_workers=args.segment_workers,
+                                           run_start_time=time.time(), first_byte_time=Value('d', 0.0),
+                                           jumpcut_engine="auto-editor", silent_threshold=0.04, silent_speed=8,
+                                           jumpcut_margin=0.2, jumpcut_chunks=1, copied_bytes=Value('q', 0),
+                                           disk_budget=DiskBudget([tmp_folder, output_folder], 0),
+                                           retry_attempts=1, downloaded_bytes=Value('q', 0), stall_timeout=300)
+    conversions = Scheduler(args.conversions, downloader.cut_video, settings) if not args.no_jump_cut else None
+    download_limit = ConcurrencyLimit(args.minimum_downloads) if args.minimum_downloads else None
+    scheduler = Scheduler(args.downloads, downloader.download, settings, next_stage=conversions,
+                          concurrency_limit=download_limit)
+    if download_limit:
+        concurrency.adapt(download_limit, settings.downloaded_bytes, args.minimum_downloads, args.downloads)
+    try:
+        for subject, filename, playlist_url, video_id in videos:
+            subject_folder = Path(output_folder, subject)
+            subject_folder.mkdir(exist_ok=True)
+            downloader.download_list_of_videos([(filename, playlist_url, video_id)], subject_folder, scheduler)
+    finally:
+        scheduler.shutdown()
+        if conversions:
+            conversions.shutdown()
+
+
+def run_main(args: argparse.Namespace, videos: [(str, str, str, str)], work_directory: Path):
+    # Drives main() with a config file, only the scrapers are replaced by the synthetic videos
+    config = {
+        "Output-Folder": str(Path(work_directory, "output")),
+        "Temp-Dir": str(Path(work_directory, "tmp")),
+        "Keep-Original-File": not args.no_keep,
+        "Jumpcut": not args.no_jump_cut,
+        "Maximum-Parallel-Downloads": args.downloads,
+        "Maximum-Parallel-Conversions": args.conversions,
+        "Download-Mode": args.download_mode,
+        "Segment-Workers": args.segment_workers,
+        "Retry-Attempts": 1,
+        "Disk-Headroom": 0,
+        "Catalog-TTL": 0,
+        "Metrics-File": str(Path(work_directory, "metrics.jsonl")),
+    }
+    if args.minimum_downloads:
+        config["Minimum-Parallel-Downloads"] = args.minimum_downloads
+    config_path = Path(work_directory, "config.yml")
+    config_path.write_text(yaml.safe_dump(config))
+    scraper.scrape = lambda *_: iter(videos)
+    sys.argv = ["main.py", "-c", str(config_path)]
+    scraper.main()
+
+
+SCENARIOS = {"download_list": run_download_list, "main": run_main}
+
+
+def _scenario(run, args: argparse.Namespace, videos: [(str, str, str, str)], work_directory: Path):
+    sys.stdout = open(Path(work_directory, "log.txt"), 'w', buffering=1)  # The pipeline talks a lot
+    sys.stderr = sys.stdout
+    run(args, videos, work_directory)
+
+
+def directory_bytes(directory: Path) -> int:
+    size = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            try:
+                size += os.stat(Path(root, name)).st_size
+            except OSError:
+                pass  # Renamed or removed in the meantime
+    return size
+
+
+class Sampler:
+    # Samples the peaks of a running scenario: RSS of its process tree, number of processes, size of the temp folder
+
+    def __init__(self, root: int, tmp_folder: Path):
+        self.root = root
+        self.tmp_folder = tmp_folder
+        self.peak_rss = self.peak_processes = self.peak_tmp_bytes = 0
+        self.finished = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+
+    def sample(self):
+        while not self.finished.wait(SAMPLE_INTERVAL):
+            tree = process_tree(self.root)
+            self.peak_rss = max(self.peak_rss, sum(resident_bytes(pid) for pid in tree))
+            self.peak_processes = max(self.peak_processes, len(tree))
+            self.peak_tmp_bytes = max(self.peak_tmp_bytes, directory_bytes(self.tmp_folder))
+
+    def stop(self):
+        self.finished.set()
+        self.thread.join()
+
+
+def completed_videos(output_folder: Path, jump_cut: bool) -> int:
+    if jump_cut:
+        return len(list(output_folder.glob("*/*_jc.mp4")))
+    return len([path for path in output_folder.glob("*/*.mp4") if not path.name.startswith('.')])
+
+
+def run_scenario(name: str, args: argparse.Namespace, server: SyntheticHLSServer, work_directory: Path):
+    Path(work_directory, "output").mkdir(parents=True)
+    Path(work_directory, "tmp").mkdir()
+    videos = synthetic_videos(server, args.videos, args.subjects)
+    served_bytes = server.sent_bytes
+
+    start_time = time.time()
+    scenario = Process(target=_scenario, args=(SCENARIOS[name], args, videos, work_directory))
+    scenario.start()
+    sampler = Sampler(scenario.pid, Path(work_directory, "tmp"))
+    scenario.join()
+    sampler.stop()
+    seconds = time.time() - start_time
+
+    completed = completed_videos(Path(work_directory, "output"), not args.no_jump_cut)
+    print(f"{name:>13} | {completed:>4}/{args.videos} videos | {seconds:7.1f}s | "
+          f"{completed / seconds * 3600:8.0f} videos/h | "
+          f"{(server.sent_bytes - served_bytes) / seconds / 1e6:6.1f} MB/s | "
+          f"peak RSS {sampler.peak_rss / 1e6:7.1f} MB | {sampler.peak_processes:>3} processes | "
+          f"temp high-water {sampler.peak_tmp_bytes / 1e6:7.1f} MB")
+    if scenario.exitcode != 0 or completed != args.videos:
+        print(f"{'':>13} | see {Path(work_directory, 'log.txt')} for what went wrong")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the download and jump-cut pipeline offline")
+    parser.add_argument("--scenario", choices=[*SCENARIOS, "all"], default="all")
+    parser.add_argument("--videos", type=int, default=200)
+    parser.add_argument("--subjects", type=int, default=10, help="Subject folders the videos are spread across")
+    parser.add_argument("--segments", type=int, default=10, help="Segments per video")
+    parser.add_argument("--segment_size", type=int, default=256 * 1024, help="Bytes per segment")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds before every response of the server")
+    parser.add_argument("--bandwidth", type=float, help="Bytes per second per connection")
+    parser.add_argument("--link_bandwidth", type=float, help="Bytes per second of all connections together")
+    parser.add_argument("--downloads", type=int, default=3, help="Maximum-Parallel-Downloads")
+    parser.add_argument("--minimum_downloads", type=int, help="Minimum-Parallel-Downloads (adaptive)")
+    parser.add_argument("--conversions", type=int, default=2, help="Maximum-Parallel-Conversions")
+    parser.add_argument("--download_mode", choices=["native", "ffmpeg"], default="native")
+    parser.add_argument("--segment_workers", type=int, default=8)
+    parser.add_argument("--cut_seconds", type=float, default=0.0, help="Seconds every stub conversion takes")
+    parser.add_argument("--no_keep", action="store_true", help="Don't keep the original files")
+    parser.add_argument("--no_jump_cut", action="store_true", help="Only download")
+    parser.add_argument("--real_tools", action="store_true", help="Use the installed ffmpeg and auto-editor")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated files")
+    args = parser.parse_args()
+
+    if not args.real_tools:
+        os.environ["PATH"] = f"{STUBS}{os.pathsep}{os.environ['PATH']}"
+        os.environ["STUB_AUTO_EDITOR_SECONDS"] = str(args.cut_seconds)
+    server = SyntheticHLSServer(0, args.videos, args.segments, args.segment_size,
+                                args.latency, args.bandwidth, args.link_bandwidth)
+    server.start()
+    work_directory = Path(tempfile.mkdtemp(prefix="pipeline_benchmark_"))
+    try:
+        for name in SCENARIOS if args.scenario == "all" else [args.scenario]:
+            run_scenario(name, args, server, Path(work_directory, name))
+    finally:
+        server.shutdown()
+        if args.keep:
+            print(f"Files are kept in {work_directory}")
+        else:
+            shutil.rmtree(work_directory)
+
+
+if __name__ == '__main__':
+    main()
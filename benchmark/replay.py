@@ -0,0 +1,310 @@
+# Replays recorded TUM-live and Panopto pages from a local server, so the real scrapers can be profiled offline
+# record:  logs in once, runs the scrapers for the given subjects and saves every page and DeliveryInfo they look at
+#          (as rendered by the browser, without scripts - a recording contains your course pages, don't publish it)
+# serve:   serves a recording, e.g. for TUM_LIVE_BASE_URL / PANOPTO_BASE_URL
+# profile: runs the scrapers against a recording and prints where their time goes, by function and WebDriver call,
+#          and the memory of the browser (--full_browser to compare with images, media and fonts loaded)
+# Usage: python benchmark/replay.py record RECORDING -u go42tum [--tum_live "Name:2025/W/slug:COMB"] [--panopto Name:ID]
+#        python benchmark/replay.py profile RECORDING [--latency 0.05] [--scrape_mode http]
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import browser_pool  # noqa: E402
+import panopto  # noqa: E402
+import profiling  # noqa: E402
+import tum_live  # noqa: E402
+import util  # noqa: E402
+from browser_pool import BrowserPool  # noqa: E402
+from pipeline import Sampler  # noqa: E402
+
+INDEX = "pages.json"  # {"origins": [...], "tum_live": {name: [identifier, camera]}, "panopto": {name: folder_id},
+#                        "pages": {"GET /path?query#fragment": file}}
+CONTENT_TYPES = {".html": "text/html; charset=utf-8", ".json": "application/json", ".txt": "text/plain"}
+SNAPSHOT_SCRIPT = """
+const page = document.documentElement.cloneNode(true);
+page.querySelectorAll('script, noscript, iframe, link[rel=stylesheet]').forEach(element => element.remove());
+return '<!DOCTYPE html>' + page.outerHTML;
+"""
+# The browser doesn't send the fragment (Panopto's #folderID=...), so these pages load their recording themselves,
+# on a hashchange as well, as navigating to another fragment of the same page doesn't reload it
+LOADER_PAGE = """<!DOCTYPE html><html><head><title></title><script>
+async function load() {
+    const key = 'GET ' + location.pathname + location.search + location.hash;
+    const response = await fetch('/__replay__?key=' + encodeURIComponent(key));
+    const page = new DOMParser().parseFromString(await response.text(), 'text/html');
+    document.documentElement.innerHTML = page.documentElement.innerHTML;
+}
+window.addEventListener('hashchange', load);
+load();
+</script></head><body></body></html>"""
+
+
+def page_key(method: str, url: str) -> str:
+    parts = urlsplit(url)
+    return f"{method} {parts.path or '/'}" + (f"?{parts.query}" if parts.query else "") + \
+        (f"#{parts.fragment}" if parts.fragment else "")
+
+
+class ReplayServer(ThreadingHTTPServer):
+    # Serves the pages of a recording with the recorded origins replaced by its own
+    daemon_threads = True
+
+    def __init__(self, recording: Path, port: int = 0, latency: float = 0.0):
+        super().__init__(("127.0.0.1", port), ReplayHandler)
+        self.recording = recording
+        index = json.loads(Path(recording, INDEX).read_text())
+        self.origins = index["origins"]
+        self.pages = index["pages"]
+        self.latency = latency  # Seconds before every response, like the round trip to the real servers
+        self.requests = 0
+        self.missing: [str] = []  # Requests the recording has no answer for
+        self.statistics_lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def page(self, key: str) -> tuple[bytes, str] | None:
+        # (body, content type) of a recorded page, None if it wasn't recorded
+        if key in self.pages:
+            path = Path(self.recording, self.pages[key])
+            body = path.read_bytes()
+            for origin in self.origins:
+                body = body.replace(origin.encode(), self.url.encode())
+            return body, CONTENT_TYPES.get(path.suffix, "application/octet-stream")
+        if any(recorded.startswith(key + "#") for recorded in self.pages):
+            return LOADER_PAGE.encode(), CONTENT_TYPES[".html"]
+        return None
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: ReplayServer
+
+    def respond(self, method: str):
+        time.sleep(self.server.latency)
+        if self.command == "POST":
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        parts = urlsplit(self.path)
+        if parts.path == "/__replay__":
+            key = parse_qs(parts.query).get("key", [""])[0]
+        else:
+            key = page_key(method, self.path)
+        page = self.server.page(key)
+        with self.server.statistics_lock:
+            self.server.requests += 1
+            if page is None:
+                self.server.missing.append(key)
+        if page is None:
+            self.send_error(404)
+            return
+        body, content_type = page
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.respond("GET")
+
+    def do_POST(self):
+        self.respond("POST")
+
+    def log_message(self, *args):
+        pass
+
+
+class Recorder:
+    # Stands in for the logged-in driver and saves every page it shows before it navigates away,
+    # and the responses of the DeliveryInfo requests made for it
+
+    def __init__(self, recording: Path):
+        recording.mkdir(parents=True, exist_ok=True)
+        self.recording = recording
+        self.driver = None
+        self.origins = [tum_live.BASE_URL, panopto.BASE_URL]
+        self.pages: dict[str, str] = {}
+        self.lock = threading.Lock()  # DeliveryInfo requests are sent from several threads
+
+    def save(self, key: str, body: str, suffix: str):
+        with self.lock:
+            name = self.pages.setdefault(key, f"{len(self.pages):05d}{suffix}")
+        Path(self.recording, name).write_text(body)
+
+    def snapshot(self):
+        # The page as the browser rendered it, so it can be replayed without its scripts and their APIs
+        url = self.driver.current_url
+        if any(url.startswith(origin) for origin in self.origins):
+            self.save(page_key("GET", url), self.driver.execute_script(SNAPSHOT_SCRIPT), ".html")
+
+    def get(self, url: str):
+        self.snapshot()
+        self.driver.get(url)
+
+    def request(self, method: str, url: str, **kwargs):
+        response = self.driver.request(method, url, **kwargs)
+        self.save(page_key(method, url), response.text, ".json")
+        return response
+
+    def record_session(self, session):
+        # DeliveryInfo requests are sent by a requests session in HTTP mode
+        post = session.post
+
+        def recording_post(url: str, *args, **kwargs):
+            response = post(url, *args, **kwargs)
+            self.save(page_key("POST", url), response.text, ".json")
+            return response
+
+        session.post = recording_post
+
+    def __getattr__(self, name: str):
+        return getattr(self.driver, name)
+
+    def write_index(self, tum_live_subjects: dict[str, (str, str)], panopto_folders: dict[str, str]):
+        Path(self.recording, INDEX).write_text(json.dumps({"origins": self.origins, "tum_live": tum_live_subjects,
+                                                           "panopto": panopto_folders, "pages": self.pages},
+                                                          indent=2))
+
+
+def record(recording: Path, tum_live_subjects: dict[str, (str, str)], panopto_folders: dict[str, str],
+           username: str, password: str):
+    # The login itself isn't recorded, the SSO pages of login.tum.de can't be replayed sensibly
+    recorder = Recorder(recording)
+    if tum_live_subjects:
+        recorder.driver = tum_live.login(username, password)
+        try:
+            for subject_name, (identifier, camera_type) in tum_live_subjects.items():
+                videos = list(tum_live.get_video_links_of_subject(recorder, identifier, camera_type))
+                recorder.snapshot()
+                print(f'Recorded {len(videos)} videos of "{subject_name}"')
+        finally:
+            recorder.driver.quit()
+    if panopto_folders:
+        recorder.driver = panopto.login(username, password)
+        session = util.session_from_driver(recorder.driver, panopto.HTTP_WORKERS)
+        recorder.record_session(session)
+        try:
+            for subject_name, folder_id in panopto_folders.items():
+                videos = list(panopto.get_video_links_in_folder(recorder, folder_id, session))
+                recorder.snapshot()
+                print(f'Recorded {len(videos)} videos of "{subject_name}"')
+        finally:
+            session.close()
+            recorder.driver.quit()
+    recorder.write_index(tum_live_subjects, panopto_folders)
+
+
+def profile(recording: Path, latency: float = 0.0, scrape_mode: str = "browser",
+            scrape_workers: int = 1) -> dict[str, list]:
+    # Runs the scrapers for all recorded subjects against a replay server, like a run with Scrape-Workers does it
+    # Returns the videos found per subject
+    index = json.loads(Path(recording, INDEX).read_text())
+    server = ReplayServer(recording, latency=latency)
+    server.start()
+    tum_live.BASE_URL = panopto.BASE_URL = server.url
+    profiling.enable()
+    profiling.reset()
+    from seleniumrequests import Firefox  # driver.request() for Panopto's DeliveryInfo fallback
+
+    def open_browser():
+        return profiling.profiled(Firefox(options=util.firefox_options()))
+
+    def scrape_subject(driver, subject_name: str, subject: (str, str)):
+        identifier, camera_type = subject
+        return tum_live.get_video_links_of_subject(driver, identifier, camera_type,
+                                                   session=session if scrape_mode == "http" else None)
+
+    def scrape_folder(driver, subject_name: str, folder_id: str):
+        return panopto.get_video_links_in_folder(driver, folder_id, session)
+
+    sampler = Sampler(os.getpid(), recording)  # All geckodriver and Firefox processes are ours
+    session = requests.Session()  # No login to share
+    scrapers = []
+    if index["tum_live"]:
+        pool = BrowserPool("tum_live", open_browser(), open_browser, scrape_workers)
+        scrapers.append(pool.scrape(index["tum_live"], scrape_subject))
+    if index["panopto"]:
+        pool = BrowserPool("panopto", open_browser(), open_browser, scrape_workers)
+        scrapers.append(pool.scrape(index["panopto"], scrape_folder))
+    videos = {}
+    start = time.perf_counter()
+    try:
+        for subject_name, *video in browser_pool.merge(scrapers):
+            videos.setdefault(subject_name, []).append(tuple(video))
+    finally:
+        sampler.stop()
+        session.close()
+        server.shutdown()
+        server.server_close()
+    print(f"{sum(map(len, videos.values()))} videos of {len(index['tum_live']) + len(index['panopto'])} subjects "
+          f"in {time.perf_counter() - start:.1f}s with up to {scrape_workers} browser(s) per platform")
+    print(f"Peak memory (PSS) of the browsers and the scrapers: {sampler.peak_rss / 1e6:.0f} MB "
+          f"in {sampler.peak_processes} processes")
+    if server.missing:
+        print(f"Not in the recording: {', '.join(sorted(set(server.missing)))}", file=sys.stderr)
+    return videos
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record and replay the pages the scrapers visit")
+    commands = parser.add_subparsers(dest="command", required=True)
+    record_parser = commands.add_parser("record", help="Record the pages of the given subjects")
+    record_parser.add_argument("recording", type=Path)
+    record_parser.add_argument("--tum_live", action="append", default=[], help="subject_name:identifier:camera")
+    record_parser.add_argument("--panopto", action="append", default=[], help="subject_name:panopto_folder_id")
+    record_parser.add_argument("-u", "--username", required=True)
+    record_parser.add_argument("-p", "--password")
+    serve_parser = commands.add_parser("serve", help="Serve a recording")
+    serve_parser.add_argument("recording", type=Path)
+    serve_parser.add_argument("--port", type=int, default=8000)
+    serve_parser.add_argument("--latency", type=float, default=0.0, help="Seconds before every response")
+    profile_parser = commands.add_parser("profile", help="Profile the scrapers against a recording")
+    profile_parser.add_argument("recording", type=Path)
+    profile_parser.add_argument("--latency", type=float, default=0.0, help="Seconds before every response")
+    profile_parser.add_argument("--scrape_mode", choices=["browser", "http"], default="browser")
+    profile_parser.add_argument("--scrape_workers", type=int, default=1, help="Browsers per platform")
+    profile_parser.add_argument("--full_browser", action="store_true",
+                                help="Load images, media and fonts, like LEAN_BROWSER=0")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        import main as scraper
+        tum_live_subjects = {}
+        for subject in args.tum_live:
+            subject_name, identifier, camera_type = scraper.parse_tum_live_subject(subject)
+            tum_live_subjects[subject_name] = (identifier, camera_type)
+        panopto_folders = dict(scraper.parse_tum_panopto_folder(folder) for folder in args.panopto)
+        password = args.password or input("Please enter your TUM-Password (must fit to the TUM-Username):\n")
+        record(args.recording, tum_live_subjects, panopto_folders, args.username, password)
+    elif args.command == "serve":
+        server = ReplayServer(args.recording, args.port, args.latency)
+        print(f"Serving {args.recording} on {server.url}, "
+              f"run with TUM_LIVE_BASE_URL={server.url} and PANOPTO_BASE_URL={server.url}")
+        server.serve_forever()
+    else:
+        if args.full_browser:
+            os.environ["LEAN_BROWSER"] = "0"
+        profile(args.recording, args.latency, args.scrape_mode, args.scrape_workers)
+        print(profiling.summary())
+
+
+if __name__ == '__main__':
+    main()
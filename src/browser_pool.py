@@ -0,0 +1,202 @@
+"""Scrapes several subjects of a platform at once, each with a browser of its own, and both platforms at once.
+
+The browsers of a platform share the cookies of a single login and stay open until the pool is closed,
+a browser that grows beyond its memory limit is replaced by a fresh one between two subjects.
+"""
+import os
+import queue
+import threading
+from typing import Callable, Iterator, TypeVar
+
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.remote.webdriver import WebDriver
+
+import metrics
+import util
+
+Subject = TypeVar('Subject')
+_FINISHED = object()  # An iterator of merge() is exhausted
+
+
+def _consume(iterator: Iterator, items: queue.SimpleQueue, closed: threading.Event):
+    # Runs in a thread of its own, hands the items and the error of the iterator over to merge()
+    try:
+        for item in iterator:
+            if closed.is_set():
+                break
+            items.put((item, None))
+    except BaseException as error:
+        items.put((None, error))
+    finally:
+        if hasattr(iterator, "close"):
+            iterator.close()  # In this thread, a generator can only be closed by the one running it
+        items.put((_FINISHED, None))
+
+
+def _next_item(items: queue.SimpleQueue):
+    # The next item of any iterator, or _FINISHED, an error of an iterator is raised
+    item, error = items.get()
+    if error is not None:
+        raise error
+    return item
+
+
+def merge(iterators: [Iterator], on_close: Callable[[], None] | None = None) -> Iterator:
+    # Yields the items of all iterators as they are produced, each iterator is consumed by a thread of its own
+    # An error of one of them is raised here, on_close is called if we are closed before they are exhausted
+    items = queue.SimpleQueue()
+    closed = threading.Event()
+    threads = [threading.Thread(target=_consume, args=(iterator, items, closed), daemon=True)
+               for iterator in iterators]
+    for thread in threads:
+        thread.start()
+    running = len(threads)
+    try:
+        while running:
+            item = _next_item(items)
+            if item is _FINISHED:
+                running -= 1
+            else:
+                yield item
+    finally:
+        if running:
+            closed.set()
+            if on_close:
+                on_close()  # E.g. quits the browsers, so the threads don't finish their subjects first
+        for thread in threads:
+            thread.join()
+
+
+def process_tree(root: int) -> [int]:
+    # The root and all of its descendants, from the parent PIDs in /proc/<pid>/stat
+    children: dict[int, list[int]] = {}
+    for entry in os.scandir("/proc"):
+        if entry.name.isdigit():
+            try:
+                with open(f"/proc/{entry.name}/stat") as stat:
+                    parent = int(stat.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue  # Exited in the meantime
+            children.setdefault(parent, []).append(int(entry.name))
+    tree, pending = [], [root]
+    while pending:
+        pid = pending.pop()
+        tree.append(pid)
+        pending += children.get(pid, [])
+    return tree
+
+
+def resident_bytes(pid: int) -> int:
+    # The proportional set size, so the pages forked processes share with their parent are only counted once
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as smaps:
+            return next(int(line.split()[1]) * 1024 for line in smaps if line.startswith("Pss:"))
+    except (OSError, StopIteration, IndexError, ValueError):
+        pass  # Kernels before 4.14
+    try:
+        with open(f"/proc/{pid}/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+def browser_memory(driver: webdriver) -> int:
+    # Bytes used by geckodriver and the browser processes below it, 0 where we can't tell (no /proc)
+    if not os.path.isdir("/proc"):
+        return 0
+    try:
+        return sum(resident_bytes(pid) for pid in process_tree(driver.service.process.pid))
+    except AttributeError:
+        return 0  # Not started by us
+
+
+def quit_browser(driver: webdriver):
+    try:
+        driver.quit()
+    except WebDriverException:
+        pass  # Already gone
+
+
+class BrowserPool:
+    # Browsers of one platform: the logged-in one, and more that are opened with its cookies as they are needed
+
+    def __init__(self, site: str, driver: webdriver, open_browser: Callable[[], WebDriver], size: int,
+                 memory_limit: int | None = None):
+        self.site = site
+        self.open_browser = open_browser
+        self.size = size
+        self.memory_limit = memory_limit  # Bytes, None: unlimited
+        self.browsers = [driver]  # All that are open
+        self.idle = [driver]  # Those not scraping a subject right now
+        self.lock = threading.Lock()
+
+    def _open(self) -> webdriver:
+        driver = self.open_browser()
+        with self.lock:
+            self.browsers.append(driver)
+        return driver
+
+    def _quit(self, driver: webdriver):
+        with self.lock:
+            if driver not in self.browsers:
+                return
+            self.browsers.remove(driver)
+        quit_browser(driver)
+
+    def _check_out(self) -> webdriver:
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+        return self._open()
+
+    def _check_in(self, driver: webdriver):
+        with self.lock:
+            if driver in self.browsers:  # Not quit by close() in the meantime
+                self.idle.append(driver)
+
+    def _replace_if_too_big(self, driver: webdriver) -> webdriver:
+        if not self.memory_limit:
+            return driver
+        memory = browser_memory(driver)
+        metrics.gauge("browser_memory_bytes", memory, site=self.site)
+        if memory <= self.memory_limit:
+            return driver
+        print(f"Restarting a {self.site} browser, it uses {memory / 1e6:.0f} MB")
+        metrics.count("browser_restarts_total", site=self.site)
+        self._quit(driver)
+        return self._open()
+
+    def _work(self, subjects: queue.SimpleQueue,
+              scrape_subject: Callable[[WebDriver, str, Subject], Iterator[tuple]]) -> Iterator[tuple]:
+        driver = self._check_out()
+        try:
+            while True:
+                try:
+                    subject_name, subject = subjects.get_nowait()
+                except queue.Empty:
+                    return
+                video_count = 0
+                for video_count, video in enumerate(util.enumerate_stream(
+                        scrape_subject(driver, subject_name, subject)), 1):
+                    yield subject_name, *video
+                print(f'Found {video_count} videos for "{subject_name}"')
+                driver = self._replace_if_too_big(driver)
+        finally:
+            self._check_in(driver)
+
+    def scrape(self, subjects: dict[str, Subject],
+               scrape_subject: Callable[[WebDriver, str, Subject], Iterator[tuple]]) -> Iterator[tuple]:
+        # Yields (subject_name, *video) with the videos of every subject numbered in the order they were found
+        # scrape_subject(driver, subject_name, subject) yields the videos of a subject
+        pending = queue.SimpleQueue()
+        for subject in subjects.items():
+            pending.put(subject)
+        workers = min(self.size, len(subjects))
+        yield from merge([self._work(pending, scrape_subject) for _ in range(workers)], on_close=self.close)
+
+    def close(self):
+        with self.lock:
+            browsers, self.browsers, self.idle = self.browsers, [], []
+        for driver in browsers:
+            quit_browser(driver)
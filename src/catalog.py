@@ -0,0 +1,86 @@
+import base64
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+TOKEN_MARGIN = 3600  # Seconds a cached playlist URL must stay valid for, so a queued download can still use it
+LOCK_TIMEOUT = 5  # Seconds a lookup or store waits for another process to release the database
+
+
+def token_expiry(playlist_url: str) -> float | None:
+    # The exp claim of the jwt TUM-live appends to its playlist URLs, None if there is none we can read
+    token = parse_qs(urlsplit(playlist_url).query).get("jwt", [""])[0]
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return float(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def discard(path: Path, playlist_url: str):
+    # Drops the videos with this playlist URL, e.g. after its download failed because the token expired early
+    # Called by the download workers, which don't share the connection of the scrapers
+    connection = sqlite3.connect(path, timeout=30)
+    try:
+        with connection:
+            connection.execute("DELETE FROM videos WHERE playlist_url = ?", (playlist_url,))
+    except sqlite3.OperationalError:
+        pass  # Still locked by the scrapers after the timeout, the entry expires with its TTL then
+    finally:
+        connection.close()
+
+
+class Catalog:
+    # On-disk cache of resolved watch pages, so unchanged lectures don't have to be visited on every run
+    # Entries are keyed by (subject, watch URL) and expire after a TTL, as playlist URLs carry expiring tokens
+    # An entry whose token expires within TOKEN_MARGIN is ignored before that
+
+    def __init__(self, path: Path, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        # Used by the scraper threads of all browsers, one at a time
+        self.connection = sqlite3.connect(path, timeout=LOCK_TIMEOUT, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS videos (
+                subject TEXT NOT NULL,
+                watch_url TEXT NOT NULL,
+                title TEXT NOT NULL,
+                playlist_url TEXT NOT NULL,
+                resolved_at REAL NOT NULL,
+                PRIMARY KEY (subject, watch_url)
+            )""")
+        self.connection.commit()
+
+    def lookup(self, subject: str, watch_url: str) -> tuple[str, str] | None:
+        # Returns (title, playlist_url) if the watch page was resolved recently enough
+        try:
+            with self.lock:
+                row = self.connection.execute(
+                    "SELECT title, playlist_url FROM videos WHERE subject = ? AND watch_url = ? AND resolved_at > ?",
+                    (subject, watch_url, time.time() - self.ttl_seconds)).fetchone()
+        except sqlite3.OperationalError:
+            return None  # Locked by another process, the watch page is visited instead
+        if not row:
+            return None
+        expiry = token_expiry(row[1])
+        if expiry is not None and expiry < time.time() + TOKEN_MARGIN:
+            return None  # The watch page hands out a fresh token
+        return tuple(row)
+
+    def store(self, subject: str, watch_url: str, title: str, playlist_url: str):
+        try:
+            with self.lock, self.connection:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO videos (subject, watch_url, title, playlist_url, resolved_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (subject, watch_url, title, playlist_url, time.time()))
+        except sqlite3.OperationalError:
+            pass  # Locked by another process, the watch page is visited again next time
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
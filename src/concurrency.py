@@ -0,0 +1,104 @@
+import threading
+import time
+from multiprocessing import Condition, Value
+from multiprocessing.sharedctypes import Synchronized
+
+import metrics
+
+ADJUST_INTERVAL = 30  # Seconds of throughput measured before the number of parallel downloads is changed again
+MINIMUM_GAIN = 0.25  # An additional stream has to add this share of a stream's throughput to be worth it
+MAXIMUM_DROP = 0.3  # A throughput drop by this share at the same number of streams means the server got busier
+DECREASE_FACTOR = 0.75
+
+
+class ConcurrencyLimit:
+    # Number of jobs allowed to run at once, shared between all worker processes of a scheduler
+    # The pool is started with the maximum number of workers, a surplus worker waits here with its job until the limit
+    # is raised, so only running jobs hold a slot
+
+    def __init__(self, limit: int):
+        self.condition = Condition()
+        self.limit = Value('i', limit, lock=False)  # Guarded by the condition
+        self.active = Value('i', 0, lock=False)
+
+    def acquire(self):
+        with self.condition:
+            while self.active.value >= self.limit.value:
+                self.condition.wait()
+            self.active.value += 1
+
+    def release(self):
+        with self.condition:
+            self.active.value -= 1
+            self.condition.notify_all()
+
+    def set(self, limit: int):
+        with self.condition:
+            self.limit.value = limit
+            self.condition.notify_all()
+
+    def saturated(self) -> bool:
+        with self.condition:
+            return self.active.value >= self.limit.value
+
+
+class AIMD:
+    # Additive increase, multiplicative decrease, as TCP does it for its congestion window:
+    # one more stream per interval while the last one still added throughput,
+    # a quarter fewer once it didn't or the throughput fell, as the uplink or the server is saturated then
+
+    def __init__(self, minimum: int, maximum: int):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = minimum
+        self.previous_limit = None
+        self.previous_throughput = None
+
+    def reset(self):
+        # The next measurement can't be compared to the last one, e.g. because we ran out of videos in between
+        self.previous_limit = self.previous_throughput = None
+
+    def adjust(self, throughput: float) -> int:
+        # Takes the throughput of an interval in which all allowed streams were busy, returns the new limit
+        limit = self.limit
+        if self.previous_throughput is None:
+            limit += 1
+        else:
+            stream_throughput = self.previous_throughput / self.previous_limit
+            if limit > self.previous_limit and throughput - self.previous_throughput < MINIMUM_GAIN * stream_throughput:
+                limit = min(limit - 1, int(limit * DECREASE_FACTOR))
+            elif limit >= self.previous_limit and throughput < self.previous_throughput * (1 - MAXIMUM_DROP):
+                limit = min(limit - 1, int(limit * DECREASE_FACTOR))
+            else:
+                limit += 1  # Fewer streams are expected to deliver less, so after a decrease we probe upwards again
+        self.previous_limit, self.previous_throughput = self.limit, throughput
+        self.limit = max(self.minimum, min(self.maximum, limit))
+        return self.limit
+
+
+def adapt(concurrency_limit: ConcurrencyLimit, counter: Synchronized, minimum: int, maximum: int,
+          interval: float = ADJUST_INTERVAL) -> threading.Thread:
+    # Measures the aggregate and per-stream download throughput and adjusts the number of parallel downloads to it
+    aimd = AIMD(minimum, maximum)
+    concurrency_limit.set(aimd.limit)
+    metrics.gauge("parallel_downloads", aimd.limit)
+
+    def control():
+        while True:
+            saturated = concurrency_limit.saturated()
+            previous = counter.value
+            time.sleep(interval)
+            throughput = (counter.value - previous) / interval
+            if not (saturated and concurrency_limit.saturated()) or not throughput:
+                aimd.reset()  # Not enough videos to fill the slots, that says nothing about the bandwidth
+                continue
+            limit = aimd.limit
+            if aimd.adjust(throughput) != limit:
+                print(f"Parallel downloads: {limit} -> {aimd.limit} at {throughput / 1e6:.1f} MB/s "
+                      f"({throughput / limit / 1e6:.1f} MB/s per stream)")
+                concurrency_limit.set(aimd.limit)
+                metrics.gauge("parallel_downloads", aimd.limit)
+
+    controller = threading.Thread(target=control, daemon=True)
+    controller.start()
+    return controller
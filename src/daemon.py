@@ -0,0 +1,307 @@
+"""Daemon mode: the browsers stay logged in and every subject is polled on a schedule of its own.
+
+Newly found videos are handed to the download workers, which keep running between the polls.
+SIGHUP reloads the config, SIGTERM finishes the current poll and the queued downloads and stops.
+"""
+import datetime
+import signal
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterator
+
+import browser_pool
+import downloader
+import metrics
+import panopto
+import tum_live
+import util
+from catalog import Catalog
+from scheduler import Scheduler
+from session_store import SessionStore
+
+MAXIMUM_BACKOFF = 8  # The interval of a subject doubles with every poll without new videos, up to this factor
+RELOGIN_INTERVAL = 6 * 3600  # Seconds after which we log in again, before the sessions expire on their own
+REQUEUE_BACKOFF = 3600  # Seconds before a video whose file is still missing is queued again, doubles every time
+MAXIMUM_REQUEUE_BACKOFF = 7 * 24 * 3600  # Permanent failures (a silent lecture, a 403) end up here
+WINTER_TERM_MONTHS = (10, 3)  # October to March, the summer term is April to September
+
+
+@dataclass(frozen=True)
+class PollOptions:
+    interval: float  # Seconds between two polls of a subject during lecture hours
+    idle_interval: float  # Outside lecture hours
+    archive_interval: float  # For subjects of past semesters
+    lecture_hours: (int, int)  # Hours of the day, on weekdays
+
+
+@dataclass(frozen=True)
+class DaemonConfig:
+    # The part of the config that is applied when it is reloaded, the download workers need a restart
+    tum_live_subjects: dict[str, (str, str)]
+    panopto_folders: dict[str, str]
+    default_quality: str
+    subject_qualities: dict[str, str]
+    destination_folder_path: Path
+    poll_options: PollOptions
+    username: str | None
+    password: str | None
+    scrape_mode: str
+    session_store: SessionStore | None
+    scrape_workers: int
+    worker_memory_limit: int | None
+
+    def scraper_options(self) -> tuple:
+        # The scrapers have to log in again if one of these changes
+        return self.username, self.password, self.scrape_mode, self.scrape_workers, self.worker_memory_limit
+
+
+def current_semester(today: datetime.date) -> (int, str):
+    # (year, "W" or "S") in TUM-live's notation, the winter term is named after the year it starts in
+    if today.month >= WINTER_TERM_MONTHS[0]:
+        return today.year, "W"
+    if today.month <= WINTER_TERM_MONTHS[1]:
+        return today.year - 1, "W"
+    return today.year, "S"
+
+
+def is_archived(subjects_identifier: str, today: datetime.date) -> bool:
+    # Whether a TUM-live subject ("2022/W/slug") belongs to a past semester, so it hardly gets new videos
+    try:
+        year, term = subjects_identifier.split("/", 2)[:2]
+        semester = (int(year), 1 if term.upper() == "W" else 0)
+    except ValueError:
+        return False
+    current_year, current_term = current_semester(today)
+    return semester < (current_year, 1 if current_term == "W" else 0)
+
+
+class Schedule:
+    # When each subject is polled next: often during lecture hours, rarely for past semesters,
+    # and less and less often while a subject doesn't get new videos
+
+    def __init__(self, options: PollOptions):
+        self.options = options
+        self.next_poll: dict[str, float] = {}  # By subject, unknown subjects are due right away
+        self.backoff: dict[str, int] = {}
+
+    def in_lecture_hours(self, moment: datetime.datetime) -> bool:
+        start, end = self.options.lecture_hours
+        return moment.weekday() < 5 and start <= moment.hour < end
+
+    def next_lecture_hours(self, moment: datetime.datetime) -> datetime.datetime:
+        start = moment.replace(hour=self.options.lecture_hours[0], minute=0, second=0, microsecond=0)
+        if start <= moment:
+            start += datetime.timedelta(days=1)
+        while start.weekday() >= 5:
+            start += datetime.timedelta(days=1)
+        return start
+
+    def due(self, subject: str, now: float) -> bool:
+        return self.next_poll.get(subject, 0) <= now
+
+    def polled(self, subject: str, new_videos: bool, archived: bool, now: float):
+        self.backoff[subject] = 1 if new_videos else min(self.backoff.get(subject, 1) * 2, MAXIMUM_BACKOFF)
+        moment = datetime.datetime.fromtimestamp(now)
+        if archived:
+            interval = self.options.archive_interval
+        elif self.in_lecture_hours(moment):
+            interval = self.options.interval
+        else:
+            interval = self.options.idle_interval
+        next_poll = now + interval * self.backoff[subject]
+        if not archived and not self.in_lecture_hours(moment):
+            # Lectures of the day are uploaded soon after they end, so we don't sleep through the morning
+            next_poll = min(next_poll, self.next_lecture_hours(moment).timestamp())
+        self.next_poll[subject] = next_poll
+
+    def forget(self, subjects: set[str]):
+        # Subjects that were removed from the config
+        for subject in set(self.next_poll) - subjects:
+            del self.next_poll[subject]
+            self.backoff.pop(subject, None)
+
+    def next_due(self, subjects: set[str]) -> float:
+        return min((self.next_poll.get(subject, 0) for subject in subjects), default=float("inf"))
+
+
+class Scrapers:
+    # The logged-in scrapers of both platforms, created when first needed and again after RELOGIN_INTERVAL
+
+    def __init__(self, config: DaemonConfig, catalog: Catalog | None):
+        self.config = config
+        self.catalog = catalog
+        self.scrapers: dict[str, (tum_live.Scraper | panopto.Scraper, float)] = {}
+
+    def _scraper(self, site: str) -> tum_live.Scraper | panopto.Scraper:
+        if site in self.scrapers:
+            scraper, logged_in_at = self.scrapers[site]
+            if time.time() - logged_in_at < RELOGIN_INTERVAL:
+                return scraper
+            scraper.close()
+            del self.scrapers[site]
+        config = self.config
+        if site == tum_live.SESSION_STORE_SITE:
+            scraper = tum_live.Scraper(config.username, config.password, self.catalog, config.scrape_mode,
+                                       config.session_store, config.scrape_workers, config.worker_memory_limit)
+        else:
+            scraper = panopto.Scraper(config.username, config.password, config.session_store,
+                                      config.scrape_workers, config.worker_memory_limit)
+        self.scrapers[site] = (scraper, time.time())
+        return scraper
+
+    def scrape(self, site: str, subjects: dict) -> Iterator[tuple[str, str, str, str]]:
+        # Logs in within the thread that scrapes, so both platforms log in at the same time
+        yield from self._scraper(site).scrape(subjects)
+
+    def close(self):
+        for scraper, _ in self.scrapers.values():
+            scraper.close()
+        self.scrapers = {}
+
+
+class Signals:
+    # SIGHUP and SIGTERM as events, which also end the sleep between two polls
+
+    def __init__(self):
+        self.wake_up = threading.Event()
+        self.reload = threading.Event()
+        self.stop = threading.Event()
+        self.previous_handlers = {signal.SIGHUP: signal.signal(signal.SIGHUP, lambda *_: self._request(self.reload)),
+                                  signal.SIGTERM: signal.signal(signal.SIGTERM, lambda *_: self._request(self.stop))}
+
+    def _request(self, event: threading.Event):
+        event.set()
+        self.wake_up.set()
+
+    def reload_requested(self) -> bool:
+        requested = self.reload.is_set()
+        self.reload.clear()
+        return requested
+
+    def sleep(self, seconds: float | None):
+        self.wake_up.wait(seconds)
+        self.wake_up.clear()
+
+    def restore(self):
+        for signal_number, handler in self.previous_handlers.items():
+            signal.signal(signal_number, handler)
+
+
+class Poller:
+    # What the daemon keeps between two polls: its config, the logged-in scrapers and the schedule of every subject
+
+    def __init__(self, config: DaemonConfig, scheduler: Scheduler, catalog: Catalog | None):
+        self.config = config
+        self.scheduler = scheduler
+        self.catalog = catalog
+        self.schedule = Schedule(config.poll_options)
+        self.scrapers = Scrapers(config, catalog)
+        self.found: dict[str, set[str]] = {}  # IDs of the videos found so far, by subject
+        self.downloaded: set[str] = set()  # IDs of the found videos whose file exists, they aren't queued again
+        self.requeue: dict[str, (int, float)] = {}  # By ID of the missing videos: (times queued, when it's due again)
+
+    def subjects(self) -> set[str]:
+        return {*self.config.tum_live_subjects, *self.config.panopto_folders}
+
+    def reload(self, reload_config: Callable[[], DaemonConfig]):
+        try:
+            config = reload_config()
+        except (Exception, SystemExit) as error:  # argparse exits on invalid arguments
+            print(f"Could not reload the config, keeping the old one ({error})", file=sys.stderr)
+            return
+        if config.scraper_options() != self.config.scraper_options():
+            self.restart_scrapers(config)
+        self.config = self.scrapers.config = config
+        self.schedule.options = config.poll_options
+        self.schedule.forget(self.subjects())
+        self.requeue = {}  # The reload may have fixed what made them fail
+        print("Reloaded the config")
+
+    def restart_scrapers(self, config: DaemonConfig):
+        self.scrapers.close()
+        self.scrapers = Scrapers(config, self.catalog)
+
+    def poll_due(self):
+        now = time.time()
+        due = {site: {name: subject for name, subject in subjects.items() if self.schedule.due(name, now)}
+               for site, subjects in ((tum_live.SESSION_STORE_SITE, self.config.tum_live_subjects),
+                                      (panopto.SESSION_STORE_SITE, self.config.panopto_folders))}
+        if not any(due.values()):
+            return
+        new_videos = self.poll(due)
+        if new_videos is None:  # The scrapers are in an unknown state, we start over with a new login
+            self.restart_scrapers(self.config)
+        today = datetime.date.today()
+        for name in due[tum_live.SESSION_STORE_SITE]:
+            archived = is_archived(self.config.tum_live_subjects[name][0], today)
+            self.schedule.polled(name, bool(new_videos and new_videos[name]), archived, time.time())
+        for name in due[panopto.SESSION_STORE_SITE]:
+            self.schedule.polled(name, bool(new_videos and new_videos[name]), False, time.time())
+
+    def poll(self, due: dict[str, dict]) -> dict[str, int] | None:
+        # Scrapes the due subjects of both platforms and queues the videos that aren't downloaded yet
+        # Returns the number of newly found videos by subject, None if scraping failed
+        new_videos = {name: 0 for subjects in due.values() for name in subjects}
+        try:
+            for subject, filename, playlist_url, video_id in browser_pool.merge(
+                    [self.scrapers.scrape(site, subjects) for site, subjects in due.items() if subjects]):
+                if video_id not in self.found.setdefault(subject, set()):
+                    self.found[subject].add(video_id)
+                    new_videos[subject] += 1
+                if video_id not in self.downloaded and self.requeue.get(video_id, (0, 0.0))[1] <= time.time():
+                    self.queue(subject, filename, playlist_url, video_id)
+        except Exception as error:  # Anything from an expired session to a changed page, we try again next time
+            print(f"Polling failed: {error!r}", file=sys.stderr)
+            for subject in new_videos:
+                metrics.count("polls_total", subject=subject, result="failed")
+            return None
+        for subject, count in new_videos.items():
+            metrics.count("polls_total", subject=subject, result="new" if count else "unchanged")
+            if count:
+                print(f'{count} new videos for "{subject}"')
+        return new_videos
+
+    def queue(self, subject: str, filename: str, playlist_url: str, video_id: str):
+        # A video is queued again until its file exists, as its download may have failed in the meantime,
+        # e.g. because the playlist wasn't published yet. The downloader skips it while it is locked by a worker,
+        # a second job of a video that is still waiting in the queue is dropped once the first one claimed the lock
+        # Some failures are permanent, so the time until the next attempt doubles with every attempt
+        subject_folder = Path(self.config.destination_folder_path, subject)
+        subject_folder.mkdir(exist_ok=True)
+        (output_file_path,) = downloader.download_list_of_videos(
+            [(filename, playlist_url, video_id)], subject_folder, self.scheduler,
+            self.config.subject_qualities.get(subject, self.config.default_quality))
+        if output_file_path.exists() or util.jump_cut_path(output_file_path).exists():
+            self.downloaded.add(video_id)
+            self.requeue.pop(video_id, None)
+            return
+        attempts = self.requeue.get(video_id, (0, 0.0))[0] + 1
+        backoff = min(REQUEUE_BACKOFF * 2 ** (attempts - 1), MAXIMUM_REQUEUE_BACKOFF)
+        self.requeue[video_id] = (attempts, time.time() + backoff)
+
+    def seconds_until_due(self) -> float | None:
+        subjects = self.subjects()
+        return max(0.0, self.schedule.next_due(subjects) - time.time()) if subjects else None
+
+    def close(self):
+        self.scrapers.close()
+
+
+def run(config: DaemonConfig, reload_config: Callable[[], DaemonConfig], scheduler: Scheduler,
+        catalog: Catalog | None):
+    # Polls until SIGTERM, reload_config() is called on SIGHUP
+    signals = Signals()
+    poller = Poller(config, scheduler, catalog)
+    print(f"Polling {len(poller.subjects())} subjects, send SIGHUP to reload the config")
+    try:
+        while not signals.stop.is_set():
+            if signals.reload_requested():
+                poller.reload(reload_config)
+            poller.poll_due()
+            signals.sleep(poller.seconds_until_due())
+    finally:
+        poller.close()
+        signals.restore()
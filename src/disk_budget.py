@@ -0,0 +1,64 @@
+import os
+import shutil
+import sys
+from multiprocessing import Condition, Value
+from pathlib import Path
+
+RECHECK_INTERVAL = 30  # Seconds after which a waiting job looks at the free space again, other programs free space too
+
+
+class DiskBudget:
+    # Disk space reserved by the jobs in flight on each volume, shared between all worker processes
+    # A job only starts once its estimated size fits into the free space minus the other reservations and the headroom,
+    # so many parallel downloads can't fill up a small temp disk halfway through
+
+    def __init__(self, directories: [Path], headroom_bytes: int):
+        self.headroom_bytes = headroom_bytes
+        self.condition = Condition()
+        self.reserved: dict[int, Value] = {}  # Reserved bytes by st_dev of the volume
+        self.directories: dict[int, Path] = {}  # A directory on each volume to ask for its free space
+        for directory in directories:
+            volume = os.stat(directory).st_dev
+            if volume not in self.reserved:
+                self.reserved[volume] = Value('q', 0, lock=False)  # Guarded by the condition
+                self.directories[volume] = directory
+
+    def _volumes(self, needs: [(Path, int)]) -> dict[int, int]:
+        # Sums up the needs per volume, directories on volumes we don't track are ignored
+        volumes: dict[int, int] = {}
+        for directory, size in needs:
+            volume = os.stat(directory).st_dev
+            if volume in self.reserved:
+                volumes[volume] = volumes.get(volume, 0) + size
+        return volumes
+
+    def _fits(self, volumes: dict[int, int]) -> bool:
+        for volume, size in volumes.items():
+            free = shutil.disk_usage(self.directories[volume]).free
+            if free - self.reserved[volume].value - size < self.headroom_bytes:
+                return False
+        return True
+
+    def reserve(self, needs: [(Path, int)], name: str) -> dict[int, int]:
+        # Blocks until the bytes needed in each directory are available, returns the reservation to release later
+        volumes = self._volumes(needs)
+        with self.condition:
+            waiting = False
+            while not self._fits(volumes):
+                if not any(reserved.value for reserved in self.reserved.values()):
+                    # Nobody is going to release anything, so waiting would not help
+                    print(f"Warning: {name} probably doesn't fit on the disk, trying anyway", file=sys.stderr)
+                    break
+                if not waiting:
+                    print(f"Waiting for disk space for {name}")
+                    waiting = True
+                self.condition.wait(timeout=RECHECK_INTERVAL)
+            for volume, size in volumes.items():
+                self.reserved[volume].value += size
+        return volumes
+
+    def release(self, reservation: dict[int, int]):
+        with self.condition:
+            for volume, size in reservation.items():
+                self.reserved[volume].value -= size
+            self.condition.notify_all()
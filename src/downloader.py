@@ -1,108 +1,325 @@
-import re
 import shutil
-import subprocess
 import sys
 import time
-from multiprocessing import Process, Semaphore
+from dataclasses import dataclass
+from multiprocessing.sharedctypes import Synchronized
 from pathlib import Path
 
+import requests
 
-def download_list_of_videos(videos: [(str, str)],
-                            output_folder_path: Path, tmp_directory: Path,
-                            keep_original: bool, jump_cut: bool,
-                            semaphore: Semaphore) -> [Process]:
-    child_process_list = []
-    for filename, url in videos:
-        filename = re.sub('[\\\\/:*?"<>|]|[\x00-\x20]', '_', filename) + ".mp4"  # Filter illegal filename chars
+import catalog
+import hls
+import jumpcut
+import locks
+import metrics
+import retry
+import util
+from disk_budget import DiskBudget
+from manifest import Manifest
+from progress import Progress, run_ffmpeg, run_logged
+from scheduler import Scheduler
+
+
+@dataclass(frozen=True)
+class DownloadSettings:
+    tmp_directory: Path
+    keep_original: bool
+    jump_cut: bool
+    download_mode: str
+    segment_workers: int
+    run_start_time: float
+    first_byte_time: Synchronized  # Shared between all workers, 0 until the first byte of the run arrived
+    jumpcut_engine: str
+    silent_threshold: float
+    silent_speed: float
+    jumpcut_margin: float
+    jumpcut_chunks: int  # Chunks of one video the native engine encodes in parallel, 1 = no chunking
+    copied_bytes: Synchronized  # Shared between all workers, bytes that had to be copied between file systems
+    disk_budget: DiskBudget
+    retry_attempts: int  # Attempts per download and conversion, failures that can't go away aren't retried
+    downloaded_bytes: Synchronized  # Shared between all workers, bytes downloaded in this run
+    stall_timeout: float  # Seconds without a downloaded byte after which a download is aborted and retried
+    catalog_path: Path | None = None  # Catalog of the scrapers, failed playlist URLs are dropped from it
+
+
+def report_first_byte(settings: DownloadSettings):
+    with settings.first_byte_time.get_lock():
+        if settings.first_byte_time.value:
+            return
+        settings.first_byte_time.value = time.time()
+    print(f"Time to first byte: {(settings.first_byte_time.value - settings.run_start_time):.1f}s after start of run")
+
+
+def temporary_download_path(filename: str, output_file_path: Path, settings: DownloadSettings) -> Path:
+    # A kept original ends up in the output folder, so we download it to that file system right away
+    # Publishing it is then a rename or hardlink instead of a copy of several GB
+    if settings.keep_original and not util.same_file_system(settings.tmp_directory, output_file_path.parent):
+        return Path(output_file_path.parent, f".{filename}.original")
+    return Path(settings.tmp_directory, temporary_name(output_file_path) + ".original")
+
+
+def temporary_name(output_file_path: Path) -> str:
+    # Videos of different subjects may share a filename (e.g. "000_Lecture 1"), their temporary files must not
+    return f"{output_file_path.parent.name}_{output_file_path.name}"
+
+
+def download_list_of_videos(videos: [(str, str, str)], output_folder_path: Path, scheduler: Scheduler,
+                            quality: str = "best") -> [Path]:
+    # Returns the output file path of every video, whether it was queued or is downloaded already
+    manifest = Manifest(output_folder_path)
+    output_file_paths = []
+    for filename, url, video_id in videos:
+        filename = util.sanitize_filename(filename) + ".mp4"
+        filename = manifest.reconcile(video_id, filename)  # Moves files of videos whose index changed
         output_file_path = Path(output_folder_path, filename)
-        output_file_path_jc = Path(re.sub(r'\.(?=[^.]*$)', '_jc.', output_file_path.as_posix()))  # Add _jc to filename
-        """We use locks to prevent processing the same video twice (e.g. if we run in multiple independent instances)"""
-        """Locks can also be created by the user to keep us from downloading a specific video"""
-        if not (Path(output_file_path.as_posix() + ".lock").exists()  # Check if lock file exists
+        output_file_path_jc = util.jump_cut_path(output_file_path)
+        if not (locks.is_locked(output_file_path)  # Check if lock file exists (stale locks of crashed runs don't count)
                 or output_file_path.exists()
                 or output_file_path_jc.exists()):  # Check if file exists (we downloaded and converted it already)
-            Path(output_file_path.as_posix() + ".lock").touch()  # Create lock file
-            child_process = Process(target=download,  # Download video in separate process
-                                    args=(filename, url,
-                                          output_file_path, output_file_path_jc, tmp_directory,
-                                          keep_original, jump_cut,
-                                          semaphore))
-            child_process.start()
-            child_process_list.append(child_process)
-    return child_process_list
-
-
-def download(filename: str, playlist_url: str,
-             output_file_path: Path, output_file_path_jc: Path, tmp_directory: Path,
-             keep_original: bool, jump_cut: bool,
-             semaphore: Semaphore):
-    print(f"Download of {filename} started")
-    semaphore.acquire()  # Acquire lock
-    download_start_time = time.time()  # Track download time
-    temporary_path = Path(tmp_directory, filename + ".original")  # Download location
-    ffmpeg = subprocess.run([
+            # Blocks until a worker is about to become free, the worker claims the lock when it starts the job
+            # That way other nodes sharing the output folder can claim the videos we don't have capacity for yet
+            scheduler.submit((filename, url, quality, output_file_path, output_file_path_jc))
+        output_file_paths.append(output_file_path)
+    manifest.save()
+    return output_file_paths
+
+
+def download(filename: str, playlist_url: str, quality: str,
+             output_file_path: Path, output_file_path_jc: Path,
+             settings: DownloadSettings) -> tuple | None:
+    # Returns the job for the jump-cut stage, if the video should be jump-cut
+    # Unless the video is handed over to that stage, the lock is removed however the download ends
+    if not locks.acquire(output_file_path):  # Claim lock file
+        print(f"Skipping {filename}, another run claimed it first")
+        return
+    if output_file_path.exists() or output_file_path_jc.exists():  # Finished by another run since we checked
+        locks.remove(output_file_path)
+        return
+    temporary_path = temporary_download_path(filename, output_file_path, settings)  # Download location
+    handed_over = False
+    try:
+        reservation = reserve_download_space(filename, playlist_url, quality, temporary_path, settings)
+        print(f"Download of {filename} started")
+        download_start_time = time.time()  # Track download time
+        try:
+            downloaded = download_with_retries(filename, playlist_url, quality, output_file_path, temporary_path,
+                                               settings)
+        finally:
+            settings.disk_budget.release(reservation)  # From now on the free space shows what the download takes
+        metrics.count("videos_total", stage="download", result="completed" if downloaded else "failed")
+        if not downloaded:
+            if settings.catalog_path:
+                catalog.discard(settings.catalog_path, playlist_url)  # The next run visits the watch page again
+            return
+
+        download_seconds = time.time() - download_start_time
+        metrics.observe("stage_seconds", download_seconds, stage="download", mode=settings.download_mode)
+        metrics.observe("download_bytes_per_second", temporary_path.stat().st_size / max(download_seconds, 1e-3),
+                        mode=settings.download_mode)
+        print(f"Download of {filename} completed after {download_seconds:.0f}s")
+        if settings.keep_original:  # The jump-cut stage still reads the temporary file, so it has to stay
+            copied_bytes = util.publish_file(temporary_path, output_file_path, keep_source=settings.jump_cut)
+            with settings.copied_bytes.get_lock():
+                settings.copied_bytes.value += copied_bytes
+        if settings.jump_cut:
+            handed_over = True  # The jump-cut worker renews and removes the lock from now on
+            return (filename, playlist_url, output_file_path, output_file_path_jc, temporary_path, download_start_time,
+                    locks.hand_over(output_file_path))
+        print(f"Completed {filename} after {(time.time() - download_start_time):.0f}s")
+    finally:
+        if not handed_over:
+            temporary_path.unlink(missing_ok=True)  # Partial download, or moved to the output folder already
+            locks.remove(output_file_path)  # Remove lock file, so a later run can try again after a failure
+
+
+def download_with_retries(filename: str, playlist_url: str, quality: str,
+                          output_file_path: Path, temporary_path: Path, settings: DownloadSettings) -> bool:
+    if settings.download_mode == "native":
+        return retry.run(lambda: download_native(filename, playlist_url, quality, output_file_path,
+                                                 temporary_path, settings),
+                         f"download of {filename}", settings.retry_attempts, stage="download")
+    downloaded = retry.run(lambda: download_ffmpeg(filename, playlist_url, quality, output_file_path,
+                                                   temporary_path, settings),
+                           f"download of {filename}", settings.retry_attempts, stage="download")
+    if downloaded:
+        report_first_byte(settings)  # ffmpeg doesn't tell us earlier, so this is an upper bound
+    return downloaded
+
+
+def reserve_download_space(filename: str, playlist_url: str, quality: str, temporary_path: Path,
+                           settings: DownloadSettings) -> dict[int, int]:
+    # Blocks until there is room for the download, returns the reservation
+    try:
+        with hls.create_session(1) as session:
+            estimated_size = hls.estimate_size(session, playlist_url, quality)
+    except (requests.RequestException, hls.PlaylistError):
+        estimated_size = None  # The download itself will report what's wrong
+    if not estimated_size:
+        return {}
+    needs = [(temporary_path.parent, estimated_size)]
+    if settings.download_mode == "native":
+        needs.append((settings.tmp_directory, estimated_size))  # Segments, until they are remuxed
+    return settings.disk_budget.reserve(needs, filename)
+
+
+def download_ffmpeg(filename: str, playlist_url: str, quality: str,
+                    output_file_path: Path, temporary_path: Path,
+                    settings: DownloadSettings) -> str:
+    input_urls = [playlist_url]
+    progress = Progress(f"Download of {filename}", counter=settings.downloaded_bytes)
+    if quality != "best":  # ffmpeg would pick the best variant itself, so we hand it the one we want
+        try:
+            with hls.create_session(1) as session:
+                media_playlists = hls.resolve_media_playlists(session, playlist_url, quality)
+            input_urls = [media_playlist_url for media_playlist_url, _ in media_playlists]  # Audio may be separate
+            progress.duration = sum(duration for _, duration in hls.parse_media_playlist(*media_playlists[0]))
+        except (requests.RequestException, hls.PlaylistError) as error:
+            print(f"Error during download of \"{filename}\": could not resolve the playlist variant:", file=sys.stderr)
+            print(f"Playlist file: {playlist_url}", file=sys.stderr)
+            print(f"Error: {error}", file=sys.stderr)
+            return retry.classify_exception(error)
+
+    ffmpeg = run_ffmpeg([
         'ffmpeg',
         '-y',  # Overwrite output file if it already exists
         '-hwaccel', 'auto',  # Hardware acceleration
-        '-i', playlist_url,  # Input file
+        '-i', input_urls[0],  # Input file
+        *(['-i', input_urls[1], '-map', '0:v', '-map', '1:a'] if len(input_urls) > 1 else []),  # Audio rendition
+        *(['-vn'] if quality == "audio-only" else []),  # Drop the video of muxed variants
         '-c', 'copy',  # Codec name
         '-f', 'mp4',  # Force mp4 as output file format
         temporary_path  # Output file
-    ], capture_output=True)
+    ], progress, settings.stall_timeout)
 
     if ffmpeg.returncode != 0:  # Print debug output in case of error
         print(f"Error during download of \"{filename}\" with ffmpeg:", file=sys.stderr)
         print(f"Playlist file: {playlist_url}", file=sys.stderr)
         print(f"Designated download location: {temporary_path}", file=sys.stderr)
         print(f"Designated output location: {output_file_path}", file=sys.stderr)
-        print(f"Output of ffmpeg to stdout:\n{ffmpeg.stdout.decode('utf-8')}", file=sys.stderr)
-        print(f"Output of ffmpeg to stderr:\n{ffmpeg.stderr.decode('utf-8')}", file=sys.stderr)
-        return
+        print(f"Last output of ffmpeg to stderr:\n{ffmpeg.stderr.decode('utf-8', 'replace')}", file=sys.stderr)
+        return retry.classify_process(ffmpeg.returncode, ffmpeg.stderr.decode('utf-8', 'replace'))
+    return retry.SUCCEEDED
 
-    print(f"Download of {filename} completed after {(time.time() - download_start_time):.0f}s")
-    if keep_original:
-        shutil.copy2(temporary_path, output_file_path)  # Copy original file to output location
-    if jump_cut:
-        cut_video(filename, playlist_url,
-                  output_file_path, output_file_path_jc, temporary_path,
-                  download_start_time,
-                  semaphore)
-    else:
-        temporary_path.unlink()  # Delete original file
-        Path(output_file_path.as_posix() + ".lock").unlink()  # Remove lock file
-        print(f"Completed {filename} after {(time.time() - download_start_time):.0f}s")
 
-        semaphore.release()  # Release lock
+def download_native(filename: str, playlist_url: str, quality: str,
+                    output_file_path: Path, temporary_path: Path,
+                    settings: DownloadSettings) -> str:
+    # Segments are fetched to here
+    segment_directory = Path(settings.tmp_directory, temporary_name(output_file_path) + ".segments")
+    try:
+        fetched_bytes = hls.download(playlist_url, segment_directory, temporary_path, settings.segment_workers,
+                                     on_first_byte=lambda: report_first_byte(settings), quality=quality,
+                                     progress=Progress(f"Download of {filename}", counter=settings.downloaded_bytes),
+                                     stall_timeout=settings.stall_timeout)
+    except (requests.RequestException, hls.PlaylistError, OSError) as error:  # Print debug output in case of error
+        print(f"Error during download of \"{filename}\" with the HLS downloader:", file=sys.stderr)
+        print(f"Playlist file: {playlist_url}", file=sys.stderr)
+        print(f"Designated download location: {temporary_path}", file=sys.stderr)
+        print(f"Designated output location: {output_file_path}", file=sys.stderr)
+        print(f"Error: {error}", file=sys.stderr)
+        return retry.classify_exception(error)  # The segments stay, a retry only fetches the missing ones
+    shutil.rmtree(segment_directory)  # Segments are part of the remuxed file now
+    print(f"Fetched {fetched_bytes / 1e6:.0f} MB of segments for {filename}")
+    return retry.SUCCEEDED
 
 
 def cut_video(filename: str, playlist_url: str,
               output_file_path: Path, output_file_path_jc: Path, input_path: Path,
-              download_start_time: float,
-              semaphore: Semaphore):
-    print(f"Conversion of {filename} started")
-    conversion_start_time = time.time()  # Track auto-editor time
-    auto_editor = subprocess.run([
+              download_start_time: float, lock_token: str | None,
+              settings: DownloadSettings):
+    # The lock is removed however the conversion ends
+    if not locks.adopt(output_file_path, lock_token):
+        print(f"Skipping the conversion of {filename}, its lock expired while it was queued and another run claimed it")
+        input_path.unlink(missing_ok=True)
+        return
+    try:
+        # The jump-cut version is shorter than the original, so the original's size is a safe estimate
+        needs = [(output_file_path_jc.parent, input_path.stat().st_size)]
+        if settings.jumpcut_engine == "native" and settings.jumpcut_chunks > 1:
+            needs.append((settings.tmp_directory, input_path.stat().st_size))  # Chunks, until they are joined
+        reservation = settings.disk_budget.reserve(needs, filename)
+        print(f"Conversion of {filename} started")
+        conversion_start_time = time.time()  # Track jump-cut time
+        cut_video_with = cut_video_native if settings.jumpcut_engine == "native" else cut_video_auto_editor
+        try:
+            converted = retry.run(lambda: cut_video_with(filename, playlist_url, output_file_path_jc, input_path,
+                                                         settings),
+                                  f"conversion of {filename}", settings.retry_attempts, stage="cut")
+        finally:
+            settings.disk_budget.release(reservation)
+        metrics.count("videos_total", stage="cut", result="completed" if converted else "failed")
+        if not converted:
+            output_file_path_jc.unlink(missing_ok=True)  # A partial file would look like a finished conversion
+            return
+
+        conversion_seconds = time.time() - conversion_start_time
+        metrics.observe("stage_seconds", conversion_seconds, stage="cut", engine=settings.jumpcut_engine)
+        if metrics.enabled():
+            report_speedup(input_path, output_file_path_jc, settings)
+        print(f"Conversion of {filename} completed after {conversion_seconds:.0f}s")
+        print(f"Completed {filename} after {(time.time() - download_start_time):.0f}s")
+        metrics.observe("stage_seconds", time.time() - download_start_time, stage="video")
+    finally:
+        input_path.unlink(missing_ok=True)  # Delete original file
+        locks.remove(output_file_path)  # Remove lock file
+
+
+def report_speedup(input_path: Path, output_file_path_jc: Path, settings: DownloadSettings):
+    # How much shorter the jump-cut version is than the original
+    input_duration = jumpcut.video_duration(input_path)
+    output_duration = jumpcut.video_duration(output_file_path_jc)
+    if input_duration and output_duration:
+        metrics.observe("cut_speedup", input_duration / output_duration, engine=settings.jumpcut_engine)
+
+
+def cut_video_auto_editor(filename: str, playlist_url: str,
+                          output_file_path_jc: Path, input_path: Path,
+                          settings: DownloadSettings) -> str:
+    auto_editor = run_logged([
         'auto-editor',
         input_path,  # Input file
-        '--silent_speed', '8',  # Speed multiplier while there is no audio
+        '--silent_speed', f'{settings.silent_speed:g}',  # Speed multiplier while there is no audio
         '--video_codec', 'h264',  # Video codec
         '--video-bitrate', 'unset',  # Automatic bitrate
         '--no_open',  # Don't open the finished file
+        '--progress', 'machine',  # Progress as title~index~total~seconds_left lines
         '-o', output_file_path_jc  # Output file
-    ], capture_output=True)
+    ], Progress(f"Conversion of {filename}"))
 
     if auto_editor.returncode != 0:  # Print debug output in case of error
         print(f"Error during conversion of \"{filename}\" with auto-editor:", file=sys.stderr)
         print(f"Playlist file: {playlist_url}", file=sys.stderr)
         print(f"Reading from: {input_path}", file=sys.stderr)
         print(f"Designated output location: {output_file_path_jc}", file=sys.stderr)
-        print(f"Output of auto-editor to stdout:\n{auto_editor.stdout.decode('utf-8')}", file=sys.stderr)
-        print(f"Output of auto-editor to stderr:\n{auto_editor.stderr.decode('utf-8')}", file=sys.stderr)
-        return
+        print(f"Last output of auto-editor:\n{auto_editor.stdout.decode('utf-8', 'replace')}", file=sys.stderr)
+        return retry.classify_process(auto_editor.returncode, auto_editor.stdout.decode('utf-8', 'replace'))
+    return retry.SUCCEEDED
+
 
-    print(f"Conversion of {filename} completed after {(time.time() - conversion_start_time):.0f}s")
-    input_path.unlink()  # Delete original file
-    Path(output_file_path.as_posix() + ".lock").unlink()  # Remove lock file
-    print(f"Completed {filename} after {(time.time() - download_start_time):.0f}s")
+def cut_video_native(filename: str, playlist_url: str,
+                     output_file_path_jc: Path, input_path: Path,
+                     settings: DownloadSettings) -> str:
+    try:
+        if settings.jumpcut_chunks > 1:
+            ffmpeg = jumpcut.cut_chunked(input_path, output_file_path_jc,
+                                         Path(settings.tmp_directory, input_path.name + ".chunks"),
+                                         settings.jumpcut_chunks,
+                                         settings.silent_threshold, settings.jumpcut_margin, settings.silent_speed,
+                                         Progress(f"Conversion of {filename}"))
+        else:
+            ffmpeg = jumpcut.cut(input_path, output_file_path_jc,
+                                 settings.silent_threshold, settings.jumpcut_margin, settings.silent_speed,
+                                 Progress(f"Conversion of {filename}"))
+        error = ffmpeg.stderr.decode('utf-8', 'replace') if ffmpeg.returncode != 0 else None
+        outcome = retry.classify_process(ffmpeg.returncode, error) if error else retry.SUCCEEDED
+    except jumpcut.JumpCutError as jump_cut_error:
+        error = str(jump_cut_error)
+        outcome = retry.PERMANENT  # Silent or broken input, another try won't change that
 
-    semaphore.release()  # Release lock
+    if error:  # Print debug output in case of error
+        print(f"Error during conversion of \"{filename}\" with the jump-cut engine:", file=sys.stderr)
+        print(f"Playlist file: {playlist_url}", file=sys.stderr)
+        print(f"Reading from: {input_path}", file=sys.stderr)
+        print(f"Designated output location: {output_file_path_jc}", file=sys.stderr)
+        print(f"Error: {error}", file=sys.stderr)
+    return outcome
@@ -0,0 +1,458 @@
+import hashlib
+import json
+import re
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from progress import Progress, run_ffmpeg
+
+REQUEST_TIMEOUT = (10, 60)  # (connect, read) in seconds
+QUALITY_POLICIES = ("best", "max-height", "max-bandwidth", "audio-only")
+
+
+class PlaylistError(Exception):
+    pass
+
+
+class StalledError(requests.Timeout):
+    # Retried like any other timeout, a new connection usually gets a stuck stream going again
+    pass
+
+
+def create_session(pool_size: int) -> requests.Session:
+    # One keep-alive connection per segment worker, so parallel fetches never queue on the pool
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=3)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _attributes(line: str) -> dict[str, str]:
+    # Parses 'KEY=value,KEY2="quoted,value"' attribute lists of HLS tags
+    attributes = {}
+    for key, value in re.findall(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)', line.split(':', 1)[1]):
+        attributes[key] = value.strip('"')
+    return attributes
+
+
+def is_master_playlist(text: str) -> bool:
+    return "#EXT-X-STREAM-INF" in text
+
+
+def parse_master_playlist(playlist_url: str, text: str) -> [(dict[str, str], str)]:
+    # Returns the variant streams as (attributes, absolute_url)
+    variants: [(dict[str, str], str)] = []
+    attributes = None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("#EXT-X-STREAM-INF"):
+            attributes = _attributes(line)
+        elif line and not line.startswith('#') and attributes is not None:
+            variants.append((attributes, urljoin(playlist_url, line)))
+            attributes = None
+    return variants
+
+
+def parse_media_playlist(playlist_url: str, text: str) -> [(str, float)]:
+    # Returns the media segments as (absolute_url, duration_in_seconds)
+    if not text.lstrip().startswith("#EXTM3U"):
+        raise PlaylistError(f"Not an HLS playlist: {playlist_url}")
+    if "#EXT-X-KEY:METHOD=AES" in text or "#EXT-X-MAP" in text:
+        # Encrypted or fragmented-mp4 playlists can't be joined with the concat demuxer
+        raise PlaylistError(f"Unsupported playlist features (encryption or init segment): {playlist_url}")
+    segments: [(str, float)] = []
+    duration = 0.0
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("#EXTINF:"):
+            duration = float(line[len("#EXTINF:"):].split(',', 1)[0])
+        elif line and not line.startswith('#'):
+            segments.append((urljoin(playlist_url, line), duration))
+            duration = 0.0
+    if not segments:
+        raise PlaylistError(f"Playlist contains no segments: {playlist_url}")
+    return segments
+
+
+def parse_master_audio_renditions(playlist_url: str, text: str) -> [(dict[str, str], str)]:
+    # Returns the alternative audio renditions (EXT-X-MEDIA with TYPE=AUDIO) as (attributes, absolute_url)
+    renditions: [(dict[str, str], str)] = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("#EXT-X-MEDIA:"):
+            attributes = _attributes(line)
+            if attributes.get('TYPE') == "AUDIO" and attributes.get('URI'):
+                renditions.append((attributes, urljoin(playlist_url, attributes['URI'])))
+    return renditions
+
+
+def parse_quality(policy: str) -> (str, int | None):
+    # "best", "audio-only", "max-height:720" or "max-bandwidth:2M" -> (kind, limit)
+    kind, _, limit = policy.strip().partition(':')
+    if kind not in QUALITY_POLICIES:
+        raise ValueError(f"Unknown quality policy: {policy}")
+    if kind in ("best", "audio-only"):
+        if limit:
+            raise ValueError(f"Quality policy {kind} takes no limit: {policy}")
+        return kind, None
+    number, multiplier = limit, 1
+    if kind == "max-bandwidth" and limit[-1:] in ("k", "M"):  # Bandwidth in bits per second, like in the playlist
+        number, multiplier = limit[:-1], {"k": 1_000, "M": 1_000_000}[limit[-1]]
+    try:
+        value = int(float(number) * multiplier)
+    except ValueError:
+        value = 0
+    if value <= 0:
+        raise ValueError(f"Quality policy {kind} needs a positive number, like "
+                         f"{'max-height:720' if kind == 'max-height' else 'max-bandwidth:2M'}: {policy}")
+    return kind, value
+
+
+def _height(attributes: dict[str, str]) -> int | None:
+    resolution = attributes.get('RESOLUTION', '')
+    return int(resolution.split('x')[1]) if re.fullmatch(r'\d+x\d+', resolution) else None
+
+
+def _bandwidth(attributes: dict[str, str]) -> int:
+    return int(attributes.get('BANDWIDTH', 0))
+
+
+def select_variant(playlist_url: str, text: str, quality: str = "best") -> str:
+    # Picks the URL of the media playlist to download according to a quality policy
+    return _select_variant(playlist_url, text, quality)[1]
+
+
+def _select_variant(playlist_url: str, text: str, quality: str) -> (dict[str, str], str):
+    # Limits that no variant satisfies fall back to the smallest variant
+    variants = parse_master_playlist(playlist_url, text)
+    if not variants:
+        raise PlaylistError(f"Master playlist without variants: {playlist_url}")
+    kind, limit = parse_quality(quality)
+    if kind == "audio-only":
+        renditions = parse_master_audio_renditions(playlist_url, text)
+        if renditions:  # A separate audio rendition, the default one if there is a choice
+            return max(renditions, key=lambda rendition: rendition[0].get('DEFAULT') == "YES")
+        # Muxed variants only, the video of the smallest one is dropped when remuxing
+        return min(variants, key=lambda variant: _bandwidth(variant[0]))
+    if kind == "max-height":
+        with_height = [variant for variant in variants if _height(variant[0]) is not None]
+        if with_height:
+            fitting = [variant for variant in with_height if _height(variant[0]) <= limit]
+            if not fitting:
+                return min(with_height, key=lambda variant: (_height(variant[0]), _bandwidth(variant[0])))
+            variants = fitting
+    elif kind == "max-bandwidth":
+        fitting = [variant for variant in variants if _bandwidth(variant[0]) <= limit]
+        if not fitting:
+            return min(variants, key=lambda variant: _bandwidth(variant[0]))
+        variants = fitting
+    # Same choice ffmpeg makes by default: the variant with the highest bandwidth
+    return max(variants, key=lambda variant: _bandwidth(variant[0]))
+
+
+def audio_rendition(playlist_url: str, text: str, attributes: dict[str, str]) -> str | None:
+    # URL of the audio rendition a variant plays its audio from, None if the audio is muxed into the variant
+    if 'AUDIO' not in attributes:
+        return None
+    group = [rendition for rendition in parse_master_audio_renditions(playlist_url, text)
+             if rendition[0].get('GROUP-ID') == attributes['AUDIO']]
+    if not group:  # Renditions without URI are muxed into the variants
+        return None
+    return max(group, key=lambda rendition: rendition[0].get('DEFAULT') == "YES")[1]
+
+
+def resolve_media_playlists(session: requests.Session, playlist_url: str, quality: str = "best") -> [(str, str)]:
+    # Follows a master playlist to one of its variants and, if the variant's audio is a rendition of its own,
+    # to that as well. Returns (media_playlist_url, media_playlist_text) of the variant first, then of the audio
+    response = session.get(playlist_url, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    if not is_master_playlist(response.text):
+        return [(playlist_url, response.text)]
+    attributes, variant_url = _select_variant(playlist_url, response.text, quality)
+    media_playlist_urls = [variant_url]
+    if audio_url := audio_rendition(playlist_url, response.text, attributes):
+        media_playlist_urls.append(audio_url)
+    media_playlists = []
+    for media_playlist_url in media_playlist_urls:
+        response = session.get(media_playlist_url, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        media_playlists.append((media_playlist_url, response.text))
+    return media_playlists
+
+
+def resolve_media_playlist(session: requests.Session, playlist_url: str, quality: str = "best") -> (str, str):
+    # Follows a master playlist to one of its variants, returns (media_playlist_url, media_playlist_text)
+    return resolve_media_playlists(session, playlist_url, quality)[0]
+
+
+def estimate_size(session: requests.Session, playlist_url: str, quality: str = "best") -> int | None:
+    # Estimates the bytes a download will take, from the BANDWIDTH of the variant times the playlist duration
+    # Playlists without BANDWIDTH are estimated from the size of their first segment, None if that's unknown as well
+    response = session.get(playlist_url, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    media_playlist_url, media_playlist, bandwidth = playlist_url, response.text, 0
+    if is_master_playlist(response.text):
+        attributes, media_playlist_url = _select_variant(playlist_url, response.text, quality)
+        bandwidth = _bandwidth(attributes)  # Peak bit rate, so the estimate errs on the large side
+        response = session.get(media_playlist_url, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        media_playlist = response.text
+    segments = parse_media_playlist(media_playlist_url, media_playlist)
+    duration = sum(segment_duration for _, segment_duration in segments)
+    if bandwidth and duration:
+        return int(bandwidth / 8 * duration)
+
+    first_segment_url, first_segment_duration = segments[0]
+    response = session.head(first_segment_url, timeout=REQUEST_TIMEOUT, allow_redirects=True)
+    if not response.ok or not int(response.headers.get('Content-Length', 0)):
+        return None
+    segment_size = int(response.headers['Content-Length'])
+    if first_segment_duration and duration:
+        return int(segment_size / first_segment_duration * duration)
+    return segment_size * len(segments)
+
+
+def _segment_path(segment_directory: Path, index: int) -> Path:
+    return Path(segment_directory, f"{index:05d}.ts")
+
+
+class Journal:
+    # Append-only record of the segments that were completely fetched, so an interrupted download can resume
+    # Line 1 describes the playlist, every further line one segment: {"index": ..., "size": ..., "sha256": ...}
+
+    def __init__(self, segment_directory: Path, playlist_url: str, segments: [(str, float)]):
+        self.path = Path(segment_directory, "journal.jsonl")
+        self.lock = threading.Lock()
+        # Playlist URLs carry expiring tokens, so we identify a playlist without its query string
+        # The variants of a master playlist often share their segment names, only their playlist URLs differ
+        self.header = {"playlist": playlist_url.split('?', 1)[0],
+                       "segments": [url.split('?', 1)[0].rsplit('/', 1)[-1] for url, _ in segments]}
+        self.entries: dict[int, dict] = {}
+
+    def load(self) -> dict[int, dict]:
+        if not self.path.exists():
+            return {}
+        with open(self.path, 'r') as journal:
+            lines = journal.read().splitlines()
+        try:
+            if not lines or json.loads(lines[0]) != self.header:
+                return {}  # Different playlist, nothing to resume
+        except json.JSONDecodeError:
+            return {}
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                break  # Torn write of the last line during a crash
+            self.entries[entry['index']] = entry
+        return self.entries
+
+    def start(self):
+        with open(self.path, 'w') as journal:
+            journal.write(json.dumps(self.header) + "\n")
+            for entry in self.entries.values():
+                journal.write(json.dumps(entry) + "\n")
+
+    def record(self, index: int, size: int, sha256: str):
+        entry = {"index": index, "size": size, "sha256": sha256}
+        with self.lock, open(self.path, 'a') as journal:
+            journal.write(json.dumps(entry) + "\n")
+            journal.flush()
+            self.entries[index] = entry
+
+
+def _checksum(path: Path) -> (int, str):
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as file:
+        while chunk := file.read(1 << 20):
+            digest.update(chunk)
+            size += len(chunk)
+    return size, digest.hexdigest()
+
+
+def verified_segments(journal: Journal, segment_directory: Path) -> set[int]:
+    # Segments listed in the journal whose file on disk still has the recorded size and checksum
+    verified = set()
+    for index, entry in journal.load().items():
+        segment_path = _segment_path(segment_directory, index)
+        if segment_path.exists() and _checksum(segment_path) == (entry['size'], entry['sha256']):
+            verified.add(index)
+    journal.entries = {index: journal.entries[index] for index in verified}
+    return verified
+
+
+class Streams:
+    # The segment responses a download is reading from, so a watchdog can abort them
+    # A stream that trickles in a few bytes at a time never runs into the read timeout
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.responses: set[requests.Response] = set()
+        self.aborted = False
+
+    def open(self, response: requests.Response):
+        with self.lock:
+            if self.aborted:
+                raise StalledError("Download stalled")
+            self.responses.add(response)
+
+    def close(self, response: requests.Response):
+        with self.lock:
+            self.responses.discard(response)
+
+    def abort(self):
+        with self.lock:
+            self.aborted = True
+            for response in self.responses:
+                try:
+                    response.raw.shutdown()  # Wakes up the thread blocked in reading from it
+                except (AttributeError, ValueError, RuntimeError):
+                    response.close()  # urllib3 < 2.3 can't shut down a response from another thread
+
+
+def _watch(streams: Streams, progress: Progress, stall_timeout: float, finished: threading.Event):
+    while not finished.wait(1):
+        if progress.stalled_for() > stall_timeout:
+            streams.abort()
+            return
+
+
+def fetch_segment(session: requests.Session, url: str, destination: Path,
+                  on_first_byte: Callable[[], None] | None = None, progress: Progress | None = None,
+                  streams: Streams | None = None) -> (int, str):
+    if streams and streams.aborted:
+        raise StalledError("Download stalled")  # Queued before the download was aborted
+    partial_path = Path(destination.as_posix() + ".part")
+    digest = hashlib.sha256()
+    size = 0
+    with session.get(url, stream=True, timeout=REQUEST_TIMEOUT) as response:
+        response.raise_for_status()
+        if streams:
+            streams.open(response)
+        if on_first_byte:
+            on_first_byte()
+        with open(partial_path, 'wb') as file:
+            for chunk in response.iter_content(chunk_size=1 << 16):
+                file.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
+                if progress:
+                    progress.add(size=len(chunk))
+        if streams:
+            streams.close(response)
+            if streams.aborted:
+                raise StalledError("Download stalled")  # The segment may be cut off
+    partial_path.replace(destination)  # Only complete segments ever carry their final name
+    return size, digest.hexdigest()
+
+
+def _fetch_and_record(session: requests.Session, url: str, duration: float, index: int, segment_directory: Path,
+                      journal: Journal, on_first_byte: Callable[[], None] | None, progress: Progress | None,
+                      streams: Streams | None) -> int:
+    size, sha256 = fetch_segment(session, url, _segment_path(segment_directory, index), on_first_byte, progress,
+                                 streams)
+    journal.record(index, size, sha256)
+    if progress:
+        progress.add(out_time=duration)
+    return size
+
+
+def fetch_segments(session: requests.Session, playlist_url: str, segments: [(str, float)],
+                   segment_directory: Path, workers: int, on_first_byte: Callable[[], None] | None = None,
+                   progress: Progress | None = None, stall_timeout: float | None = None) -> int:
+    # Fetches all segments that aren't already in the journal, returns the number of bytes fetched
+    # If no byte arrives for stall_timeout seconds, all open streams are aborted and StalledError is raised
+    segment_directory.mkdir(parents=True, exist_ok=True)
+    journal = Journal(segment_directory, playlist_url, segments)
+    already_fetched = verified_segments(journal, segment_directory)
+    journal.start()
+    if already_fetched:
+        print(f"Resuming download with {len(already_fetched)}/{len(segments)} segments already fetched")
+    if progress:
+        progress.duration = sum(duration for _, duration in segments)
+        progress.add(out_time=sum(segments[index][1] for index in already_fetched))
+    streams = finished = None
+    if stall_timeout:
+        progress = progress or Progress(None)
+        streams, finished = Streams(), threading.Event()
+        threading.Thread(target=_watch, args=(streams, progress, stall_timeout, finished), daemon=True).start()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_fetch_and_record, session, url, duration, index, segment_directory, journal,
+                                       on_first_byte, progress, streams)
+                       for index, (url, duration) in enumerate(segments) if index not in already_fetched]
+            try:
+                for future in as_completed(futures):
+                    future.result()  # Re-raises the first failed fetch as soon as it fails
+            except BaseException as error:
+                executor.shutdown(wait=True, cancel_futures=True)  # A 403 or a full disk fails the queued ones as well
+                if isinstance(error, (requests.RequestException, OSError)) and streams and streams.aborted:
+                    # The aborted streams fail with all kinds of connection errors
+                    raise StalledError(f"No progress for {stall_timeout:.0f}s, aborted the download")
+                raise
+            return sum(future.result() for future in futures)
+    finally:
+        if finished:
+            finished.set()
+
+
+def write_concat_list(segment_count: int, segment_directory: Path) -> Path:
+    concat_list_path = Path(segment_directory, "concat.txt")
+    with open(concat_list_path, 'w') as concat_list:
+        for index in range(segment_count):
+            concat_list.write(f"file '{_segment_path(segment_directory, index).name}'\n")
+    return concat_list_path
+
+
+def remux(concat_list_path: Path, output_path: Path, audio_only: bool = False,
+          audio_concat_list_path: Path | None = None) -> subprocess.CompletedProcess:
+    # The segments of a separate audio rendition are joined as a second input and muxed in
+    audio_input = ['-f', 'concat', '-safe', '0', '-i', audio_concat_list_path] if audio_concat_list_path else []
+    return run_ffmpeg([
+        'ffmpeg',
+        '-y',  # Overwrite output file if it already exists
+        '-f', 'concat',  # Join the local segments
+        '-safe', '0',  # Allow absolute paths in the concat list
+        '-i', concat_list_path,  # Input file
+        *audio_input,  # Audio rendition
+        *(['-map', '0:v', '-map', '1:a'] if audio_concat_list_path else []),  # Video of the variant, separate audio
+        *(['-vn'] if audio_only else []),  # Drop the video of muxed variants
+        '-c', 'copy',  # Codec name
+        '-f', 'mp4',  # Force mp4 as output file format
+        output_path  # Output file
+    ])
+
+
+def download(playlist_url: str, segment_directory: Path, output_path: Path, workers: int,
+             on_first_byte: Callable[[], None] | None = None, quality: str = "best",
+             progress: Progress | None = None, stall_timeout: float | None = None) -> int:
+    # Downloads all segments of an HLS playlist in parallel and remuxes them into a single mp4
+    # Returns the number of bytes fetched
+    with create_session(workers) as session:
+        (media_playlist_url, media_playlist), *audio_playlists = resolve_media_playlists(session, playlist_url, quality)
+        segments = parse_media_playlist(media_playlist_url, media_playlist)
+        fetched_bytes = fetch_segments(session, media_playlist_url, segments, segment_directory, workers,
+                                       on_first_byte, progress, stall_timeout)
+        audio_concat_list_path = None
+        for audio_playlist_url, audio_playlist in audio_playlists:  # Demuxed audio, fetched next to the video
+            audio_segments = parse_media_playlist(audio_playlist_url, audio_playlist)
+            audio_directory = Path(segment_directory, "audio")
+            fetched_bytes += fetch_segments(session, audio_playlist_url, audio_segments, audio_directory, workers,
+                                            progress=Progress(None, counter=progress.counter) if progress else None,
+                                            stall_timeout=stall_timeout)
+            audio_concat_list_path = write_concat_list(len(audio_segments), audio_directory)
+
+    concat_list_path = write_concat_list(len(segments), segment_directory)
+    ffmpeg = remux(concat_list_path, output_path, quality == "audio-only", audio_concat_list_path)
+    if ffmpeg.returncode != 0:
+        raise PlaylistError(f"Remuxing of {len(segments)} segments failed:\n{ffmpeg.stderr.decode('utf-8', 'replace')}")
+    return fetched_bytes
@@ -0,0 +1,274 @@
+import json
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from progress import Progress, run_ffmpeg
+
+SAMPLE_RATE = 8000  # Plenty to tell speech from silence, keeps a 90-minute lecture below 100 MB of samples
+CUT_OUT_SPEED = 99999  # Like auto-editor: silent sections with this speed are removed entirely
+
+
+class JumpCutError(Exception):
+    pass
+
+
+def probe(input_path: Path) -> (float, bool):
+    # Returns (frames_per_second, has_video) of a video file
+    ffprobe = subprocess.run([
+        'ffprobe',
+        '-v', 'error',
+        '-show_entries', 'stream=codec_type,avg_frame_rate',
+        '-of', 'json',
+        input_path
+    ], capture_output=True)
+    if ffprobe.returncode != 0:
+        raise JumpCutError(f"Could not probe {input_path}:\n{ffprobe.stderr.decode('utf-8', 'replace')}")
+    streams = json.loads(ffprobe.stdout)['streams']
+    video_streams = [stream for stream in streams if stream['codec_type'] == 'video']
+    if not any(stream['codec_type'] == 'audio' for stream in streams):
+        raise JumpCutError(f"{input_path} has no audio track to detect silence in")
+    if not video_streams:
+        return 25.0, False  # Audio-only, the frame rate just sets the resolution of the cut list
+    numerator, denominator = video_streams[0]['avg_frame_rate'].split('/')
+    return (float(numerator) / float(denominator) if float(denominator) else 25.0), True
+
+
+def video_duration(input_path: Path) -> float | None:
+    # Returns the length of a video file in seconds, None if ffprobe can't tell
+    try:
+        ffprobe = subprocess.run([
+            'ffprobe',
+            '-v', 'error',
+            '-show_entries', 'format=duration',
+            '-of', 'json',
+            input_path
+        ], capture_output=True)
+        return float(json.loads(ffprobe.stdout)['format']['duration'])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def loudness(input_path: Path, frames_per_second: float) -> np.ndarray:
+    # Returns the peak amplitude of every video frame's worth of audio, normalized to [0, 1]
+    ffmpeg = subprocess.run([
+        'ffmpeg',
+        '-v', 'error',  # stdout carries the samples, keep the log on stderr short
+        '-i', input_path,  # Input file
+        '-vn',  # Only decode the audio track
+        '-ac', '1',  # Mix down to mono
+        '-ar', str(SAMPLE_RATE),  # Resample
+        '-f', 's16le',  # Raw samples
+        'pipe:1'
+    ], capture_output=True)
+    if ffmpeg.returncode != 0:
+        raise JumpCutError(f"Could not decode the audio of {input_path}:\n{ffmpeg.stderr.decode('utf-8', 'replace')}")
+    samples = np.frombuffer(ffmpeg.stdout, dtype=np.int16)
+    if not samples.size:
+        raise JumpCutError(f"{input_path} has an empty audio track")
+
+    frame_count = max(1, int(np.ceil(samples.size * frames_per_second / SAMPLE_RATE)))
+    frame_starts = np.minimum((np.arange(frame_count) * SAMPLE_RATE / frames_per_second).astype(np.int64),
+                              samples.size - 1)
+    # Peak per frame without materializing abs() of all samples
+    peaks = np.maximum(np.maximum.reduceat(samples, frame_starts).astype(np.int32),
+                       -np.minimum.reduceat(samples, frame_starts).astype(np.int32))
+    loudest = peaks.max()
+    return peaks / loudest if loudest else peaks.astype(np.float64)
+
+
+def cut_list(frame_loudness: np.ndarray, frames_per_second: float,
+             threshold: float, margin: float, silent_speed: float) -> [(float, float)]:
+    # Returns the sections of the video as (start_in_seconds, speed), each section lasts until the next one starts
+    loud = frame_loudness > threshold
+    margin_frames = int(round(margin * frames_per_second))
+    if margin_frames:  # Keep a bit of silence around everything that's loud, so words aren't clipped
+        loud = np.convolve(loud, np.ones(2 * margin_frames + 1, dtype=np.int32), mode='same') > 0
+    section_starts = np.concatenate(([0], np.flatnonzero(np.diff(loud.astype(np.int8))) + 1))
+    return [(float(start / frames_per_second), 1.0 if loud[start] else silent_speed) for start in section_starts]
+
+
+def _atempo_chain(speed: float) -> str:
+    # atempo only accepts factors up to 2 in older ffmpeg versions
+    factors = []
+    while speed > 2:
+        factors.append(2.0)
+        speed /= 2
+    factors.append(speed)
+    return ",".join(f"atempo={factor:.6f}" for factor in factors)
+
+
+def filter_script(cuts: [(float, float)], frames_per_second: float, video: bool = True, audio: bool = True) -> str:
+    # One filter graph that splits the streams at the section borders, retimes every section and joins them again
+    # Every frame passes the graph exactly once, so the whole video is rendered in a single encode
+    timestamps = "|".join(f"{start:.6f}" for start, _ in cuts[1:])
+    lines = []
+    video_labels = "".join(f"[v{index}]" for index in range(len(cuts)))
+    audio_labels = "".join(f"[a{index}]" for index in range(len(cuts)))
+    if video:
+        lines.append(f"[0:v]segment=timestamps={timestamps}{video_labels};" if len(cuts) > 1 else "[0:v]null[v0];")
+    if audio:
+        lines.append(f"[0:a]asegment=timestamps={timestamps}{audio_labels};" if len(cuts) > 1 else "[0:a]anull[a0];")
+
+    inputs = ""
+    kept_sections = 0
+    for index, (_, speed) in enumerate(cuts):
+        if speed >= CUT_OUT_SPEED:
+            lines += [f"[v{index}]nullsink;"] if video else []
+            lines += [f"[a{index}]anullsink;"] if audio else []
+            continue
+        if video:
+            lines.append(f"[v{index}]setpts=(PTS-STARTPTS)/{speed:.6f}[vs{index}];")
+            inputs += f"[vs{index}]"
+        if audio:
+            lines.append(f"[a{index}]asetpts=PTS-STARTPTS,{_atempo_chain(speed)}[as{index}];")
+            inputs += f"[as{index}]"
+        kept_sections += 1
+
+    if video:
+        lines.append(f"{inputs}concat=n={kept_sections}:v=1:a={int(audio)}[vcat]{'[aout]' if audio else ''};")
+        lines.append(f"[vcat]fps={frames_per_second:.6f}[vout]")  # Drop the frames that got too close together
+    else:
+        lines.append(f"{inputs}concat=n={kept_sections}:v=0:a=1[aout]")
+    return "\n".join(lines)
+
+
+def output_duration(cuts: [(float, float)], input_duration: float) -> float:
+    # Length of the video after the silent sections were sped up or cut out
+    section_ends = [start for start, _ in cuts[1:]] + [input_duration]
+    return sum((end - start) / speed for (start, speed), end in zip(cuts, section_ends) if speed < CUT_OUT_SPEED)
+
+
+def render(input_path: Path, output_path: Path, cuts: [(float, float)], frames_per_second: float,
+           video: bool = True, audio: bool = True,
+           start: float | None = None, end: float | None = None,
+           progress: Progress | None = None) -> subprocess.CompletedProcess:
+    # Renders the cut list of the input (or of the part between start and end) in a single encode
+    script_path = Path(output_path.as_posix() + ".filter")
+    script_path.write_text(filter_script(cuts, frames_per_second, video, audio))
+    try:
+        return run_ffmpeg([
+            'ffmpeg',
+            '-y',  # Overwrite output file if it already exists
+            *(['-ss', f'{start:.6f}'] if start is not None else []),  # Seek to the chunk (a keyframe)
+            *(['-to', f'{end:.6f}'] if end is not None else []),  # End of the chunk
+            '-i', input_path,  # Input file
+            '-filter_complex_script', script_path,  # Our cut list as filter graph
+            *(['-map', '[vout]', '-c:v', 'libx264'] if video else []),  # Video codec
+            *(['-map', '[aout]', '-c:a', 'aac'] if audio else []),  # Audio codec
+            '-f', 'mp4',  # Force mp4 as output file format
+            output_path  # Output file
+        ], progress)
+    finally:
+        script_path.unlink(missing_ok=True)
+
+
+def cut(input_path: Path, output_path: Path,
+        threshold: float, margin: float, silent_speed: float,
+        progress: Progress | None = None) -> subprocess.CompletedProcess:
+    # Speeds up (or removes) the silent sections of a video, like auto-editor does
+    frames_per_second, has_video = probe(input_path)
+    frame_loudness = loudness(input_path, frames_per_second)
+    cuts = cut_list(frame_loudness, frames_per_second, threshold, margin, silent_speed)
+    if all(speed >= CUT_OUT_SPEED for _, speed in cuts):
+        raise JumpCutError(f"{input_path} is silent throughout, nothing would be left")
+    if progress:
+        progress.duration = output_duration(cuts, len(frame_loudness) / frames_per_second)
+    return render(input_path, output_path, cuts, frames_per_second, video=has_video, progress=progress)
+
+
+def keyframes(input_path: Path) -> [float]:
+    # Timestamps of the video keyframes, read from the packet headers without decoding anything
+    ffprobe = subprocess.run([
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,flags',
+        '-of', 'csv=p=0',
+        input_path
+    ], capture_output=True)
+    if ffprobe.returncode != 0:
+        raise JumpCutError(f"Could not read the keyframes of {input_path}:\n{ffprobe.stderr.decode('utf-8', 'replace')}")
+    return sorted(float(pts_time) for pts_time, flags, *_ in
+                  (line.split(',') for line in ffprobe.stdout.decode('utf-8').splitlines())
+                  if 'K' in flags and pts_time not in ('', 'N/A'))
+
+
+def chunk_borders(keyframe_times: [float], chunks: int) -> [float]:
+    # Splits the video at the keyframes closest to equally long chunks, returns the start of every chunk
+    if len(keyframe_times) < 2:
+        return [0.0]
+    duration = keyframe_times[-1]
+    borders = {0.0}
+    for index in range(1, chunks):
+        borders.add(min(keyframe_times, key=lambda keyframe: abs(keyframe - index * duration / chunks)))
+    return sorted(borders)
+
+
+def chunk_cuts(cuts: [(float, float)], start: float, end: float | None) -> [(float, float)]:
+    # The sections of the cut list that overlap a chunk, relative to the start of the chunk
+    chunk_sections = []
+    for index, (section_start, speed) in enumerate(cuts):
+        section_end = cuts[index + 1][0] if index + 1 < len(cuts) else float('inf')
+        if section_end <= start or (end is not None and section_start >= end):
+            continue
+        chunk_sections.append((max(section_start, start) - start, speed))
+    return chunk_sections
+
+
+def cut_chunked(input_path: Path, output_path: Path, work_directory: Path, chunks: int,
+                threshold: float, margin: float, silent_speed: float,
+                progress: Progress | None = None) -> subprocess.CompletedProcess:
+    # Like cut(), but the video is encoded in chunks on several cores
+    # The audio track is rendered in one piece next to the video chunks, so there are no gaps at the chunk borders
+    # The encodes are ffmpeg processes, the threads only wait for them. Every chunk adds its progress to the
+    # progress of the whole video and is killed on its own if it stalls
+    frames_per_second, has_video = probe(input_path)
+    frame_loudness = loudness(input_path, frames_per_second)
+    cuts = cut_list(frame_loudness, frames_per_second, threshold, margin, silent_speed)
+    if all(speed >= CUT_OUT_SPEED for _, speed in cuts):
+        raise JumpCutError(f"{input_path} is silent throughout, nothing would be left")
+    if progress:
+        progress.duration = output_duration(cuts, len(frame_loudness) / frames_per_second)
+    if not has_video:
+        return render(input_path, output_path, cuts, frames_per_second, video=False, progress=progress)
+
+    borders = chunk_borders(keyframes(input_path), chunks)
+    work_directory.mkdir(parents=True, exist_ok=True)
+    audio_path = Path(work_directory, "audio.m4a")
+    chunk_paths = [Path(work_directory, f"chunk_{index:03d}.mp4") for index in range(len(borders))]
+    try:
+        with ThreadPoolExecutor(max_workers=len(borders) + 1) as executor:
+            audio = executor.submit(render, input_path, audio_path, cuts, frames_per_second, False, True)
+            rendered_chunks = []
+            for index, start in enumerate(borders):
+                end = borders[index + 1] if index + 1 < len(borders) else None
+                sections = chunk_cuts(cuts, start, end)
+                if all(speed >= CUT_OUT_SPEED for _, speed in sections):
+                    continue  # Nothing of this chunk is left
+                rendered_chunks.append((chunk_paths[index], executor.submit(
+                    render, input_path, chunk_paths[index], sections, frames_per_second, True, False, start, end,
+                    Progress(None, parent=progress) if progress else None)))
+
+            for chunk_path, rendered_chunk in [(audio_path, audio)] + rendered_chunks:
+                if rendered_chunk.result().returncode != 0:
+                    raise JumpCutError(f"Rendering {chunk_path.name} failed:\n"
+                                       f"{rendered_chunk.result().stderr.decode('utf-8', 'replace')}")
+
+        concat_list_path = Path(work_directory, "concat.txt")
+        concat_list_path.write_text("".join(f"file '{chunk_path.name}'\n" for chunk_path, _ in rendered_chunks))
+        return run_ffmpeg([
+            'ffmpeg',
+            '-y',  # Overwrite output file if it already exists
+            '-f', 'concat', '-safe', '0', '-i', concat_list_path,  # Video chunks
+            '-i', audio_path,  # Audio in one piece
+            '-map', '0:v', '-map', '1:a',
+            '-c', 'copy',  # Everything is encoded already
+            '-f', 'mp4',  # Force mp4 as output file format
+            output_path  # Output file
+        ])
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
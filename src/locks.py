@@ -0,0 +1,211 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from pathlib import Path
+
+"""We use locks to prevent processing the same video twice (e.g. if we run in multiple independent instances)"""
+"""Locks can also be created by the user to keep us from downloading a specific video"""
+"""Our own locks are leases: they are claimed atomically, renewed by a heartbeat and taken over once it stops"""
+
+LOCK_TIMEOUT = 30 * 60  # Seconds without a heartbeat after which a lock counts as abandoned, on any host
+
+_held: dict[Path, str] = {}  # Leases claimed by this process and their tokens, renewed while they exist
+_held_lock = threading.Lock()
+_timeout = LOCK_TIMEOUT
+_heartbeat_pid = None  # Process that runs the heartbeat thread, forked workers start their own
+
+
+def lock_path(output_file_path: Path) -> Path:
+    return Path(output_file_path.as_posix() + ".lock")
+
+
+def set_timeout(timeout: float):
+    global _timeout
+    _timeout = timeout
+
+
+def _lease(token: str, pid: int | None) -> str:
+    # Our own locks carry their owner, so a later run can tell a crashed run's lock apart from a user's lock
+    # The heartbeat lets runs on other hosts tell an abandoned lock apart from a long download
+    return json.dumps({"host": socket.gethostname(), "pid": pid, "token": token, "heartbeat": time.time()})
+
+
+def _write_temporary(path: Path, token: str, in_transit: bool = False) -> Path:
+    # A lease in transit between two workers has no PID, only its heartbeat can expire it
+    temporary_path = Path(f"{path.as_posix()}.{token}.tmp")  # Unique per lease, several nodes may write at once
+    with open(temporary_path, 'w') as lock_file:
+        lock_file.write(_lease(token, None if in_transit else os.getpid()))
+    return temporary_path
+
+
+def _claim(path: Path, token: str) -> bool:
+    # Hard links are created atomically and fail if the target exists, even on NFS
+    # The lease is complete before it becomes visible, so nobody ever sees an empty (user-created looking) lock
+    temporary_path = _write_temporary(path, token)
+    try:
+        os.link(temporary_path, path)
+        return True
+    except FileExistsError:
+        return False
+    finally:
+        temporary_path.unlink(missing_ok=True)
+
+
+def _take_over(path: Path, stale_lease: str, token: str) -> bool:
+    # Moves an abandoned lease out of the way, only one of the nodes racing for it can succeed with the rename
+    expired_path = Path(f"{path.as_posix()}.{token}.expired")
+    try:
+        path.rename(expired_path)
+    except FileNotFoundError:
+        return _claim(path, token)  # Someone else removed it already
+    try:
+        if expired_path.read_text() != stale_lease:
+            # Between our check and the rename the lease was renewed or claimed by someone else, give it back
+            try:
+                os.link(expired_path, path)
+            except FileExistsError:
+                pass  # Yet another node claimed it in the meantime, that one wins
+            return False
+    finally:
+        expired_path.unlink(missing_ok=True)
+    return _claim(path, token)
+
+
+def acquire(output_file_path: Path) -> bool:
+    # Claims the lease of a video, returns False if someone else (another worker, node or the user) holds it
+    path = lock_path(output_file_path)
+    token = uuid.uuid4().hex
+    if not _claim(path, token):
+        try:
+            stale_lease = path.read_text()
+        except FileNotFoundError:
+            stale_lease = None  # Released just now
+        if stale_lease is None:
+            claimed = _claim(path, token)
+        else:
+            claimed = is_stale(output_file_path) and _take_over(path, stale_lease, token)
+        if not claimed:
+            return False
+    with _held_lock:
+        _held[path] = token
+    _start_heartbeat()
+    return True
+
+
+def _owns(path: Path, token: str | None) -> bool:
+    owner = _owner_of_lock(path)
+    return token is not None and owner is not None and owner.get('token') == token
+
+
+def _renew():
+    # Holds _held_lock throughout, so a lease that remove() or hand_over() let go of is never written again
+    with _held_lock:
+        for path, token in list(_held.items()):
+            if _owns(path, token):
+                _write_temporary(path, token).replace(path)
+                continue
+            del _held[path]
+            if _owner_of_lock(path) is not None:  # Not removed because the video is finished, but replaced while we stalled
+                print(f"Warning: lost the lock {path} to another run")
+
+
+def _start_heartbeat():
+    # Renews the heartbeat of our leases until they are removed or handed over to the next worker
+    global _heartbeat_pid
+    if _heartbeat_pid == os.getpid():
+        return
+    _heartbeat_pid = os.getpid()
+
+    def beat():
+        while True:
+            time.sleep(_timeout / 3)
+            _renew()
+
+    threading.Thread(target=beat, daemon=True).start()
+
+
+def hand_over(output_file_path: Path) -> str | None:
+    # Stops renewing a lease that a worker in another process adopts, returns the token it needs for that
+    # Only one process ever renews and removes a lease, so none of them can bring back a lease another one removed
+    # Renewed one last time, the lease stays valid for the lock timeout while the job waits for its next worker
+    path = lock_path(output_file_path)
+    with _held_lock:
+        token = _held.pop(path, None)
+        if not _owns(path, token):
+            return None
+        _write_temporary(path, token, in_transit=True).replace(path)
+    return token
+
+
+def adopt(output_file_path: Path, token: str | None) -> bool:
+    # Takes over renewing and removing a lease handed over by another worker
+    # Returns False if the lease expired while the job waited and another run claimed it
+    path = lock_path(output_file_path)
+    with _held_lock:
+        if not _owns(path, token):
+            return False
+        _write_temporary(path, token).replace(path)
+        _held[path] = token
+    _start_heartbeat()
+    return True
+
+
+def remove(output_file_path: Path):
+    # Releases a lease we hold, locks of others (another run, the user) stay
+    path = lock_path(output_file_path)
+    with _held_lock:
+        if _owns(path, _held.pop(path, None)):
+            path.unlink(missing_ok=True)
+
+
+def _owner_of_lock(path: Path) -> dict | None:
+    try:
+        with open(path, 'r') as lock_file:
+            owner = json.load(lock_file)
+    except (OSError, ValueError):
+        return None  # Empty or foreign lock, most likely created by the user
+    return owner if isinstance(owner, dict) else None
+
+
+def _owner(output_file_path: Path) -> dict | None:
+    return _owner_of_lock(lock_path(output_file_path))
+
+
+def _process_is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # Exists, but belongs to someone else
+    return True
+
+
+def is_stale(output_file_path: Path) -> bool:
+    # A lock is stale if its heartbeat stopped, or if it was created by a run on this host that is no longer alive
+    owner = _owner(output_file_path)
+    if not owner:
+        return False
+    heartbeat = owner.get('heartbeat')
+    if isinstance(heartbeat, (int, float)) and time.time() - heartbeat > _timeout:
+        return True
+    if owner.get('host') != socket.gethostname():
+        return False
+    pid = owner.get('pid')
+    if not isinstance(pid, int) or pid <= 0:
+        return False
+    if pid == os.getpid():
+        # Restarted containers hand out the same PIDs again, so unless we hold it, it is a leftover
+        return lock_path(output_file_path) not in _held
+    return not _process_is_running(pid)
+
+
+def is_user_lock(output_file_path: Path) -> bool:
+    return lock_path(output_file_path).exists() and _owner(output_file_path) is None
+
+
+def is_locked(output_file_path: Path) -> bool:
+    return lock_path(output_file_path).exists() and not is_stale(output_file_path)
@@ -1,14 +1,30 @@
 import argparse
 import os
 import tempfile
-from multiprocessing import Semaphore
+import time
+from multiprocessing import Value
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Iterator
 
 import yaml
 
+import browser_pool
+import concurrency
+import daemon
 import downloader
+import hls
+import locks
+import metrics
 import panopto
+import profiling
+import progress
 import tum_live
+from catalog import Catalog
+from concurrency import ConcurrencyLimit
+from disk_budget import DiskBudget
+from scheduler import Scheduler
+from session_store import SessionStore
 
 
 def parse_tum_live_subject(s: str) -> (str, str, str):
@@ -40,6 +56,27 @@ def parse_tum_panopto_folder(s: str) -> (str, str):
         raise argparse.ArgumentTypeError("Panopto folders must be in the form: subject_name:panopto_folder_id")
 
 
+def parse_quality_policy(s: str) -> str:
+    try:
+        hls.parse_quality(s)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error))
+    return s
+
+
+def parse_subject_quality(s: str) -> (str | None, str):
+    # Either a quality policy for all subjects, or subject_name:quality_policy
+    try:
+        return None, parse_quality_policy(s)
+    except argparse.ArgumentTypeError:
+        pass
+    try:
+        a, b = s.split(':', 1)
+    except ValueError:
+        raise argparse.ArgumentTypeError("Quality must be in the form: subject_name:quality_policy")
+    return a, parse_quality_policy(b)
+
+
 def parse_command_line_arguments():
     parser = argparse.ArgumentParser(description="Download and jump-cut TUM-Lecture-Videos")
     parser.add_argument("--tum_live",
@@ -57,13 +94,82 @@ def parse_command_line_arguments():
     parser.add_argument("-j", "--jump_cut", type=bool,
                         help="Whether to jump-cut the videos or not. Defaults to True. Optional.")
 
+    parser.add_argument("--jumpcut_engine", choices=["auto-editor", "native"],
+                        help="Jump-cut with auto-editor or with the built-in engine (native). "
+                             "Defaults to auto-editor. Optional.")
+    parser.add_argument("--silent_speed", type=float,
+                        help="Speed of silent sections in jump-cut videos, 99999 removes them. Defaults to 8. Optional.")
+    parser.add_argument("--jumpcut_chunks", type=int,
+                        help="Number of chunks the native engine encodes in parallel per video. "
+                             "Defaults to 1 (no chunking). Optional.")
+
+    parser.add_argument("--quality", type=parse_subject_quality, nargs='+',
+                        help="Variant to download from multi-quality playlists, for all subjects or per subject "
+                             "(subject_name:quality_policy). Policies: best, max-height:N, max-bandwidth:N[k|M], "
+                             "audio-only. Defaults to best. Optional.")
+
     parser.add_argument("-o", "--output_folder", type=Path,
                         help="Path to the output folder. Downloaded and converted videos get saved here.")
     parser.add_argument("-t", "--temp_dir", type=Path,
                         help="Path for temporary files. Defaults to the system specific tmp folder. Optional.")
 
     parser.add_argument("-d", "--maximum_parallel_downloads", type=int,
-                        help="Maximal number of videos to download and convert in parallel. Defaults to 3. Optional.")
+                        help="Maximal number of videos to download in parallel. Defaults to 3. Optional.")
+    parser.add_argument("--minimum_parallel_downloads", type=int,
+                        help="Minimal number of videos to download in parallel. If it is below the maximum, "
+                             "the number is adapted to the measured throughput. "
+                             "Defaults to the maximum (no adaptation). Optional.")
+    parser.add_argument("--stall_timeout", type=float,
+                        help="Seconds without a downloaded byte after which a download is aborted and retried. "
+                             "Defaults to 300. Optional.")
+    parser.add_argument("-e", "--maximum_parallel_conversions", type=int,
+                        help="Maximal number of videos to jump-cut in parallel. "
+                             "Defaults to the number of CPU cores. Optional.")
+    parser.add_argument("-m", "--download_mode", choices=["native", "ffmpeg"],
+                        help="Fetch playlists with the built-in parallel HLS downloader (native) "
+                             "or hand them to ffmpeg (ffmpeg). Defaults to native. Optional.")
+    parser.add_argument("-s", "--segment_workers", type=int,
+                        help="Number of segments to fetch in parallel per video in native mode. "
+                             "Defaults to 8. Optional.")
+
+    parser.add_argument("--scrape_mode", choices=["browser", "http"],
+                        help="Open every TUM-live watch page in the browser (browser) or fetch them concurrently "
+                             "with the browser's session cookies (http). Defaults to browser. Optional.")
+    parser.add_argument("--scrape_workers", type=int,
+                        help="Number of browsers per platform that scrape subjects in parallel. "
+                             "Defaults to 1. Optional.")
+    parser.add_argument("--scrape_worker_memory", type=int,
+                        help="Megabytes a browser may use before it is restarted between two subjects, "
+                             "0 for no limit. Defaults to 2048. Optional.")
+    parser.add_argument("--session_store", type=Path,
+                        help="Folder in which the login sessions are kept (encrypted) between runs. "
+                             "Defaults to OUTPUT_FOLDER/.sessions. Optional.")
+    parser.add_argument("--disk_headroom", type=float,
+                        help="Gigabytes to keep free on the temp and output volumes. Downloads and conversions "
+                             "wait while their estimated size would cut into it. Defaults to 1. Optional.")
+    parser.add_argument("--retry_attempts", type=int,
+                        help="Attempts per download and conversion, failures that can't go away aren't retried. "
+                             "Defaults to 3. Optional.")
+    parser.add_argument("--lock_timeout", type=float,
+                        help="Minutes without a heartbeat after which a lock of another run is taken over. "
+                             "Defaults to 30. Optional.")
+    parser.add_argument("--catalog_ttl", type=float,
+                        help="Hours for which a resolved lecture page is reused instead of visited again. "
+                             "0 disables the catalog. Defaults to 6. Optional.")
+
+    parser.add_argument("--metrics_file", type=Path,
+                        help="JSON-lines file the measurements of every stage are appended to. Optional.")
+    parser.add_argument("--metrics_textfile", type=Path,
+                        help="Prometheus textfile with the totals of the run, e.g. for node_exporter. Optional.")
+    parser.add_argument("--metrics_port", type=int,
+                        help="Port on which the totals of the run are served to Prometheus. Optional.")
+
+    parser.add_argument("--daemon", action="store_true",
+                        help="Keep running and poll every subject on its own schedule, new videos are downloaded "
+                             "as they appear. SIGHUP reloads the config. Optional.")
+    parser.add_argument("--poll_interval", type=float,
+                        help="Minutes between two polls of a subject during lecture hours in daemon mode. "
+                             "Defaults to 15. Optional.")
 
     parser.add_argument("-c", "--config_file", type=Path,
                         help="Path to a config file. Command line arguments take priority over config file. Optional.")
@@ -139,20 +245,277 @@ def parse_keep_original_and_jump_cut(args: argparse.Namespace, cfg) -> (bool, bo
     return keep_original, jump_cut
 
 
-def parse_maximum_parallel_downloads(args: argparse.Namespace, cfg) -> Semaphore:
+def parse_jumpcut_engine(args: argparse.Namespace, cfg) -> (str, int):
+    jumpcut_engine = "auto-editor"
+    jumpcut_chunks = 1
+    if 'Jumpcut-Engine' in cfg:
+        jumpcut_engine = cfg['Jumpcut-Engine']
+    if 'Jumpcut-Chunks' in cfg:
+        jumpcut_chunks = cfg['Jumpcut-Chunks']
+    if args.jumpcut_engine:
+        jumpcut_engine = args.jumpcut_engine
+    if args.jumpcut_chunks:
+        jumpcut_chunks = args.jumpcut_chunks
+    if jumpcut_engine not in ("auto-editor", "native"):
+        raise argparse.ArgumentTypeError("Jump-cut engine must be \"auto-editor\" or \"native\"")
+    if jumpcut_chunks < 1:
+        raise argparse.ArgumentTypeError("Jumpcut-Chunks must be at least 1")
+    if jumpcut_chunks > 1 and jumpcut_engine != "native":
+        print("Jumpcut-Chunks only applies to the native jump-cut engine, ignoring it")
+        jumpcut_chunks = 1
+    return jumpcut_engine, jumpcut_chunks
+
+
+def parse_silence_options(args: argparse.Namespace, cfg) -> (float, float, float):
+    silent_threshold = 0.04  # Same defaults as auto-editor
+    silent_speed = 8
+    jumpcut_margin = 0.2
+    if 'Silent-Threshold' in cfg:
+        silent_threshold = cfg['Silent-Threshold']
+    if 'Silent-Speed' in cfg:
+        silent_speed = cfg['Silent-Speed']
+    if 'Jumpcut-Margin' in cfg:
+        jumpcut_margin = cfg['Jumpcut-Margin']
+    if args.silent_speed:
+        silent_speed = args.silent_speed
+    if silent_speed < 1:
+        raise argparse.ArgumentTypeError("The silent speed must be at least 1")
+    return silent_threshold, silent_speed, jumpcut_margin
+
+
+def parse_jumpcut_options(args: argparse.Namespace, cfg) -> (str, float, float, float, int):
+    (jumpcut_engine, jumpcut_chunks) = parse_jumpcut_engine(args, cfg)
+    (silent_threshold, silent_speed, jumpcut_margin) = parse_silence_options(args, cfg)
+    return jumpcut_engine, silent_threshold, silent_speed, jumpcut_margin, jumpcut_chunks
+
+
+def parse_stall_timeout(args: argparse.Namespace, cfg) -> float:
+    stall_timeout = 300
+    if 'Stall-Timeout' in cfg:
+        stall_timeout = cfg['Stall-Timeout']
+    if args.stall_timeout:
+        stall_timeout = args.stall_timeout
+    if stall_timeout <= 0:
+        raise argparse.ArgumentTypeError("Stall-Timeout must be positive")
+    return stall_timeout
+
+
+def parse_parallel_downloads(args: argparse.Namespace, cfg) -> (int, int, float):
     maximum_parallel_downloads = 3
+    minimum_parallel_downloads = None
     if 'Maximum-Parallel-Downloads' in cfg:
         maximum_parallel_downloads = cfg['Maximum-Parallel-Downloads']
+    if 'Minimum-Parallel-Downloads' in cfg:
+        minimum_parallel_downloads = cfg['Minimum-Parallel-Downloads']
     if args.maximum_parallel_downloads:
         maximum_parallel_downloads = args.maximum_parallel_downloads
-    # Keeps us from using massive amounts of RAM
-    return Semaphore(maximum_parallel_downloads)
+    if args.minimum_parallel_downloads:
+        minimum_parallel_downloads = args.minimum_parallel_downloads
+    if minimum_parallel_downloads is None:
+        minimum_parallel_downloads = maximum_parallel_downloads  # A fixed number of downloads, as configured
+    if minimum_parallel_downloads < 1:
+        raise argparse.ArgumentTypeError("The number of parallel downloads must be at least 1")
+    if maximum_parallel_downloads < minimum_parallel_downloads:
+        raise argparse.ArgumentTypeError("Maximum-Parallel-Downloads must not be below Minimum-Parallel-Downloads")
+    # The maximum is the size of the worker pool, keeps us from using massive amounts of RAM
+    return minimum_parallel_downloads, maximum_parallel_downloads, parse_stall_timeout(args, cfg)
+
+
+def parse_maximum_parallel_conversions(args: argparse.Namespace, cfg) -> int:
+    maximum_parallel_conversions = os.cpu_count() or 1
+    if 'Maximum-Parallel-Conversions' in cfg:
+        maximum_parallel_conversions = cfg['Maximum-Parallel-Conversions']
+    if args.maximum_parallel_conversions:
+        maximum_parallel_conversions = args.maximum_parallel_conversions
+    if maximum_parallel_conversions < 1:
+        raise argparse.ArgumentTypeError("The number of parallel conversions must be at least 1")
+    # Jump-cutting is CPU-bound, so it gets its own pool next to the network-bound downloads
+    return maximum_parallel_conversions
+
+
+def limit_jumpcut_chunks(jumpcut_chunks: int, maximum_parallel_conversions: int) -> int:
+    # Every conversion encodes its chunks at the same time, together they shouldn't run more encodes than CPU cores
+    chunks_per_conversion = max(1, (os.cpu_count() or 1) // maximum_parallel_conversions)
+    if jumpcut_chunks > chunks_per_conversion:
+        print(f"Jumpcut-Chunks is limited to {chunks_per_conversion} with {maximum_parallel_conversions} parallel "
+              f"conversions on {os.cpu_count() or 1} CPU cores")
+        return chunks_per_conversion
+    return jumpcut_chunks
+
+
+def parse_download_mode(args: argparse.Namespace, cfg) -> (str, int):
+    download_mode = "native"
+    segment_workers = 8
+    if 'Download-Mode' in cfg:
+        download_mode = cfg['Download-Mode']
+    if 'Segment-Workers' in cfg:
+        segment_workers = cfg['Segment-Workers']
+    if args.download_mode:
+        download_mode = args.download_mode
+    if args.segment_workers:
+        segment_workers = args.segment_workers
+    if download_mode not in ("native", "ffmpeg"):
+        raise argparse.ArgumentTypeError("Download mode must be \"native\" or \"ffmpeg\"")
+    if segment_workers < 1:
+        raise argparse.ArgumentTypeError("The number of segment workers must be at least 1")
+    return download_mode, segment_workers
+
+
+def parse_quality(args: argparse.Namespace, cfg) -> (str, dict[str, str]):
+    # Returns the default quality policy and the policies of individual subjects
+    default_quality = "best"
+    subject_qualities: dict[str, str] = {}
+    if 'Default-Quality' in cfg:
+        default_quality = parse_quality_policy(cfg['Default-Quality'])
+    if 'Quality' in cfg:
+        subject_qualities.update({key: parse_quality_policy(value) for key, value in cfg['Quality'].items()})
+    for subject_name, quality in args.quality or []:
+        if subject_name is None:
+            default_quality = quality
+        else:
+            subject_qualities[subject_name] = quality
+    return default_quality, subject_qualities
+
+
+def parse_scrape_workers(args: argparse.Namespace, cfg) -> (int, int | None):
+    scrape_workers = 1
+    worker_memory = 2048
+    if 'Scrape-Workers' in cfg:
+        scrape_workers = cfg['Scrape-Workers']
+    if 'Scrape-Worker-Memory' in cfg:
+        worker_memory = cfg['Scrape-Worker-Memory']
+    if args.scrape_workers:
+        scrape_workers = args.scrape_workers
+    if args.scrape_worker_memory is not None:
+        worker_memory = args.scrape_worker_memory
+    if scrape_workers < 1:
+        raise argparse.ArgumentTypeError("The number of scrape workers must be at least 1")
+    if worker_memory < 0:
+        raise argparse.ArgumentTypeError("Scrape-Worker-Memory must not be negative")
+    # Every worker is a browser of its own, TUM-live and Panopto get a pool each
+    return scrape_workers, worker_memory * 1024 * 1024 if worker_memory else None
+
+
+def parse_scrape_mode(args: argparse.Namespace, cfg) -> str:
+    scrape_mode = "browser"
+    if 'Scrape-Mode' in cfg:
+        scrape_mode = cfg['Scrape-Mode']
+    if args.scrape_mode:
+        scrape_mode = args.scrape_mode
+    if scrape_mode not in ("browser", "http"):
+        raise argparse.ArgumentTypeError("Scrape mode must be \"browser\" or \"http\"")
+    return scrape_mode
+
+
+def parse_catalog(args: argparse.Namespace, cfg, tmp_folder_path: Path) -> (Path | None, float):
+    # The temp folder is local to the node, SQLite's locking is unreliable on network file systems
+    catalog_path = Path(tmp_folder_path, "tum_video_scraper_catalog.sqlite")
+    catalog_ttl_hours = 6  # Below the lifetime of the playlist tokens, which aren't readable on every platform
+    if 'Catalog-File' in cfg:
+        catalog_path = Path(cfg['Catalog-File'])
+    if 'Catalog-TTL' in cfg:
+        catalog_ttl_hours = cfg['Catalog-TTL']
+    if args.catalog_ttl is not None:
+        catalog_ttl_hours = args.catalog_ttl
+    if catalog_ttl_hours <= 0:
+        return None, 0  # Catalog disabled, every lecture page gets visited
+    return catalog_path, catalog_ttl_hours * 3600
+
+
+def parse_disk_headroom(args: argparse.Namespace, cfg) -> int:
+    disk_headroom_gigabytes = 1
+    if 'Disk-Headroom' in cfg:
+        disk_headroom_gigabytes = cfg['Disk-Headroom']
+    if args.disk_headroom is not None:
+        disk_headroom_gigabytes = args.disk_headroom
+    if disk_headroom_gigabytes < 0:
+        raise argparse.ArgumentTypeError("Disk-Headroom must not be negative")
+    return int(disk_headroom_gigabytes * 1e9)
+
+
+def parse_failure_handling(args: argparse.Namespace, cfg) -> (int, float):
+    retry_attempts = 3
+    lock_timeout_minutes = 30
+    if 'Retry-Attempts' in cfg:
+        retry_attempts = cfg['Retry-Attempts']
+    if 'Lock-Timeout' in cfg:
+        lock_timeout_minutes = cfg['Lock-Timeout']
+    if args.retry_attempts is not None:
+        retry_attempts = args.retry_attempts
+    if args.lock_timeout is not None:
+        lock_timeout_minutes = args.lock_timeout
+    if retry_attempts < 1:
+        raise argparse.ArgumentTypeError("Retry-Attempts must be at least 1")
+    if lock_timeout_minutes <= 0:
+        raise argparse.ArgumentTypeError("Lock-Timeout must be positive")
+    return retry_attempts, lock_timeout_minutes * 60
+
+
+def parse_metrics(args: argparse.Namespace, cfg) -> (Path | None, Path | None, int | None):
+    metrics_path = None  # Metrics are only measured if one of their outputs is configured
+    metrics_textfile_path = None
+    metrics_port = None
+    if 'Metrics-File' in cfg:
+        metrics_path = Path(cfg['Metrics-File']) if cfg['Metrics-File'] else None
+    if 'Metrics-Textfile' in cfg:
+        metrics_textfile_path = Path(cfg['Metrics-Textfile'])
+    if 'Metrics-Port' in cfg:
+        metrics_port = cfg['Metrics-Port']
+    if args.metrics_file:
+        metrics_path = args.metrics_file
+    if args.metrics_textfile:
+        metrics_textfile_path = args.metrics_textfile
+    if args.metrics_port:
+        metrics_port = args.metrics_port
+    if metrics_textfile_path and not os.path.isdir(metrics_textfile_path.parent):
+        raise argparse.ArgumentTypeError("The folder of the Metrics-Textfile does not exist")
+    if metrics_port is not None and not 0 < metrics_port < 65536:
+        raise argparse.ArgumentTypeError("Metrics-Port must be a valid port number")
+    return metrics_path, metrics_textfile_path, metrics_port
+
+
+def parse_session_store(args: argparse.Namespace, cfg, destination_folder_path: Path,
+                        username: str | None, password: str | None) -> SessionStore | None:
+    if not username or not password:
+        return None  # Nothing to log in with, nothing to store
+    session_store_path = Path(destination_folder_path, ".sessions")
+    if 'Session-Store' in cfg:
+        session_store_path = Path(cfg['Session-Store'])
+    if args.session_store:
+        session_store_path = args.session_store
+    return SessionStore(session_store_path, username, password)
+
+
+def parse_daemon(args: argparse.Namespace, cfg) -> daemon.PollOptions | None:
+    if not args.daemon and not cfg.get('Daemon', False):
+        return None  # A single run
+    poll_interval = cfg.get('Poll-Interval', 15)
+    idle_poll_interval = cfg.get('Idle-Poll-Interval', 120)
+    archive_poll_interval = cfg.get('Archive-Poll-Interval', 1440)
+    lecture_hours = str(cfg.get('Lecture-Hours', "8-20"))
+    if args.poll_interval:
+        poll_interval = args.poll_interval
+    if min(poll_interval, idle_poll_interval, archive_poll_interval) <= 0:
+        raise argparse.ArgumentTypeError("Poll intervals must be positive")
+    try:
+        start, end = (int(hour) for hour in lecture_hours.split("-"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("Lecture-Hours must look like \"8-20\"")
+    if not 0 <= start < end <= 24:
+        raise argparse.ArgumentTypeError("Lecture-Hours must be hours of the same day")
+    # Intervals are configured in minutes
+    return daemon.PollOptions(poll_interval * 60, idle_poll_interval * 60, archive_poll_interval * 60, (start, end))
 
 
-def parse_username_password(args: argparse.Namespace, cfg) -> (str | None, str | None):
+def parse_username_password(args: argparse.Namespace, cfg,
+                            known_credentials: (str | None, str | None) = (None, None)) -> (str | None, str | None):
     username = args.username or cfg.get('Username')
     password = args.password or cfg.get('Password')
 
+    # A password entered on stdin is kept when the daemon reloads its config
+    if username and not password and username == known_credentials[0]:
+        password = known_credentials[1]
+
     # Allows setting the password from stdin
     if username and not password:
         password = input("Please enter your TUM-Password (must fit to the TUM-Username):\n")
@@ -160,7 +523,46 @@ def parse_username_password(args: argparse.Namespace, cfg) -> (str | None, str |
     return username, password
 
 
-def parse_arguments():
+@dataclass(frozen=True)
+class Arguments:
+    # Everything parse_arguments() read from the command line and the config file
+    tum_live_subjects: dict[str, (str, str)]
+    panopto_folders: dict[str, str]
+    keep_original: bool
+    jump_cut: bool
+    jumpcut_engine: str
+    silent_threshold: float
+    silent_speed: float
+    jumpcut_margin: float
+    jumpcut_chunks: int
+    default_quality: str
+    subject_qualities: dict[str, str]
+    destination_folder_path: Path
+    tmp_folder_path: Path
+    scrape_mode: str
+    scrape_workers: int
+    worker_memory_limit: int | None
+    catalog_path: Path | None
+    catalog_ttl: float
+    disk_headroom: int
+    retry_attempts: int
+    lock_timeout: float
+    metrics_path: Path | None
+    metrics_textfile_path: Path | None
+    metrics_port: int | None
+    minimum_parallel_downloads: int
+    maximum_parallel_downloads: int
+    stall_timeout: float
+    maximum_parallel_conversions: int
+    download_mode: str
+    segment_workers: int
+    username: str | None
+    password: str | None
+    session_store: SessionStore | None
+    poll_options: daemon.PollOptions | None
+
+
+def parse_arguments(known_credentials: (str | None, str | None) = (None, None)) -> Arguments:
     args = parse_command_line_arguments()
     cfg = load_config_file(args)
 
@@ -168,19 +570,74 @@ def parse_arguments():
     panopto_folders = parse_panopto_folders(args, cfg)
 
     (keep_original, jump_cut) = parse_keep_original_and_jump_cut(args, cfg)
+    (jumpcut_engine, silent_threshold, silent_speed, jumpcut_margin, jumpcut_chunks) = parse_jumpcut_options(args, cfg)
+    (default_quality, subject_qualities) = parse_quality(args, cfg)
 
     destination_folder_path = parse_destination_folder(args, cfg)
     tmp_folder_path = parse_tmp_folder(args, cfg)
-
-    semaphore = parse_maximum_parallel_downloads(args, cfg)
-
-    (username, password) = parse_username_password(args, cfg)
-
-    return tum_live_subjects, panopto_folders, \
-        keep_original, jump_cut, \
-        destination_folder_path, tmp_folder_path, \
-        semaphore, \
-        username, password
+    scrape_mode = parse_scrape_mode(args, cfg)
+    (scrape_workers, worker_memory_limit) = parse_scrape_workers(args, cfg)
+    (catalog_path, catalog_ttl) = parse_catalog(args, cfg, tmp_folder_path)
+    disk_headroom = parse_disk_headroom(args, cfg)
+    (retry_attempts, lock_timeout) = parse_failure_handling(args, cfg)
+    (metrics_path, metrics_textfile_path, metrics_port) = parse_metrics(args, cfg)
+
+    (minimum_parallel_downloads, maximum_parallel_downloads, stall_timeout) = parse_parallel_downloads(args, cfg)
+    maximum_parallel_conversions = parse_maximum_parallel_conversions(args, cfg)
+    jumpcut_chunks = limit_jumpcut_chunks(jumpcut_chunks, maximum_parallel_conversions)
+    (download_mode, segment_workers) = parse_download_mode(args, cfg)
+
+    (username, password) = parse_username_password(args, cfg, known_credentials)
+    session_store = parse_session_store(args, cfg, destination_folder_path, username, password)
+    poll_options = parse_daemon(args, cfg)
+
+    return Arguments(tum_live_subjects=tum_live_subjects, panopto_folders=panopto_folders,
+                     keep_original=keep_original, jump_cut=jump_cut, jumpcut_engine=jumpcut_engine,
+                     silent_threshold=silent_threshold, silent_speed=silent_speed, jumpcut_margin=jumpcut_margin,
+                     jumpcut_chunks=jumpcut_chunks, default_quality=default_quality,
+                     subject_qualities=subject_qualities, destination_folder_path=destination_folder_path,
+                     tmp_folder_path=tmp_folder_path, scrape_mode=scrape_mode, scrape_workers=scrape_workers,
+                     worker_memory_limit=worker_memory_limit, catalog_path=catalog_path, catalog_ttl=catalog_ttl,
+                     disk_headroom=disk_headroom, retry_attempts=retry_attempts, lock_timeout=lock_timeout,
+                     metrics_path=metrics_path, metrics_textfile_path=metrics_textfile_path,
+                     metrics_port=metrics_port, minimum_parallel_downloads=minimum_parallel_downloads,
+                     maximum_parallel_downloads=maximum_parallel_downloads, stall_timeout=stall_timeout,
+                     maximum_parallel_conversions=maximum_parallel_conversions, download_mode=download_mode,
+                     segment_workers=segment_workers, username=username, password=password,
+                     session_store=session_store, poll_options=poll_options)
+
+
+def daemon_config(arguments: Arguments) -> daemon.DaemonConfig:
+    # The settings of parse_arguments() the daemon applies when it reloads its config
+    if arguments.poll_options is None:
+        raise argparse.ArgumentTypeError("Daemon mode was turned off, restart to leave it")
+    return daemon.DaemonConfig(tum_live_subjects=arguments.tum_live_subjects, panopto_folders=arguments.panopto_folders,
+                               default_quality=arguments.default_quality,
+                               subject_qualities=arguments.subject_qualities,
+                               destination_folder_path=arguments.destination_folder_path,
+                               poll_options=arguments.poll_options, username=arguments.username,
+                               password=arguments.password, scrape_mode=arguments.scrape_mode,
+                               session_store=arguments.session_store, scrape_workers=arguments.scrape_workers,
+                               worker_memory_limit=arguments.worker_memory_limit)
+
+
+def scrape(tum_live_subjects: dict[str, (str, str)], panopto_folders: dict[str, str],
+           username: str | None, password: str | None,
+           session_store: SessionStore | None,
+           catalog: Catalog | None, scrape_mode: str,
+           scrape_workers: int = 1, worker_memory_limit: int | None = None) -> Iterator[tuple[str, str, str, str]]:
+    # Yields (subject_folder_name, episode_name, playlist_m3u8_URL, video_id) as the scrapers find them
+    # TUM-live and Panopto are scraped at the same time, each by a pool of scrape_workers browsers
+    scrapers = []
+    if tum_live_subjects:
+        print(f"Scanning TUM-live with {min(scrape_workers, len(tum_live_subjects))} browser(s)")
+        scrapers.append(tum_live.scrape_subjects(tum_live_subjects, username, password, catalog, scrape_mode,
+                                                 session_store, scrape_workers, worker_memory_limit))
+    if panopto_folders:
+        print(f"Scanning Panopto with {min(scrape_workers, len(panopto_folders))} browser(s)")
+        scrapers.append(panopto.scrape_folders(panopto_folders, username, password, session_store,
+                                               scrape_workers, worker_memory_limit))
+    yield from browser_pool.merge(scrapers)
 
 
 def main():
@@ -188,44 +645,81 @@ def main():
     os.nice(15)
 
     # Parse arguments
-    tum_live_subjects, \
-        panopto_folders, \
-        keep_original, \
-        jump_cut, \
-        destination_folder_path, \
-        tmp_folder_path, \
-        semaphore, \
-        username, \
-        password = parse_arguments()
+    arguments = parse_arguments()
 
     print("Starting new run!")
-
-    # subject_folder_name -> [(episode_name, playlist_m3u8_URL)]
-    videos_for_subject: dict[str, [(str, str)]] = {}
-
-    # Scrape TUM-live videos
-    if tum_live_subjects:
-        print("\nScanning TUM-live:")
-        tum_live.get_subjects(tum_live_subjects, username, password, videos_for_subject)
-
-    # Scrape Panopto videos
-    if panopto_folders:
-        print("\nScanning Panopto:")
-        panopto.get_folders(panopto_folders, username, password, videos_for_subject)
-
-    # Download videos
-    print("\n--------------------\n")
-    print("Starting downloads:")
-    spawned_child_processes = []
-    for subject, playlists in videos_for_subject.items():
-        subject_folder = Path(destination_folder_path, subject)
-        subject_folder.mkdir(exist_ok=True)
-        spawned_child_processes += downloader.download_list_of_videos(playlists,
-                                                                      subject_folder, tmp_folder_path,
-                                                                      keep_original, jump_cut,
-                                                                      semaphore)
-    for process in spawned_child_processes:
-        process.join()
+    run_start_time = time.time()
+
+    settings = downloader.DownloadSettings(tmp_directory=arguments.tmp_folder_path,
+                                           keep_original=arguments.keep_original, jump_cut=arguments.jump_cut,
+                                           download_mode=arguments.download_mode,
+                                           segment_workers=arguments.segment_workers,
+                                           run_start_time=run_start_time, first_byte_time=Value('d', 0.0),
+                                           jumpcut_engine=arguments.jumpcut_engine,
+                                           silent_threshold=arguments.silent_threshold,
+                                           silent_speed=arguments.silent_speed,
+                                           jumpcut_margin=arguments.jumpcut_margin,
+                                           jumpcut_chunks=arguments.jumpcut_chunks, copied_bytes=Value('q', 0),
+                                           disk_budget=DiskBudget([arguments.tmp_folder_path,
+                                                                   arguments.destination_folder_path],
+                                                                  arguments.disk_headroom),
+                                           retry_attempts=arguments.retry_attempts, downloaded_bytes=Value('q', 0),
+                                           stall_timeout=arguments.stall_timeout,
+                                           catalog_path=arguments.catalog_path)
+    locks.set_timeout(arguments.lock_timeout)  # Before the workers are forked, they claim and renew the locks
+    if arguments.metrics_path or arguments.metrics_textfile_path or arguments.metrics_port:
+        metrics.enable()  # Before the workers are forked as well, they send their measurements to the collector
+    # Download workers hand finished videos over to the jump-cut workers
+    conversions = Scheduler(arguments.maximum_parallel_conversions, downloader.cut_video, settings) \
+        if arguments.jump_cut else None
+    # Workers for the maximum number of downloads, of which only as many as the adaptive limit allows run at once
+    adaptive = arguments.minimum_parallel_downloads < arguments.maximum_parallel_downloads
+    download_limit = ConcurrencyLimit(arguments.minimum_parallel_downloads) if adaptive else None
+    scheduler = Scheduler(arguments.maximum_parallel_downloads, downloader.download, settings,
+                          next_stage=conversions, concurrency_limit=download_limit)
+    # Threads are started after the workers are forked
+    progress.report_throughput(settings.downloaded_bytes)
+    collector = metrics.Collector(arguments.metrics_path, arguments.metrics_textfile_path, arguments.metrics_port) \
+        if metrics.enabled() else None
+    if adaptive:
+        concurrency.adapt(download_limit, settings.downloaded_bytes,
+                          arguments.minimum_parallel_downloads, arguments.maximum_parallel_downloads)
+    # Opened after the workers are forked, as SQLite connections must not be shared across processes
+    catalog = Catalog(arguments.catalog_path, arguments.catalog_ttl) if arguments.catalog_path else None
+    try:
+        if arguments.poll_options:
+            # Runs until SIGTERM, the download workers stay up between the polls
+            credentials = (arguments.username, arguments.password)
+            daemon.run(daemon_config(arguments), lambda: daemon_config(parse_arguments(credentials)),
+                       scheduler, catalog)
+        else:
+            # Videos are downloaded while the scrapers are still looking for more
+            for subject, filename, playlist_url, video_id in scrape(arguments.tum_live_subjects,
+                                                                    arguments.panopto_folders,
+                                                                    arguments.username, arguments.password,
+                                                                    arguments.session_store,
+                                                                    catalog, arguments.scrape_mode,
+                                                                    arguments.scrape_workers,
+                                                                    arguments.worker_memory_limit):
+                subject_folder = Path(arguments.destination_folder_path, subject)
+                subject_folder.mkdir(exist_ok=True)
+                downloader.download_list_of_videos([(filename, playlist_url, video_id)], subject_folder, scheduler,
+                                                   arguments.subject_qualities.get(subject,
+                                                                                   arguments.default_quality))
+    finally:
+        if catalog:
+            catalog.close()
+        if profiling.enabled():
+            print(profiling.summary())  # Where the scrapers spent their time, before we wait for the downloads
+        scheduler.shutdown()  # Waits for all submitted videos to be downloaded
+        if conversions:
+            conversions.shutdown()  # Waits for all downloaded videos to be jump-cut
+        metrics.observe("stage_seconds", time.time() - run_start_time, stage="run")
+        if collector:
+            collector.close()
+    print(f"Downloaded {settings.downloaded_bytes.value / 1e6:.0f} MB, "
+          f"copied {settings.copied_bytes.value / 1e6:.0f} MB between file systems")
+    print(f"Run completed after {(time.time() - run_start_time):.0f}s")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,66 @@
+import hashlib
+import json
+import re
+from pathlib import Path
+
+import locks
+import util
+
+
+class Manifest:
+    # Maps the stable ID of every video in a subject folder (watch URL or Panopto delivery ID) to its local filename
+    # If a lecture gets inserted, removed or reordered, the index in the filename shifts
+    # We then rename the existing files instead of downloading them again under their new name
+
+    def __init__(self, subject_folder: Path):
+        self.subject_folder = subject_folder
+        self.path = Path(subject_folder, ".manifest.json")
+        self.videos: dict[str, str] = {}
+        if self.path.exists():
+            with open(self.path, 'r') as manifest:
+                self.videos = json.load(manifest)
+
+    def save(self):
+        temporary_path = Path(self.path.as_posix() + ".tmp")
+        with open(temporary_path, 'w') as manifest:
+            json.dump(self.videos, manifest, indent=2, ensure_ascii=False)
+        temporary_path.replace(self.path)  # Never leave a half-written manifest behind
+
+    def _owner(self, filename: str) -> str | None:
+        return next((video_id for video_id, name in self.videos.items() if name == filename), None)
+
+    def _files(self, filename: str) -> [Path]:
+        output_file_path = Path(self.subject_folder, filename)
+        return [output_file_path, util.jump_cut_path(output_file_path), locks.lock_path(output_file_path)]
+
+    def _occupied(self, filename: str) -> bool:
+        return any(path.exists() for path in self._files(filename))
+
+    def _move(self, old_filename: str, new_filename: str):
+        for old_path, new_path in zip(self._files(old_filename), self._files(new_filename)):
+            if old_path.exists():
+                old_path.rename(new_path)
+
+    def _in_progress(self, filename: str) -> bool:
+        # Locked by a live lease of a worker, its files must not be moved away under it
+        output_file_path = Path(self.subject_folder, filename)
+        return locks.is_locked(output_file_path) and not locks.is_user_lock(output_file_path)
+
+    def reconcile(self, video_id: str, filename: str) -> str:
+        # Returns the filename under which the video is stored from now on
+        previous_filename = self.videos.get(video_id)
+        if previous_filename and previous_filename != filename and self._occupied(previous_filename):
+            if self._in_progress(previous_filename) or self._in_progress(filename):
+                return previous_filename  # Still being processed, we'll rename it in a later run
+            if self._occupied(filename):
+                # The new name is still taken by another video that moved as well, park that one under a unique name
+                owner = self._owner(filename)
+                parked_filename = re.sub(r'\.(?=[^.]*$)',
+                                         f'~{hashlib.sha1((owner or filename).encode()).hexdigest()[:8]}.', filename)
+                self._move(filename, parked_filename)
+                if owner:
+                    self.videos[owner] = parked_filename
+            self._move(previous_filename, filename)
+            print(f'Renamed "{previous_filename}" to "{filename}"')
+        self.videos[video_id] = filename
+        return filename
@@ -0,0 +1,203 @@
+import json
+import math
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Queue
+from pathlib import Path
+from typing import Iterator
+
+"""Counters, gauges and histograms of the stages of a run, e.g. stage_seconds{stage="download"}"""
+"""Every process sends its measurements to a collector in the main process, which appends them to a JSON-lines file"""
+"""and keeps the totals of the run for a Prometheus textfile (for node_exporter) and an HTTP endpoint"""
+
+PREFIX = "tum_video_scraper_"
+TEXTFILE_INTERVAL = 15  # Seconds between two updates of the Prometheus textfile
+
+SECONDS_BUCKETS = (0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)
+BUCKETS = {  # Upper bounds of the histogram buckets, by metric name
+    "download_bytes_per_second": (1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7, 2.5e7, 5e7, 1e8),
+    "cut_speedup": (1, 1.1, 1.25, 1.5, 1.75, 2, 2.5, 3, 4, 5),
+    "webdriver_seconds": (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+}
+
+_queue: 'Queue | None' = None  # Measurements on their way to the collector, None: metrics are disabled
+
+
+def enable():
+    # Called before the workers are forked, so they send their measurements to the same queue
+    global _queue
+    _queue = Queue()
+
+
+def enabled() -> bool:
+    # Lets callers skip measurements that take work of their own
+    return _queue is not None
+
+
+def _send(kind: str, name: str, value: float, labels: dict[str, str]):
+    if _queue is not None:
+        _queue.put((time.time(), os.getpid(), kind, name, value, {label: str(text) for label, text in labels.items()}))
+
+
+def count(name: str, value: float = 1, **labels):
+    _send("counter", name, value, labels)
+
+
+def gauge(name: str, value: float, **labels):
+    _send("gauge", name, value, labels)
+
+
+def observe(name: str, value: float, **labels):
+    _send("histogram", name, value, labels)
+
+
+@contextmanager
+def timed(name: str, **labels):
+    # Observes the seconds the block took, also if it raised
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        observe(name, time.monotonic() - start, **labels)
+
+
+def timed_stream(items: Iterator, name: str, **labels) -> Iterator:
+    # Observes the seconds spent producing the items, without the time the consumer spends between two of them
+    elapsed = 0.0
+    start = time.monotonic()
+    try:
+        for item in items:
+            elapsed += time.monotonic() - start
+            yield item
+            start = time.monotonic()
+        elapsed += time.monotonic() - start
+    finally:
+        observe(name, elapsed, **labels)
+
+
+class Registry:
+    # Totals of all measurements of the run, in the Prometheus text exposition format
+
+    def __init__(self):
+        self.lock = threading.Lock()  # Read by the HTTP endpoint while the collector writes
+        self.counters: dict[str, dict[tuple, float]] = {}
+        self.gauges: dict[str, dict[tuple, float]] = {}
+        self.histograms: dict[str, dict[tuple, list]] = {}  # [bucket counts..., sum, count]
+
+    def record(self, kind: str, name: str, value: float, labels: dict[str, str]):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            if kind == "counter":
+                series = self.counters.setdefault(name, {})
+                series[key] = series.get(key, 0) + value
+            elif kind == "gauge":
+                self.gauges.setdefault(name, {})[key] = value
+            else:
+                buckets = BUCKETS.get(name, SECONDS_BUCKETS)
+                series = self.histograms.setdefault(name, {})
+                histogram = series.setdefault(key, [0] * (len(buckets) + 2))
+                for index, bound in enumerate(buckets):
+                    if value <= bound:
+                        histogram[index] += 1
+                histogram[-2] += value
+                histogram[-1] += 1
+
+    def exposition(self) -> str:
+        lines = []
+        with self.lock:
+            for kind, metrics in (("counter", self.counters), ("gauge", self.gauges)):
+                for name, series in sorted(metrics.items()):
+                    lines.append(f"# TYPE {PREFIX}{name} {kind}")
+                    lines += [f"{PREFIX}{name}{_labels(key)} {value:g}" for key, value in sorted(series.items())]
+            for name, series in sorted(self.histograms.items()):
+                lines.append(f"# TYPE {PREFIX}{name} histogram")
+                for key, histogram in sorted(series.items()):
+                    for bound, bucket_count in zip((*BUCKETS.get(name, SECONDS_BUCKETS), math.inf), histogram):
+                        lines.append(f"{PREFIX}{name}_bucket{_labels(key + (('le', f'{bound:g}'),))} "
+                                     f"{bucket_count if bound != math.inf else histogram[-1]}")
+                    lines.append(f"{PREFIX}{name}_sum{_labels(key)} {histogram[-2]:g}")
+                    lines.append(f"{PREFIX}{name}_count{_labels(key)} {histogram[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(key: tuple) -> str:
+    if not key:
+        return ""
+    return "{" + ",".join(f'{label}="{_escape(value)}"' for label, value in key) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _write_textfile(registry: Registry, textfile_path: Path):
+    # node_exporter must never read a half-written file
+    temporary_path = Path(textfile_path.as_posix() + f".{os.getpid()}.tmp")
+    temporary_path.write_text(registry.exposition())
+    temporary_path.replace(textfile_path)
+
+
+def _serve(registry: Registry, port: int) -> ThreadingHTTPServer:
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = registry.exposition().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class Collector:
+    # Runs in the main process, started after the workers are forked
+
+    def __init__(self, events_path: Path | None, textfile_path: Path | None, port: int | None):
+        self.registry = Registry()
+        self.events_path = events_path
+        self.textfile_path = textfile_path
+        self.server = _serve(self.registry, port) if port else None
+        self.thread = threading.Thread(target=self._collect, daemon=True)
+        self.thread.start()
+
+    def _collect(self):
+        events = open(self.events_path, 'a') if self.events_path else None
+        last_textfile = time.monotonic()
+        try:
+            while True:
+                try:
+                    event = _queue.get(timeout=TEXTFILE_INTERVAL)
+                except queue.Empty:  # Nothing happened in a while
+                    event = ()
+                if event is None:  # Sent by close()
+                    return
+                if event:
+                    timestamp, pid, kind, name, value, labels = event
+                    self.registry.record(kind, name, value, labels)
+                    if events:
+                        events.write(json.dumps({"time": timestamp, "pid": pid, "type": kind, "name": name,
+                                                 "value": value, "labels": labels}) + "\n")
+                        events.flush()
+                if self.textfile_path and time.monotonic() - last_textfile >= TEXTFILE_INTERVAL:
+                    _write_textfile(self.registry, self.textfile_path)
+                    last_textfile = time.monotonic()
+        finally:
+            if events:
+                events.close()
+
+    def close(self):
+        # Records everything that was sent until now, the HTTP endpoint stays up until we exit
+        _queue.put(None)
+        self.thread.join()
+        if self.textfile_path:
+            _write_textfile(self.registry, self.textfile_path)
@@ -1,96 +1,221 @@
 import argparse
 import os
 import re
-from time import sleep
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
 
+import requests
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from seleniumrequests import Firefox
 
+import metrics
+import profiling
 import util
+from browser_pool import BrowserPool
+from session_store import SessionStore
 
+HTTP_WORKERS = 8  # DeliveryInfo requests sent in parallel
+FOLDER_PAGE_SIZE = 250  # Sessions per page of the folder list
+BASE_URL = os.getenv('PANOPTO_BASE_URL', "https://tum.cloud.panopto.eu").rstrip('/')  # Or a replay server
+DELIVERY_INFO_PATH = "/Panopto/Pages/Viewer/DeliveryInfo.aspx?deliveryId="
+SESSION_STORE_SITE = "panopto"
+FOLDER_LOAD_TIMEOUT = 10  # Seconds we wait for a folder page to show videos, which an empty folder never does
+# The title and all links of the folder list in a single round trip to the browser
+FOLDER_PAGE_SCRIPT = "return {title: document.title, links: Array.from(document.querySelectorAll('a[href]'), " \
+                     "link => link.href)};"
 
-def login(tum_username: str | None, tum_password: str | None) -> webdriver:
-    driver_options = webdriver.FirefoxOptions()
-    if str(os.getenv('HEADLESS', 'true')) in ("1", "true", "yes", "on"):
-        driver_options.add_argument("--headless")
-    if os.getenv('NO-SANDBOX') == '1':
-        driver_options.add_argument("--no-sandbox")
-    driver = Firefox(options=driver_options)
+
+def _new_browser() -> webdriver:
+    return Firefox(options=util.firefox_options())  # seleniumrequests' Firefox, for the DeliveryInfo requests
+
+
+def login(tum_username: str | None, tum_password: str | None,
+          session_store: SessionStore | None = None) -> webdriver:
+    driver = profiling.profiled(_new_browser())
 
     if not tum_username or not tum_password:
         driver.close()
         raise argparse.ArgumentTypeError("You must provide a valid TUM username and password to use Panopto")
 
+    if session_store and _restore_session(driver, session_store):
+        return driver
+
     driver.get("https://www.moodle.tum.de/login/index.php")
     driver.find_element(By.LINK_TEXT, "TUM LOGIN").click()
-    sleep(3)
+    util.wait_until(driver, lambda d: d.find_elements(By.ID, "username"))
 
     driver.find_element(By.ID, "username").send_keys(tum_username)
     driver.find_element(By.ID, "password").send_keys(tum_password)
     driver.find_element(By.ID, "btnLogin").click()
-    sleep(3)
+    util.wait_until(driver, lambda d: "login.tum.de" not in d.current_url
+                    or "Username or password was incorrect" in d.page_source)
     if "Username or password was incorrect" in driver.page_source:
         driver.close()
         raise argparse.ArgumentTypeError("Username or password incorrect")
 
-    driver.get("https://tum.cloud.panopto.eu/")
+    driver.get(f"{BASE_URL}/")
     driver.find_element(By.LINK_TEXT, "Sign in").click()
-    sleep(3)
+    # Back from the identity provider, signed in
+    util.wait_until(driver, lambda d: d.current_url.startswith(BASE_URL)
+                    and not d.find_elements(By.LINK_TEXT, "Sign in"))
+    if session_store:
+        session_store.save(SESSION_STORE_SITE, driver.get_cookies())
     return driver
 
 
-def get_video_links_in_folder(driver: webdriver, folder_id: str) -> [(str, str)]:
-    folder_link = f"https://tum.cloud.panopto.eu/Panopto/Pages/Sessions/List.aspx#folderID=%22" \
-                  f"{folder_id}" \
-                  f"%22&maxResults=250"
-    driver.get(folder_link)
-    sleep(3)
-    if "Failed to load folder" in driver.title:
-        print("Folder-ID incorrect: " + folder_id)
-        raise Exception
-
-    links_on_page = driver.find_elements(By.XPATH, ".//a")
-    video_urls: [str] = []
-    for link in links_on_page:
-        link_url = link.get_attribute("href")
-        if link_url and "https://tum.cloud.panopto.eu/Panopto/Pages/Viewer.aspx" in link_url:
-            video_urls.append(link_url)
-    video_urls = list(dict.fromkeys(video_urls))  # deduplicate
-
-    video_playlists: [(str, str)] = []
-    for video_url in video_urls:
-        video_id = video_url[-36:]
-        video_playlists.append(get_m3u8_playlist(driver, video_id))
-    video_playlists.reverse()
-
-    return video_playlists
+def _restore_session(driver: webdriver, session_store: SessionStore) -> bool:
+    # Logs the browser in with the cookies of an earlier run, returns False if they are gone or expired
+    cookies = session_store.load(SESSION_STORE_SITE)
+    if not cookies:
+        return False
+    util.add_cookies(driver, BASE_URL, cookies)
+    driver.get(f"{BASE_URL}/Panopto/Pages/Sessions/List.aspx")
+    # An expired session sends us to the identity provider or leaves us signed out
+    if "login.tum.de" in driver.current_url or driver.find_elements(By.LINK_TEXT, "Sign in"):
+        driver.delete_all_cookies()
+        session_store.discard(SESSION_STORE_SITE)
+        return False
+    print("Reusing stored Panopto session")
+    return True
+
+
+def get_video_links_in_folder(driver: webdriver, folder_id: str,
+                              session: requests.Session) -> Iterator[tuple[str, str, str]]:
+    # Yields (episode_name, playlist_m3u8_URL, delivery_ID), the delivery ID identifies a video across runs
+    with metrics.timed("stage_seconds", stage="course_list", site=SESSION_STORE_SITE):
+        video_ids = _collect_video_ids(driver, folder_id)
+
+    # The folder lists the newest video first, we resolve them oldest first
+    video_ids.reverse()
+    with ThreadPoolExecutor(max_workers=HTTP_WORKERS) as executor:
+        resolved_playlists = [executor.submit(fetch_m3u8_playlist, session, video_id) for video_id in video_ids]
+        for video_id, resolved_playlist in zip(video_ids, resolved_playlists):
+            video_playlist = resolved_playlist.result()
+            if video_playlist is None:  # DeliveryInfo didn't tell us everything, ask the browser
+                video_playlist = get_m3u8_playlist(driver, video_id)
+            if video_playlist:
+                yield *video_playlist, video_id
+
+
+def _collect_video_ids(driver: webdriver, folder_id: str) -> [str]:
+    # The folder list is paginated, we keep turning pages until one doesn't show any new videos
+    video_ids: [str] = []
+    page = 0
+    while True:
+        folder_link = f"{BASE_URL}/Panopto/Pages/Sessions/List.aspx#folderID=%22" \
+                      f"{folder_id}" \
+                      f"%22&maxResults={FOLDER_PAGE_SIZE}&page={page}"
+        driver.get(folder_link)
+        # The list is rendered client-side, also when only the fragment (the page) changed,
+        # so it is ready once it shows videos we haven't seen on the previous pages
+        folder_page = util.wait_until(driver, lambda d: _folder_page_if_ready(d, video_ids), FOLDER_LOAD_TIMEOUT) \
+            or driver.execute_script(FOLDER_PAGE_SCRIPT)
+        if "Failed to load folder" in folder_page["title"]:
+            print("Folder-ID incorrect: " + folder_id)
+            raise Exception
+
+        new_video_ids = [video_id for video_id in _video_ids(folder_page["links"]) if video_id not in video_ids]
+        video_ids += new_video_ids
+        if len(new_video_ids) < FOLDER_PAGE_SIZE:
+            return video_ids
+        page += 1
+
+
+def _folder_page_if_ready(driver: webdriver, seen_video_ids: [str]) -> dict | None:
+    page = driver.execute_script(FOLDER_PAGE_SCRIPT)
+    if "Failed to load folder" in page["title"] or set(_video_ids(page["links"])) - set(seen_video_ids):
+        return page
+    return None
+
+
+def _video_ids(links: [str]) -> [str]:
+    video_ids = [link[-36:] for link in links if f"{BASE_URL}/Panopto/Pages/Viewer.aspx" in link]
+    return list(dict.fromkeys(video_ids))  # deduplicate, preserve order
+
+
+def _extract_playlist_url(delivery_info: str) -> str | None:
+    prefix = "https://"
+    postfix = "/master.m3u8"
+    matches = re.search(prefix + '(.+?)' + postfix, delivery_info)
+    if not matches:
+        return None
+    playlist_extracted_url = matches.group(1)
+    return prefix + playlist_extracted_url.replace('\\', '') + postfix
+
+
+def fetch_m3u8_playlist(session: requests.Session, video_id: str) -> (str, str):
+    # Resolves a video with a single DeliveryInfo request, returns None if the response lacks name or playlist
+    try:
+        with metrics.timed("stage_seconds", stage="playlist", site=SESSION_STORE_SITE, method="http"):
+            response = session.post(BASE_URL + DELIVERY_INFO_PATH + video_id, timeout=(10, 30))
+        response.raise_for_status()
+        filename = response.json()['Delivery']['SessionName'].strip()
+    except (requests.RequestException, ValueError, KeyError, TypeError, AttributeError):
+        return None
+    playlist_url = _extract_playlist_url(response.text)
+    if not filename or not playlist_url:
+        return None
+    return filename, playlist_url
 
 
 def get_m3u8_playlist(driver: webdriver, video_id: str) -> (str, str):
-    video_url = "https://tum.cloud.panopto.eu/Panopto/Pages/Embed.aspx?id=" + video_id
-    driver.get(video_url)
-    request_url = "https://tum.cloud.panopto.eu/Panopto/Pages/Viewer/DeliveryInfo.aspx?deliveryId="
-    post_response = driver.request('POST', request_url + video_id)
+    video_url = f"{BASE_URL}/Panopto/Pages/Embed.aspx?id=" + video_id
+    with metrics.timed("stage_seconds", stage="playlist", site=SESSION_STORE_SITE, method="browser"):
+        driver.get(video_url)
+        post_response = driver.request('POST', BASE_URL + DELIVERY_INFO_PATH + video_id)
 
-    prefix = "https://"
-    postfix = "/master.m3u8"
-    matches = re.search(prefix + '(.+?)' + postfix, post_response.text)
-    if not matches:
+    playlist_url = _extract_playlist_url(post_response.text)
+    if not playlist_url:
         print("Error on URL " + video_url + " - " + driver.title)
         return
-    playlist_extracted_url = matches.group(1)
-    playlist_url = prefix + playlist_extracted_url.replace('\\', '') + postfix
     filename = driver.title.strip()
     return filename, playlist_url
 
 
+class Scraper:
+    # A login to Panopto and its pool of browsers, kept open to scrape folders again and again (daemon mode)
+
+    def __init__(self, tum_username: str | None, tum_password: str | None,
+                 session_store: SessionStore | None = None, scrape_workers: int = 1,
+                 worker_memory_limit: int | None = None):
+        with metrics.timed("stage_seconds", stage="login", site=SESSION_STORE_SITE):
+            driver = login(tum_username, tum_password, session_store)
+        cookies = driver.get_cookies()
+        self.pool = BrowserPool(SESSION_STORE_SITE, driver, lambda: util.open_browser(_new_browser, BASE_URL, cookies),
+                                scrape_workers, worker_memory_limit)
+        # DeliveryInfo requests reuse the browser's login
+        self.session = util.session_from_driver(driver, HTTP_WORKERS * scrape_workers)
+
+    def _scrape_folder(self, driver: webdriver, subject_name: str, folder_id: str) -> Iterator[tuple[str, str, str]]:
+        # Timed without the time the download queue keeps us waiting
+        return metrics.timed_stream(get_video_links_in_folder(driver, folder_id, self.session),
+                                    "scrape_seconds", site=SESSION_STORE_SITE, subject=subject_name)
+
+    def scrape(self, panopto_folders: dict[str, str]) -> Iterator[tuple[str, str, str, str]]:
+        # Yields (subject_name, episode_name, playlist_m3u8_URL, video_id) as soon as each video is found
+        # Up to scrape_workers folders are scraped at once
+        return self.pool.scrape(panopto_folders, self._scrape_folder)
+
+    def close(self):
+        self.session.close()
+        self.pool.close()
+
+
+def scrape_folders(panopto_folders: dict[str, str], tum_username: str | None, tum_password: str | None,
+                   session_store: SessionStore | None = None, scrape_workers: int = 1,
+                   worker_memory_limit: int | None = None) -> Iterator[tuple[str, str, str, str]]:
+    # Logs in, scrapes the folders once and closes the browsers again
+    scraper = Scraper(tum_username, tum_password, session_store, scrape_workers, worker_memory_limit)
+    try:
+        yield from scraper.scrape(panopto_folders)
+    finally:
+        scraper.close()
+
+
 def get_folders(panopto_folders: dict[str, str], tum_username: str | None, tum_password: str | None,
                 queue: [str, [(str, str)]]):
-    driver = login(tum_username, tum_password)
-    for subject_name, folder_id in panopto_folders.items():
-        m3u8_playlists = get_video_links_in_folder(driver, folder_id)
-        m3u8_playlists = util.enumerate_list(m3u8_playlists)
-        print(f'Found {len(m3u8_playlists)} videos for "{subject_name}"')
-        queue[subject_name] = m3u8_playlists
-    driver.close()
+    for subject_name in panopto_folders:
+        queue[subject_name] = []
+    for subject_name, filename, playlist_url, _ in scrape_folders(panopto_folders, tum_username, tum_password):
+        queue[subject_name].append((filename, playlist_url))
@@ -0,0 +1,134 @@
+"""Times every WebDriver operation of the scrapers and their WebDriverWaits, by scraper function.
+
+Enabled with PROFILE_WEBDRIVER=1, or by the replay harness, the summary is printed after the scrapers are done.
+"""
+import os
+import sys
+import threading
+import time
+
+from selenium.webdriver.remote.webelement import WebElement
+from selenium.webdriver.support.ui import WebDriverWait as SeleniumWebDriverWait
+
+import metrics
+
+_enabled = os.getenv('PROFILE_WEBDRIVER') in ("1", "true", "yes", "on")
+_calls: dict[tuple[str, str], list[float]] = {}  # (scraper function, operation): seconds of every call
+_calls_lock = threading.Lock()  # Watch pages and DeliveryInfo requests are resolved by several threads
+_COMPREHENSIONS = ("<listcomp>", "<setcomp>", "<dictcomp>", "<genexpr>")  # Frames of their own before Python 3.12
+_transparent = set()  # Code of helpers whose calls are attributed to the function that called the helper
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def reset():
+    with _calls_lock:
+        _calls.clear()
+
+
+def _caller() -> str:
+    # The scraper function that made the call, e.g. "_collect_video_links.watch_links"
+    frame = sys._getframe(2)
+    while frame and (frame.f_code.co_filename in (__file__, SeleniumWebDriverWait.until.__code__.co_filename)
+                     or frame.f_code in _transparent or frame.f_code.co_name in _COMPREHENSIONS):
+        frame = frame.f_back
+    if not frame:
+        return "?"
+    code = frame.f_code
+    parts = getattr(code, "co_qualname", code.co_name).split(".")  # Python 3.10 only knows the plain name
+    return ".".join(part for part in parts if part != "<locals>")
+
+
+def transparent(function):
+    # Decorator for helpers like util.wait_until, which would otherwise be the caller of everything they do
+    _transparent.add(function.__code__)
+    return function
+
+
+def record(operation: str, seconds: float, caller: str | None = None):
+    caller = caller or _caller()
+    with _calls_lock:
+        _calls.setdefault((caller, operation), []).append(seconds)
+    metrics.observe("webdriver_seconds", seconds, operation=operation, caller=caller)
+
+
+def _profiled(value):
+    if isinstance(value, WebElement):
+        return ProfiledDriver(value, "element.")
+    if isinstance(value, list) and value and all(isinstance(item, WebElement) for item in value):
+        return [ProfiledDriver(item, "element.") for item in value]
+    return value
+
+
+class ProfiledDriver:
+    # Stands in for a WebDriver (or one of its elements) and times every call and property read made through it
+    # Properties like page_source or element.text are round trips to the browser as well, so they are timed too
+
+    def __init__(self, target, prefix: str = ""):
+        object.__setattr__(self, "_target", target)
+        object.__setattr__(self, "_prefix", prefix)
+
+    def __getattr__(self, name: str):
+        caller = _caller()
+        start = time.perf_counter()
+        attribute = getattr(self._target, name)
+        if not callable(attribute):
+            record(self._prefix + name, time.perf_counter() - start, caller)
+            return _profiled(attribute)
+
+        def call(*args, **kwargs):
+            call_start = time.perf_counter()
+            try:
+                return _profiled(attribute(*args, **kwargs))
+            finally:
+                record(self._prefix + name, time.perf_counter() - call_start, caller)
+
+        return call
+
+    def __setattr__(self, name: str, value):
+        setattr(self._target, name, value)
+
+    def __eq__(self, other):
+        return self._target == (other._target if isinstance(other, ProfiledDriver) else other)
+
+    def __hash__(self):
+        return hash(self._target)
+
+
+def profiled(driver):
+    # Returns the driver itself unless profiling is enabled
+    return ProfiledDriver(driver) if _enabled else driver
+
+
+class WebDriverWait(SeleniumWebDriverWait):
+    # Records the whole wait, including the polling interval, the single polls are recorded as the calls they make
+
+    def until(self, method, message: str = ""):
+        if not _enabled:
+            return super().until(method, message)
+        caller = _caller()
+        start = time.perf_counter()
+        try:
+            return super().until(method, message)
+        finally:
+            record("wait", time.perf_counter() - start, caller)
+
+
+def summary() -> str:
+    # One line per scraper function and operation, the most expensive first
+    with _calls_lock:
+        calls = sorted(_calls.items(), key=lambda item: sum(item[1]), reverse=True)
+    total = sum(sum(seconds) for _, seconds in calls)
+    lines = [f"{'Function':<40} {'Operation':<26} {'Calls':>6} {'Total':>9} {'Share':>6} {'Mean':>8} {'Max':>8}"]
+    for (caller, operation), seconds in calls:
+        lines.append(f"{caller[:40]:<40} {operation[:26]:<26} {len(seconds):>6} {sum(seconds):>8.2f}s "
+                     f"{sum(seconds) / total if total else 0:>6.1%} {sum(seconds) / len(seconds) * 1000:>6.0f}ms "
+                     f"{max(seconds) * 1000:>6.0f}ms")
+    return "\n".join(lines)
@@ -0,0 +1,207 @@
+import collections
+import re
+import subprocess
+import threading
+import time
+from multiprocessing.sharedctypes import Synchronized
+from typing import Iterator
+
+import metrics
+
+PROGRESS_INTERVAL = 30  # Seconds between two progress lines of the same job
+THROUGHPUT_INTERVAL = 60  # Seconds between two throughput lines of the whole run
+LOG_TAIL_LINES = 200  # Lines of a subprocess' output kept for the error report, the rest is dropped as it arrives
+LOG_TAIL_BYTES = 64 * 1024  # The same for programs whose lines may grow without bound, like progress bars
+STALL_TIMEOUT = 300  # Seconds without progress after which ffmpeg is killed
+
+
+def _format_duration(seconds: float) -> str:
+    return f"{int(seconds // 3600):02d}:{time.strftime('%M:%S', time.gmtime(seconds))}"
+
+
+class Progress:
+    # Progress of a single job, printed at most every PROGRESS_INTERVAL seconds
+    # Fetched bytes are also added to a counter shared by all workers, for the throughput of the whole run
+    # A part of a job (a chunk encoded on its own) adds its progress to the progress of the whole job, its parent
+
+    def __init__(self, name: str | None, duration: float | None = None, counter: Synchronized | None = None,
+                 parent: 'Progress | None' = None):
+        self.name = name  # None: track, but don't print
+        self.duration = duration  # Length of the video in seconds, if known
+        self.counter = counter
+        self.parent = parent
+        self.size = 0
+        self.out_time = 0.0
+        self.speed = None
+        self.stage = None  # (title, index, total) of programs that report steps of named stages instead of a time
+        self.remaining = None  # Seconds left, as estimated by the program itself
+        self.lock = threading.Lock()  # Segments are fetched by several threads
+        self.started = self.last_change = self.last_report = time.monotonic()
+
+    def add(self, size: int = 0, out_time: float = 0.0):
+        with self.lock:
+            self._advance(self.size + size, self.out_time + out_time, self.speed)
+
+    def update(self, size: int | None, out_time: float | None, speed: float | None):
+        with self.lock:
+            self._advance(size if size is not None else self.size,
+                          out_time if out_time is not None else self.out_time,
+                          speed if speed is not None else self.speed)
+
+    def _advance(self, size: int, out_time: float, speed: float | None):
+        if size > self.size or out_time > self.out_time:
+            self.last_change = time.monotonic()
+        if self.counter is not None and size > self.size:
+            with self.counter.get_lock():
+                self.counter.value += size - self.size
+        if self.parent is not None:
+            self.parent.add(max(0, size - self.size), max(0.0, out_time - self.out_time))
+        self.size, self.out_time, self.speed = max(size, self.size), max(out_time, self.out_time), speed
+        self._report()
+
+    def update_stage(self, title: str, index: float, total: float, remaining: float | None):
+        with self.lock:
+            if self.stage is None or self.stage[0] != title or index > self.stage[1]:
+                self.last_change = time.monotonic()
+            self.stage, self.remaining = (title, index, total), remaining
+            self._report()
+
+    def _report(self):
+        if self.name and time.monotonic() - self.last_report >= PROGRESS_INTERVAL:
+            self.last_report = time.monotonic()
+            print(f"{self.name}: {self}")
+
+    def eta(self) -> float | None:
+        if self.remaining is not None:
+            return max(0.0, self.remaining)
+        if not self.duration or not self.out_time:
+            return None
+        if self.speed:
+            return max(0.0, self.duration - self.out_time) / self.speed
+        elapsed = time.monotonic() - self.started
+        return max(0.0, self.duration - self.out_time) * elapsed / self.out_time
+
+    def stalled_for(self) -> float:
+        return time.monotonic() - self.last_change
+
+    def __str__(self):
+        parts = [f"{self.size / 1e6:.0f} MB"] if self.size else []
+        if self.stage:
+            title, index, total = self.stage
+            parts.append(f"{title} {index / total:.0%}" if total else title)
+        if self.out_time:
+            parts.append(_format_duration(self.out_time)
+                         + (f" of {_format_duration(self.duration)}" if self.duration else ""))
+        if self.speed:
+            parts.append(f"at {self.speed:.1f}x")
+        if (eta := self.eta()) is not None:
+            parts.append(f"ETA {_format_duration(eta)}")
+        return ", ".join(parts) or "started"
+
+
+def _number(value: str | None) -> float | None:
+    try:
+        return float(value.rstrip('x'))
+    except (AttributeError, ValueError):
+        return None  # "N/A" until ffmpeg knows
+
+
+def _read_progress(process: subprocess.Popen, progress: Progress):
+    # ffmpeg writes blocks of key=value lines, every block ends with progress=continue (or progress=end)
+    values = {}
+    for line in process.stdout:
+        key, _, value = line.decode('utf-8', 'replace').strip().partition('=')
+        values[key] = value
+        if key == "progress":
+            size = _number(values.get('total_size'))
+            out_time = _number(values.get('out_time_us', values.get('out_time_ms')))  # Both are microseconds
+            progress.update(int(size) if size is not None else None,
+                            out_time / 1e6 if out_time is not None else None, _number(values.get('speed')))
+            values = {}
+
+
+def _watch(process: subprocess.Popen, progress: Progress, stall_timeout: float, stalled: threading.Event):
+    while process.poll() is None:
+        if progress.stalled_for() > stall_timeout:
+            stalled.set()
+            process.kill()
+            return
+        time.sleep(1)
+
+
+def run_ffmpeg(command: list, progress: Progress | None = None,
+               stall_timeout: float | None = STALL_TIMEOUT) -> subprocess.CompletedProcess:
+    # Runs ffmpeg with its progress streamed to us instead of buffering all of its output until it exits
+    # Only the tail of its log is kept, and ffmpeg is killed if it made no progress for stall_timeout seconds
+    progress = progress or Progress(None)
+    process = subprocess.Popen([command[0], '-progress', 'pipe:1', '-nostats', *command[1:]],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    log_tail = collections.deque(maxlen=LOG_TAIL_LINES)
+    log_reader = threading.Thread(target=log_tail.extend, args=(process.stderr,), daemon=True)
+    log_reader.start()
+    stalled = threading.Event()
+    if stall_timeout:
+        threading.Thread(target=_watch, args=(process, progress, stall_timeout, stalled), daemon=True).start()
+
+    _read_progress(process, progress)
+    process.wait()
+    log_reader.join()
+    if stalled.is_set():
+        log_tail.append(f"Killed after {stall_timeout:.0f}s without progress\n".encode())
+    return subprocess.CompletedProcess(process.args, process.returncode, b"", b"".join(log_tail))
+
+
+def _lines(stream) -> Iterator[bytes]:
+    # Splits the output of a program at carriage returns as well, progress bars never end their lines
+    # A line is cut to its last LOG_TAIL_BYTES while it arrives, so it can't grow without bound
+    pending = b""
+    while chunk := stream.read1(1 << 16):
+        *lines, pending = re.split(rb"[\r\n]", pending + chunk)
+        pending = pending[-LOG_TAIL_BYTES:]
+        yield from (line for line in lines if line)
+    if pending:
+        yield pending
+
+
+def _machine_progress(line: str) -> tuple[str, float, float, float | None] | None:
+    # auto-editor --progress machine writes title~index~total~seconds_left
+    parts = line.split('~')
+    if len(parts) != 4 or _number(parts[1]) is None or not _number(parts[2]):
+        return None
+    return parts[0], _number(parts[1]), _number(parts[2]), _number(parts[3])
+
+
+def run_logged(command: list, progress: Progress | None = None) -> subprocess.CompletedProcess:
+    # Runs a program like auto-editor, keeping only the last LOG_TAIL_BYTES of its (combined) output
+    # Its machine-readable progress lines go to progress instead of the log
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    log_tail, log_size = collections.deque(), 0
+    for line in _lines(process.stdout):
+        if stage := _machine_progress(line.decode('utf-8', 'replace')):
+            if progress:
+                progress.update_stage(*stage)
+            continue
+        log_tail.append(line[-LOG_TAIL_BYTES + 1:] + b"\n")
+        log_size += len(log_tail[-1])
+        while log_size > LOG_TAIL_BYTES:
+            log_size -= len(log_tail.popleft())
+    process.wait()
+    return subprocess.CompletedProcess(process.args, process.returncode, b"".join(log_tail), b"")
+
+
+def report_throughput(counter: Synchronized, interval: float = THROUGHPUT_INTERVAL) -> threading.Thread:
+    # Prints the download throughput of the whole run while anything is being downloaded
+    def report():
+        previous = counter.value
+        while True:
+            time.sleep(interval)
+            current = counter.value
+            metrics.gauge("download_throughput_bytes_per_second", (current - previous) / interval)
+            if current != previous:
+                print(f"Throughput: {(current - previous) / interval / 1e6:.1f} MB/s over the last {interval:.0f}s, "
+                      f"{current / 1e6:.0f} MB downloaded in this run")
+            previous = current
+
+    reporter = threading.Thread(target=report, daemon=True)
+    reporter.start()
+    return reporter
@@ -0,0 +1,60 @@
+import errno
+import random
+import time
+from typing import Callable
+
+import requests
+
+import metrics
+
+# Outcomes of a single attempt
+SUCCEEDED = "succeeded"
+TRANSIENT = "transient"  # Might work if we try again in a bit: network blips, overloaded servers, full disks
+PERMANENT = "permanent"  # Trying again won't help: expired playlist tokens, broken files, missing tools
+
+BACKOFF_BASE = 10  # Seconds before the first retry, doubled for every further one
+BACKOFF_CAP = 300
+
+# ffmpeg and auto-editor only tell us what went wrong in their output
+TRANSIENT_PROCESS_ERRORS = (
+    "Connection reset", "Connection refused", "Connection timed out", "timed out", "Operation timed out",
+    "Temporary failure in name resolution", "Server returned 5", "Server returned 429",
+    "No space left on device", "Input/output error",
+)
+
+
+def classify_exception(error: Exception) -> str:
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status_code = error.response.status_code
+        return TRANSIENT if status_code == 429 or status_code >= 500 else PERMANENT  # 403/404: the token expired
+    if isinstance(error, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)):
+        return TRANSIENT
+    if isinstance(error, OSError) and error.errno in (errno.ENOSPC, errno.EIO):
+        return TRANSIENT  # The disk budget lets other jobs finish and free up space in the meantime
+    return PERMANENT
+
+
+def classify_process(returncode: int, output: str) -> str:
+    if returncode < 0:
+        return TRANSIENT  # Killed by a signal, most likely by the OOM killer
+    return TRANSIENT if any(error in output for error in TRANSIENT_PROCESS_ERRORS) else PERMANENT
+
+
+def backoff_delay(attempt: int) -> float:
+    # "Full jitter": parallel workers that failed at the same moment don't all come back at the same moment
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** (attempt - 1)))
+
+
+def run(attempt: Callable[[], str], name: str, attempts: int, stage: str = "job") -> bool:
+    # Calls attempt until it succeeds, fails permanently or we are out of attempts
+    for attempt_number in range(1, attempts + 1):
+        outcome = attempt()
+        metrics.count("attempts_total", stage=stage, outcome=outcome)
+        if outcome == SUCCEEDED:
+            return True
+        if outcome == PERMANENT or attempt_number == attempts:
+            return False
+        delay = backoff_delay(attempt_number)
+        print(f"Retrying {name} in {delay:.0f}s (attempt {attempt_number + 1} of {attempts})")
+        time.sleep(delay)
+    return False
@@ -0,0 +1,64 @@
+import sys
+import traceback
+from multiprocessing import Process, Queue
+from typing import Callable
+
+import metrics
+from concurrency import ConcurrencyLimit
+
+
+def _report_queue_depth(jobs: Queue, stage: str):
+    try:
+        metrics.gauge("queue_depth", jobs.qsize(), stage=stage)
+    except NotImplementedError:  # macOS can't count the items of a queue
+        pass
+
+
+def _work(jobs: Queue, target: Callable, settings, next_stage_jobs: 'Queue | None',
+          concurrency_limit: ConcurrencyLimit | None):
+    while True:
+        job = jobs.get()
+        _report_queue_depth(jobs, target.__name__)
+        if job is None:  # None tells us to shut down
+            return
+        if concurrency_limit:
+            concurrency_limit.acquire()  # A slot is only taken while a job runs, so idle workers don't count as busy
+        follow_up_job = None
+        try:
+            follow_up_job = target(*job, settings)
+        except Exception:  # A failed job must never take its worker down with it
+            print(f"Unexpected error while processing {job[0]}:", file=sys.stderr)
+            traceback.print_exc()
+        finally:
+            if concurrency_limit:
+                concurrency_limit.release()
+        if follow_up_job is not None and next_stage_jobs is not None:
+            next_stage_jobs.put(follow_up_job)  # Blocks while the next stage is saturated
+
+
+class Scheduler:
+    # A fixed pool of worker processes that consume jobs from a bounded queue
+    # Submitting blocks while the queue is full, so jobs are only created once a worker is about to need them
+    # Jobs returned by the target are handed off to the next stage, if there is one
+    # With a concurrency limit, only that many of the workers run a job at once, the limit can change at runtime
+
+    def __init__(self, workers: int, target: Callable, settings, next_stage: 'Scheduler | None' = None,
+                 concurrency_limit: ConcurrencyLimit | None = None):
+        self.jobs = Queue(maxsize=workers)
+        next_stage_jobs = next_stage.jobs if next_stage else None
+        self.stage = target.__name__
+        self.workers = [Process(target=_work, args=(self.jobs, target, settings, next_stage_jobs, concurrency_limit))
+                        for _ in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, job: tuple):
+        self.jobs.put(job)
+        _report_queue_depth(self.jobs, self.stage)
+
+    def shutdown(self):
+        # Lets the workers finish all submitted jobs, then waits for them to exit
+        for _ in self.workers:
+            self.jobs.put(None)
+        for worker in self.workers:
+            worker.join()
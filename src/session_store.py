@@ -0,0 +1,52 @@
+import base64
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+from cryptography.fernet import Fernet, InvalidToken
+
+SALT_LENGTH = 16
+KEY_DERIVATION_ROUNDS = 200_000
+
+
+class SessionStore:
+    # Keeps the cookies of a logged-in browser between runs, so we don't have to go through the SSO forms every time
+    # The cookies are encrypted with a key derived from the TUM credentials, nobody without them can read the store
+
+    def __init__(self, directory: Path, tum_username: str, tum_password: str):
+        self.directory = directory
+        self.secret = f"{tum_username}:{tum_password}".encode()
+        self.directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+
+    def _path(self, site: str) -> Path:
+        return Path(self.directory, site + ".session")
+
+    def _fernet(self, salt: bytes) -> Fernet:
+        key = hashlib.pbkdf2_hmac('sha256', self.secret, salt, KEY_DERIVATION_ROUNDS)
+        return Fernet(base64.urlsafe_b64encode(key))
+
+    def load(self, site: str) -> list[dict] | None:
+        # Returns the stored cookies that haven't expired yet, None if there is no usable session
+        try:
+            data = self._path(site).read_bytes()
+            session = json.loads(self._fernet(data[:SALT_LENGTH]).decrypt(data[SALT_LENGTH:]))
+        except (OSError, InvalidToken, ValueError):
+            return None  # No session yet, or it was stored with other credentials
+        now = time.time()
+        cookies = [cookie for cookie in session['cookies'] if cookie.get('expiry', now + 1) > now]
+        if not cookies:
+            return None
+        return cookies
+
+    def save(self, site: str, cookies: [dict]):
+        salt = os.urandom(SALT_LENGTH)
+        token = self._fernet(salt).encrypt(json.dumps({"cookies": cookies, "saved_at": time.time()}).encode())
+        temporary_path = Path(self._path(site).as_posix() + ".tmp")
+        with open(os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as session_file:
+            session_file.write(salt + token)
+        temporary_path.replace(self._path(site))
+
+    def discard(self, site: str):
+        self._path(site).unlink(missing_ok=True)
@@ -2,138 +2,275 @@ import argparse
 import os
 import re
 import sys
-from time import sleep
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterator
 
+import requests
+from bs4 import BeautifulSoup
 from selenium import webdriver
-from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
 
+import metrics
+import profiling
 import util
+from browser_pool import BrowserPool
+from catalog import Catalog
+from session_store import SessionStore
 
+BASE_URL = os.getenv('TUM_LIVE_BASE_URL', "https://live.rbg.tum.de").rstrip('/')  # Or a replay server
+HTTP_WORKERS = 8  # Watch pages fetched in parallel in HTTP mode
+PLAYLIST_URL_PATTERN = r"(https://\S+?/playlist\.m3u8[^'\"\s]*)"
+SESSION_STORE_SITE = "tum_live"
+UPCOMING_MARKERS = ("Starts in more than a day", "Stream is due")
+# Everything we need from a page in a single round trip to the browser
+COURSE_PAGE_SCRIPT = """
+return {
+    links: Array.from(document.querySelectorAll('a[href]'), link => link.href),
+    active_buttons: Array.from(document.querySelectorAll('button'))
+        .filter(button => (button.getAttribute('class') || '').includes('active'))
+        .map(button => button.innerText.trim()),
+};
+"""
+WATCH_PAGE_SCRIPT = """
+const heading = document.querySelector('h1');
+const source = document.querySelector('video source');
+const html = document.documentElement.innerHTML;
+return {
+    title: heading ? heading.innerText.trim() : '',
+    source: source && source.src ? source.src : '',
+    upcoming: arguments[0].some(marker => html.includes(marker)),
+};
+"""
 
-def login(tum_username: str | None, tum_password: str | None) -> webdriver:
-    driver_options = webdriver.FirefoxOptions()
-    if str(os.getenv('HEADLESS', 'true')) in ("1", "true", "yes", "on"):
-        driver_options.add_argument("--headless")
-    if os.getenv('NO-SANDBOX') == '1':
-        driver_options.add_argument("--no-sandbox")
-    driver = webdriver.Firefox(options=driver_options)
+
+def _new_browser() -> webdriver:
+    return webdriver.Firefox(options=util.firefox_options())
+
+
+def login(tum_username: str | None, tum_password: str | None,
+          session_store: SessionStore | None = None) -> webdriver:
+    driver = profiling.profiled(_new_browser())
+
+    if tum_username and session_store and _restore_session(driver, session_store):
+        return driver
 
     if tum_username:
-        driver.get("https://live.rbg.tum.de/login")
+        driver.get(f"{BASE_URL}/login")
         driver.find_element(By.XPATH, "/html/body/main/section/article/div/button").click()
         driver.find_element(By.ID, "username").send_keys(tum_username)
         driver.find_element(By.ID, "password").send_keys(tum_password)
         driver.find_element(By.ID, "username").submit()
-        sleep(2)
+        util.wait_until(driver, lambda d: "/login" not in d.current_url or "Couldn't log in" in d.page_source)
         if "Couldn't log in. Please double check your credentials." in driver.page_source:
             driver.close()
             raise argparse.ArgumentTypeError("Username or password incorrect")
-    driver.get("https://live.rbg.tum.de/old/")
+    driver.get(f"{BASE_URL}/old/")
+    if tum_username and session_store:
+        session_store.save(SESSION_STORE_SITE, driver.get_cookies())
     return driver
 
 
-def get_video_links_of_subject(driver: webdriver, subjects_identifier, camera_type) -> [(str, str)]:
+def _restore_session(driver: webdriver, session_store: SessionStore) -> bool:
+    # Logs the browser in with the cookies of an earlier run, returns False if they are gone or expired
+    cookies = session_store.load(SESSION_STORE_SITE)
+    if not cookies:
+        return False
+    util.add_cookies(driver, BASE_URL, cookies)
+    driver.get(f"{BASE_URL}/old/")
+    if "Login" in driver.page_source:  # The server doesn't know the session anymore
+        driver.delete_all_cookies()
+        session_store.discard(SESSION_STORE_SITE)
+        return False
+    print("Reusing stored TUM-live session")
+    return True
+
+
+def get_video_links_of_subject(driver: webdriver, subjects_identifier, camera_type,
+                               catalog: Catalog | None = None,
+                               session: requests.Session | None = None) -> Iterator[tuple[str, str, str]]:
+    # Yields (episode_name, playlist_m3u8_URL, watch_URL), the watch URL identifies a video across runs
     year, term, slug = subjects_identifier.split("/", 2)
-    subject_url = f"https://live.rbg.tum.de/?year={year}&term={term}&slug={slug}&view=3"
-    driver.get(subject_url)
-
-    # The course page is rendered client-side, so we wait for the video list
-    # to appear before scraping it. An empty list means an empty lecture series.
-    video_urls = _collect_video_links(driver)
-    if not video_urls:
-        return []
-
-    sort_ascending = _sort_is_ascending(driver)
-
-    video_playlists: [(str, str)] = []
-    for video_url in video_urls:
-        driver.get(video_url + "/" + camera_type)
-        sleep(2)
-        filename = driver.find_element(By.XPATH, "//h1").text.strip()
-        if not ("Starts in more than a day" or "Stream is due") in driver.page_source:
-            playlist_url = get_playlist_url(driver)
+    subject_url = f"{BASE_URL}/?year={year}&term={term}&slug={slug}&view=3"
+    with metrics.timed("stage_seconds", stage="course_list", site=SESSION_STORE_SITE):
+        driver.get(subject_url)
+
+        # The course page is rendered client-side, so we wait for the video list
+        # to appear before scraping it. An empty list means an empty lecture series.
+        page = util.wait_until(driver, _course_page_if_ready) or _read_course_page(driver)
+        video_urls = _watch_links(page["links"])
+        if not video_urls:
+            return
+
+        # We visit the videos oldest first, so every video can be yielded as soon as it is found
+        if not _sort_is_ascending(page["active_buttons"]):
+            video_urls.reverse()
+
+    with ThreadPoolExecutor(max_workers=HTTP_WORKERS) as executor:
+        watch_urls = [video_url + "/" + camera_type for video_url in video_urls]
+        fetched_pages = _fetch_watch_pages(executor, session, catalog, subjects_identifier, watch_urls)
+        for video_url, watch_url in zip(video_urls, watch_urls):
+            if catalog and (cached := catalog.lookup(subjects_identifier, watch_url)):
+                metrics.count("catalog_hits_total", site=SESSION_STORE_SITE)
+                yield *cached, video_url  # Resolved recently, no need to open the watch page again
+                continue
+            filename, playlist_url = _resolve_watch_page(driver, watch_url, fetched_pages.get(watch_url))
             if playlist_url:
-                video_playlists.append((filename, playlist_url))
-            else:
+                if catalog:
+                    catalog.store(subjects_identifier, watch_url, filename, playlist_url)
+                yield filename, playlist_url, video_url
+            elif playlist_url is None:
                 print(f'Warning: no playlist URL for "{filename}" ({video_url}) - skipping',
                       file=sys.stderr)
 
-    if not sort_ascending:
-        video_playlists.reverse()
 
-    return video_playlists
+def _fetch_watch_pages(executor: ThreadPoolExecutor, session: requests.Session | None, catalog: Catalog | None,
+                       subjects_identifier: str, watch_urls: [str]) -> dict[str, Future]:
+    # In HTTP mode all watch pages that aren't in the catalog are fetched concurrently up front
+    if not session:
+        return {}
+    return {watch_url: executor.submit(fetch_watch_page, session, watch_url) for watch_url in watch_urls
+            if not (catalog and catalog.lookup(subjects_identifier, watch_url))}
 
 
-def _collect_video_links(driver: webdriver) -> [str]:
-    # The video list is rendered asynchronously; wait for at least one
-    # watch link ("https://live.rbg.tum.de/w/...") to appear.
-    def watch_links() -> [str]:
-        urls: [str] = []
-        for link in driver.find_elements(By.XPATH, ".//a"):
-            link_url = link.get_attribute("href")
-            if link_url and "https://live.rbg.tum.de/w/" in link_url:
-                urls.append(link_url)
-        urls = [url for url in urls if ("/CAM" not in url and "/PRES" not in url and "/chat" not in url)]
-        return list(dict.fromkeys(urls))  # deduplicate, preserve order
+def _resolve_watch_page(driver: webdriver, watch_url: str, fetched_page: Future | None) -> (str, str | None):
+    video = fetched_page.result() if fetched_page else None
+    if video is None:  # Browser mode, or the page couldn't be parsed without running its scripts
+        video = _get_watch_page_with_browser(driver, watch_url)
+    return video
 
-    try:
-        WebDriverWait(driver, 10).until(lambda _d: watch_links())
-    except TimeoutException:
-        pass
-    return watch_links()
+
+def _is_upcoming(page_source: str) -> bool:
+    return any(marker in page_source for marker in UPCOMING_MARKERS)
+
+
+def _read_watch_page(driver: webdriver) -> dict:
+    return driver.execute_script(WATCH_PAGE_SCRIPT, UPCOMING_MARKERS)
+
+
+def _watch_page_if_ready(driver: webdriver) -> dict | None:
+    # Ready once the player has its source, or the page tells us the stream hasn't started yet
+    page = _read_watch_page(driver)
+    return page if page["title"] and (".m3u8" in page["source"] or page["upcoming"]) else None
+
+
+def _get_watch_page_with_browser(driver: webdriver, watch_url: str) -> (str, str | None):
+    # Returns (episode_name, playlist_m3u8_URL), the playlist is "" for streams that haven't happened yet
+    with metrics.timed("stage_seconds", stage="playlist", site=SESSION_STORE_SITE, method="browser"):
+        driver.get(watch_url)
+        page = util.wait_until(driver, _watch_page_if_ready) or _read_watch_page(driver)
+        if page["upcoming"]:
+            return page["title"], ""
+        if ".m3u8" in page["source"]:
+            return page["title"], page["source"]
+        match = re.search(PLAYLIST_URL_PATTERN, driver.page_source)  # Some players only have it in a script
+        return page["title"], match.group(1) if match else None
+
+
+def parse_watch_page(html: str) -> tuple[str, str | None] | None:
+    # Returns (episode_name, playlist_m3u8_URL) like _get_watch_page_with_browser
+    # Returns None if the page has to be rendered by the browser to be understood
+    page = BeautifulSoup(html, 'html.parser')
+    heading = page.find('h1')
+    if not heading:
+        return None
+    filename = " ".join(heading.get_text().split())
+    if _is_upcoming(html):
+        return filename, ""
+    source = page.select_one('video source')
+    if source and ".m3u8" in source.get('src', ''):
+        return filename, source['src']
+    match = re.search(PLAYLIST_URL_PATTERN, html)
+    if match:
+        return filename, match.group(1)
+    return None
+
+
+def fetch_watch_page(session: requests.Session, watch_url: str) -> tuple[str, str | None] | None:
+    with metrics.timed("stage_seconds", stage="playlist", site=SESSION_STORE_SITE, method="http"):
+        try:
+            response = session.get(watch_url, timeout=(10, 30))
+            response.raise_for_status()
+        except requests.RequestException as error:
+            print(f"Warning: could not fetch {watch_url} ({error}) - falling back to the browser", file=sys.stderr)
+            return None
+        return parse_watch_page(response.text)
+
+
+def _read_course_page(driver: webdriver) -> dict:
+    return driver.execute_script(COURSE_PAGE_SCRIPT)
 
 
-def _sort_is_ascending(driver: webdriver) -> bool:
+def _course_page_if_ready(driver: webdriver) -> dict | None:
+    # Ready once at least one watch link ("https://live.rbg.tum.de/w/...") is there
+    page = _read_course_page(driver)
+    return page if _watch_links(page["links"]) else None
+
+
+def _watch_links(links: [str]) -> [str]:
+    urls = [url for url in links if f"{BASE_URL}/w/" in url]
+    urls = [url for url in urls if ("/CAM" not in url and "/PRES" not in url and "/chat" not in url)]
+    return list(dict.fromkeys(urls))  # deduplicate, preserve order
+
+
+def _sort_is_ascending(active_buttons: [str]) -> bool:
     # The newer TUM-Live UI offers two toggle buttons, "Newest first" and
     # "Oldest first"; the one carrying the "active" class reflects the
     # current order. We consider the list ascending (oldest first) only when
     # "Oldest first" is the active button, defaulting to descending.
-    newest = oldest = False
-    for button in driver.find_elements(By.CSS_SELECTOR, "button"):
-        label = (button.text or "").strip()
-        if not label:
-            continue
-        classes = button.get_attribute("class") or ""
-        if "active" not in classes:
-            continue
-        if label == "Oldest first":
-            oldest = True
-        elif label == "Newest first":
-            newest = True
-    return oldest and not newest
-
-
-def get_playlist_url(driver: webdriver) -> str | None:
-    try:
-        WebDriverWait(driver, 10).until(
-            lambda d: d.execute_script(
-                "const s = document.querySelector('video source'); return s && s.src ? s.src : '';"
-            )
-        )
-    except TimeoutException:
-        pass
-
-    src = driver.execute_script(
-        "const s = document.querySelector('video source'); return s && s.src ? s.src : '';"
-    )
-    if src and ".m3u8" in src:
-        return src
-
-    match = re.search(r"(https://\S+?/playlist\.m3u8[^'\"\s]*)", driver.page_source)
-    if match:
-        return match.group(1)
+    return "Oldest first" in active_buttons and "Newest first" not in active_buttons
 
-    return None
+
+class Scraper:
+    # A login to TUM-live and its pool of browsers, kept open to scrape subjects again and again (daemon mode)
+    # In HTTP mode the browsers are only used for the course lists
+
+    def __init__(self, tum_username: str | None, tum_password: str | None, catalog: Catalog | None = None,
+                 scrape_mode: str = "browser", session_store: SessionStore | None = None, scrape_workers: int = 1,
+                 worker_memory_limit: int | None = None):
+        with metrics.timed("stage_seconds", stage="login", site=SESSION_STORE_SITE):
+            driver = login(tum_username, tum_password, session_store)
+        cookies = driver.get_cookies()
+        self.catalog = catalog
+        self.pool = BrowserPool(SESSION_STORE_SITE, driver, lambda: util.open_browser(_new_browser, BASE_URL, cookies),
+                                scrape_workers, worker_memory_limit)
+        self.session = util.session_from_driver(driver, HTTP_WORKERS * scrape_workers) \
+            if scrape_mode == "http" else None
+
+    def _scrape_subject(self, driver: webdriver, subject_name: str,
+                        subject: (str, str)) -> Iterator[tuple[str, str, str]]:
+        subjects_identifier, camera_type = subject
+        # Timed without the time the download queue keeps us waiting
+        return metrics.timed_stream(
+            get_video_links_of_subject(driver, subjects_identifier, camera_type, self.catalog, self.session),
+            "scrape_seconds", site=SESSION_STORE_SITE, subject=subject_name)
+
+    def scrape(self, subjects: dict[str, (str, str)]) -> Iterator[tuple[str, str, str, str]]:
+        # Yields (subject_name, episode_name, playlist_m3u8_URL, video_id) as soon as each video is found
+        # Up to scrape_workers subjects are scraped at once
+        return self.pool.scrape(subjects, self._scrape_subject)
+
+    def close(self):
+        if self.session:
+            self.session.close()
+        self.pool.close()
+
+
+def scrape_subjects(subjects: dict[str, (str, str)], tum_username: str | None, tum_password: str | None,
+                    catalog: Catalog | None = None, scrape_mode: str = "browser",
+                    session_store: SessionStore | None = None, scrape_workers: int = 1,
+                    worker_memory_limit: int | None = None) -> Iterator[tuple[str, str, str, str]]:
+    # Logs in, scrapes the subjects once and closes the browsers again
+    scraper = Scraper(tum_username, tum_password, catalog, scrape_mode, session_store, scrape_workers,
+                      worker_memory_limit)
+    try:
+        yield from scraper.scrape(subjects)
+    finally:
+        scraper.close()
 
 
 def get_subjects(subjects: dict[str, (str, str)], tum_username: str | None, tum_password: str | None,
                  queue: dict[str, [(str, str)]]):
-    driver = login(tum_username, tum_password)
-    for subject_name, (subjects_identifier, camera_type) in subjects.items():
-        m3u8_playlists = get_video_links_of_subject(driver, subjects_identifier, camera_type)
-        m3u8_playlists = util.enumerate_list(m3u8_playlists)
-        print(f'Found {len(m3u8_playlists)} videos for "{subject_name}"')
-        queue[subject_name] = m3u8_playlists
-    driver.close()
+    for subject_name in subjects:
+        queue[subject_name] = []
+    for subject_name, filename, playlist_url, _ in scrape_subjects(subjects, tum_username, tum_password):
+        queue[subject_name].append((filename, playlist_url))
@@ -1,3 +1,142 @@
+import errno
+import fcntl
+import os
+import re
+import shutil
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+
+import requests
+from requests.adapters import HTTPAdapter
+from selenium import webdriver
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.remote.webdriver import WebDriver
+
+import profiling
+from profiling import WebDriverWait
+
+# Firefox preferences of the scraping browser: we only read the DOM, so nothing has to be shown or played
+LEAN_BROWSER_PREFERENCES = {
+    "permissions.default.image": 2,  # No images (thumbnails, posters, avatars)
+    "media.autoplay.default": 5,  # The player doesn't start, not even muted
+    "media.preload.default": 0,  # Nor does it load video data up front
+    "media.preload.auto": 0,
+    "gfx.downloadable_fonts.enabled": False,  # No web fonts
+}
+WAIT_POLL_INTERVAL = 0.1  # Seconds between two checks of a readiness condition
+
+
 # Prepend the index of a list item to the first string in its tuple
 def enumerate_list(list_of_tuples: [(str, str)]) -> [(str, str)]:
-    return [(f'{index:03d}_{name}', url) for index, (name, url) in enumerate(list_of_tuples)]
+    return list(enumerate_stream(list_of_tuples))
+
+
+# Prepend the running index to the first string of each tuple, as the tuples arrive
+def enumerate_stream(tuples: Iterable[tuple]) -> Iterator[tuple]:
+    for index, (name, *rest) in enumerate(tuples):
+        yield f'{index:03d}_{name}', *rest
+
+
+# Filter illegal filename chars
+def sanitize_filename(name: str) -> str:
+    return re.sub('[\\\\/:*?"<>|]|[\x00-\x20]', '_', name)
+
+
+# Add _jc to filename
+def jump_cut_path(output_file_path: Path) -> Path:
+    return Path(re.sub(r'\.(?=[^.]*$)', '_jc.', output_file_path.as_posix()))
+
+
+FICLONE = 0x40049409  # ioctl from linux/fs.h: share the extents of another file (reflink) on btrfs, XFS, ...
+
+
+# Whether two paths live on the same file system, so files can be renamed or hardlinked between them
+def same_file_system(a: Path, b: Path) -> bool:
+    return os.stat(a).st_dev == os.stat(b).st_dev
+
+
+# Try to make destination a copy-on-write clone of source
+def _reflink(source: Path, destination: Path) -> bool:
+    with open(source, 'rb') as source_file, open(destination, 'wb') as destination_file:
+        try:
+            fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+            return True
+        except OSError:
+            return False
+
+
+# Make source available under destination, which never shows up half-written
+# Rename if the source isn't needed anymore, otherwise hardlink or reflink, copy only if nothing else works
+# Returns the number of bytes copied
+def publish_file(source: Path, destination: Path, keep_source: bool) -> int:
+    partial_path = Path(destination.as_posix() + ".part")
+    partial_path.unlink(missing_ok=True)
+    try:
+        if not keep_source:
+            source.replace(destination)
+            return 0
+        os.link(source, partial_path)
+        partial_path.replace(destination)
+        return 0
+    except OSError as error:
+        if error.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise  # Anything but "not possible between these files" is a real error
+
+    copied_bytes = 0
+    if not _reflink(source, partial_path):
+        shutil.copyfile(source, partial_path)
+        copied_bytes = partial_path.stat().st_size
+    shutil.copystat(source, partial_path)
+    partial_path.replace(destination)
+    if not keep_source:
+        source.unlink()
+    return copied_bytes
+
+
+# Reuses the login of a browser for plain HTTP requests
+def session_from_driver(driver: webdriver, pool_size: int) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers['User-Agent'] = driver.execute_script("return navigator.userAgent;")
+    for cookie in driver.get_cookies():
+        session.cookies.set(cookie['name'], cookie['value'], domain=cookie.get('domain'), path=cookie.get('path', '/'))
+    return session
+
+
+# Logs a browser in with the cookies of another one, or of an earlier run
+def add_cookies(driver: webdriver, base_url: str, cookies: [dict]):
+    driver.get(f"{base_url}/robots.txt")  # Cookies can only be set for the current domain
+    for cookie in cookies:
+        driver.add_cookie(cookie)
+
+
+# Another browser of the same site with the login of the first one
+def open_browser(new_browser: Callable[[], WebDriver], base_url: str, cookies: [dict]) -> webdriver:
+    driver = profiling.profiled(new_browser())
+    add_cookies(driver, base_url, cookies)
+    return driver
+
+
+# Options of the scraping browser, set by the environment variables HEADLESS, NO-SANDBOX and LEAN_BROWSER
+def firefox_options() -> webdriver.FirefoxOptions:
+    driver_options = webdriver.FirefoxOptions()
+    if str(os.getenv('HEADLESS', 'true')) in ("1", "true", "yes", "on"):
+        driver_options.add_argument("--headless")
+    if os.getenv('NO-SANDBOX') == '1':
+        driver_options.add_argument("--no-sandbox")
+    if str(os.getenv('LEAN_BROWSER', 'true')) in ("1", "true", "yes", "on"):
+        for preference, value in LEAN_BROWSER_PREFERENCES.items():
+            driver_options.set_preference(preference, value)
+        driver_options.page_load_strategy = "eager"  # Pages are ready for us once parsed, we wait for what we need
+    return driver_options
+
+
+# Waits until condition(driver) is true and returns its result, returns None if it isn't within timeout seconds
+@profiling.transparent
+def wait_until(driver: webdriver, condition, timeout: float = 10):
+    try:
+        return WebDriverWait(driver, timeout, poll_frequency=WAIT_POLL_INTERVAL).until(condition)
+    except TimeoutException:
+        return None
@@ -0,0 +1,92 @@
+import time
+
+import pytest
+
+import browser_pool
+from browser_pool import BrowserPool
+
+
+class FakeBrowser:
+    opened = 0
+
+    def __init__(self):
+        FakeBrowser.opened += 1
+        self.number = FakeBrowser.opened
+        self.quit_count = 0
+
+    def quit(self):
+        self.quit_count += 1
+
+
+@pytest.fixture
+def browsers():
+    FakeBrowser.opened = 0
+    return []
+
+
+def open_browser(browsers: [FakeBrowser]) -> FakeBrowser:
+    browser = FakeBrowser()
+    browsers.append(browser)
+    return browser
+
+
+def lectures(browser: FakeBrowser, subject_name: str, lecture_count: int):
+    for lecture in range(lecture_count):
+        time.sleep(0.1)  # Visiting a watch page
+        yield f"{subject_name} {lecture}", f"https://example.com/{subject_name}/{lecture}.m3u8", browser.number
+
+
+def test_merge_yields_items_of_all_iterators_and_raises_their_errors():
+    def failing():
+        yield 1
+        raise ValueError("Folder-ID incorrect")
+
+    assert (sorted(browser_pool.merge([iter([1, 2]), iter([3])])) == [1, 2, 3])
+    with pytest.raises(ValueError):
+        list(browser_pool.merge([failing(), iter([2])]))
+
+
+def test_subjects_are_spread_across_the_pool(browsers):
+    first = open_browser(browsers)
+    pool = BrowserPool("tum_live", first, lambda: open_browser(browsers), 4)
+    subjects = {f"Subject {index}": 3 for index in range(4)}
+
+    start = time.monotonic()
+    videos = list(pool.scrape(subjects, lectures))
+    assert (time.monotonic() - start < 0.9)  # 4 subjects of 0.3s each, scraped at once
+    assert (len(videos) == 12)
+    assert (len(browsers) == 4)
+    assert (all(browser.quit_count == 0 for browser in browsers))  # Kept open for the next scrape
+
+    assert (len(list(pool.scrape({"Subject 0": 1}, lectures))) == 1)
+    assert (len(browsers) == 4)
+    pool.close()
+    assert (all(browser.quit_count == 1 for browser in browsers))
+
+    for subject_name in subjects:  # Numbered per subject, in the order they were found, by a single browser
+        subject_videos = [video for video in videos if video[0] == subject_name]
+        assert ([video[1] for video in subject_videos] == [f"{index:03d}_{subject_name} {index}" for index in range(3)])
+        assert (len({video[3] for video in subject_videos}) == 1)
+
+
+def test_browsers_beyond_the_memory_limit_are_replaced(browsers, monkeypatch):
+    monkeypatch.setattr(browser_pool, "browser_memory", lambda browser: 600e6 if browser.number == 1 else 100e6)
+    first = open_browser(browsers)
+    pool = BrowserPool("panopto", first, lambda: open_browser(browsers), 1, memory_limit=500e6)
+
+    videos = list(pool.scrape({"Analysis": 1, "Lineare Algebra": 1}, lectures))
+    assert ([video[3] for video in videos] == [1, 2])  # The second subject got a fresh browser
+    assert (first.quit_count == 1 and browsers[1].quit_count == 0)
+
+
+def test_closing_the_scrape_quits_all_browsers(browsers):
+    first = open_browser(browsers)
+    pool = BrowserPool("tum_live", first, lambda: open_browser(browsers), 2)
+    videos = pool.scrape({"Algorithmen": 50, "Analysis": 50}, lectures)
+
+    next(videos)
+    start = time.monotonic()
+    videos.close()
+    assert (time.monotonic() - start < 1)  # The workers stopped after their current video, not after 50
+    assert (len(browsers) == 2)
+    assert (all(browser.quit_count == 1 for browser in browsers))
@@ -0,0 +1,54 @@
+import base64
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+import catalog as catalog_module
+from catalog import Catalog
+
+
+def playlist_url(expiry: float) -> str:
+    claims = base64.urlsafe_b64encode(json.dumps({"exp": int(expiry)}).encode()).decode().rstrip("=")
+    return f"https://edge.live.rbg.tum.de/vod/NetSec.mp4/playlist.m3u8?jwt=eyJhbGciOiJIUzI1NiJ9.{claims}.signature"
+
+
+def test_lookup_returns_stored_video(tmp_path):
+    catalog = Catalog(Path(tmp_path, "catalog.sqlite"), 3600)
+    catalog.store("2022/W/NetSec", "https://live.rbg.tum.de/w/NetSec/1/COMB", "00 Formalities", "https://a/playlist.m3u8")
+    catalog.close()
+
+    catalog = Catalog(Path(tmp_path, "catalog.sqlite"), 3600)  # Survives a restart
+    assert (catalog.lookup("2022/W/NetSec", "https://live.rbg.tum.de/w/NetSec/1/COMB")
+            == ("00 Formalities", "https://a/playlist.m3u8"))
+    assert (catalog.lookup("2022/W/NetSec", "https://live.rbg.tum.de/w/NetSec/2/COMB") is None)
+
+
+def test_lookup_ignores_expired_video(tmp_path):
+    catalog = Catalog(Path(tmp_path, "catalog.sqlite"), -1)
+    catalog.store("2022/W/NetSec", "https://live.rbg.tum.de/w/NetSec/1/COMB", "00 Formalities", "https://a/playlist.m3u8")
+    assert (catalog.lookup("2022/W/NetSec", "https://live.rbg.tum.de/w/NetSec/1/COMB") is None)
+
+
+def test_lookup_ignores_videos_whose_token_expires_soon(tmp_path):
+    catalog = Catalog(Path(tmp_path, "catalog.sqlite"), 24 * 3600)
+    catalog.store("2022/W/NetSec", "https://live.rbg.tum.de/w/NetSec/1/COMB", "00 Formalities",
+                  playlist_url(time.time() + 600))
+    catalog.store("2022/W/NetSec", "https://live.rbg.tum.de/w/NetSec/2/COMB", "01 Crypto",
+                  playlist_url(time.time() + 3 * 3600))
+    assert (catalog.lookup("2022/W/NetSec", "https://live.rbg.tum.de/w/NetSec/1/COMB") is None)
+    assert (catalog.lookup("2022/W/NetSec", "https://live.rbg.tum.de/w/NetSec/2/COMB") is not None)
+
+
+def test_locked_catalog_is_a_cache_miss(tmp_path, monkeypatch):
+    monkeypatch.setattr(catalog_module, "LOCK_TIMEOUT", 0.1)
+    catalog = Catalog(Path(tmp_path, "catalog.sqlite"), 3600)
+    catalog.store("2022/W/NetSec", "https://live.rbg.tum.de/w/NetSec/1/COMB", "00 Formalities", "https://a/playlist.m3u8")
+    other_process = sqlite3.connect(Path(tmp_path, "catalog.sqlite"))
+    other_process.execute("BEGIN EXCLUSIVE")
+
+    assert (catalog.lookup("2022/W/NetSec", "https://live.rbg.tum.de/w/NetSec/1/COMB") is None)
+    catalog.store("2022/W/NetSec", "https://live.rbg.tum.de/w/NetSec/2/COMB", "01 Crypto", "https://b/playlist.m3u8")
+    other_process.rollback()
+    assert (catalog.lookup("2022/W/NetSec", "https://live.rbg.tum.de/w/NetSec/1/COMB") is not None)
+    assert (catalog.lookup("2022/W/NetSec", "https://live.rbg.tum.de/w/NetSec/2/COMB") is None)
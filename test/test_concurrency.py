@@ -0,0 +1,180 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Value
+from pathlib import Path
+
+import pytest
+import requests
+
+import concurrency
+import hls
+from concurrency import AIMD, ConcurrencyLimit
+from progress import Progress
+from scheduler import Scheduler
+
+CHUNK_SIZE = 16 * 1024
+STREAM_RATE = 2e6  # Bytes per second a single connection gets, like a busy CDN node
+LINK_RATE = 6e6  # Bytes per second all connections share, like our uplink
+
+
+class ThrottledHandler(BaseHTTPRequestHandler):
+    # Serves /stream/* at STREAM_RATE per connection and LINK_RATE in total, /stall/* sends one chunk and hangs
+    protocol_version = "HTTP/1.1"
+    link_lock = threading.Lock()
+    link_free_at = 0.0
+    hanging = threading.Event()
+
+    def send_throttled(self, size: int):
+        connection_free_at = time.monotonic()
+        for _ in range(size // CHUNK_SIZE):
+            with self.link_lock:
+                start = max(time.monotonic(), ThrottledHandler.link_free_at, connection_free_at)
+                ThrottledHandler.link_free_at = start + CHUNK_SIZE / LINK_RATE
+            connection_free_at = start + CHUNK_SIZE / STREAM_RATE
+            time.sleep(max(0.0, start - time.monotonic()))
+            self.wfile.write(b"\0" * CHUNK_SIZE)
+
+    def do_GET(self):
+        if self.path.endswith(".m3u8"):
+            body = "#EXTM3U\n" + "".join(f"#EXTINF:6.000,\nsegment_{index}.ts\n" for index in range(4))
+            body = (body + "#EXT-X-ENDLIST\n").encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        size = 8 * CHUNK_SIZE if self.path.startswith("/stall/") else 64 * CHUNK_SIZE
+        self.send_response(200)
+        self.send_header("Content-Length", str(size))
+        self.end_headers()
+        if self.path.startswith("/stall/segment_3"):
+            self.wfile.write(b"\0" * CHUNK_SIZE)
+            self.hanging.wait(10)  # Trickles nothing, but keeps the connection open
+            return
+        self.send_throttled(size)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def throttled_server():
+    ThrottledHandler.hanging.clear()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ThrottledHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    ThrottledHandler.hanging.set()
+    server.shutdown()
+    server.server_close()
+
+
+def test_aimd_settles_at_capacity():
+    # Every stream gets 1 MB/s until the 5 MB/s link is full
+    aimd = AIMD(1, 10)
+    limits = [aimd.adjust(min(aimd.limit, 5) * 1e6) for _ in range(40)]
+    assert (max(limits) <= 6)
+    assert (min(limits[10:]) >= 3)
+
+
+def test_aimd_backs_off_when_throughput_drops():
+    aimd = AIMD(2, 10)
+    for _ in range(6):
+        aimd.adjust(aimd.limit * 1e6)
+    assert (aimd.limit == 8)
+    assert (aimd.adjust(2e6) == 6)  # Same streams, a quarter of the throughput: the server got busy
+    assert (AIMD(4, 4).adjust(1e6) == 4)
+
+
+def record_interval(name: str, directory: Path, settings):
+    start = time.time()
+    time.sleep(0.2)
+    Path(directory, name).write_text(f"{start} {time.time()}")
+
+
+def test_scheduler_respects_concurrency_limit(tmp_path):
+    limit = ConcurrencyLimit(2)
+    scheduler = Scheduler(5, record_interval, None, concurrency_limit=limit)
+    for index in range(10):
+        scheduler.submit((f"{index:03d}", tmp_path))
+    scheduler.shutdown()
+
+    intervals = [tuple(map(float, file.read_text().split())) for file in tmp_path.iterdir()]
+    assert (len(intervals) == 10)
+    assert (max(sum(start <= moment < end for start, end in intervals) for moment, _ in intervals) <= 2)
+    assert (limit.active.value == 0)
+
+
+def stream_for(seconds: float, downloaded_bytes):
+    end = time.time() + seconds
+    while time.time() < end:
+        with downloaded_bytes.get_lock():
+            downloaded_bytes.value += 100_000
+        time.sleep(0.01)
+
+
+def test_adapt_only_judges_intervals_with_all_slots_busy():
+    limit = ConcurrencyLimit(1)
+    downloaded_bytes = Value('q', 0)
+    scheduler = Scheduler(6, stream_for, downloaded_bytes, concurrency_limit=limit)
+    try:
+        time.sleep(0.5)  # The idle workers wait for jobs, not for slots
+        assert (limit.active.value == 0 and not limit.saturated())
+
+        concurrency.adapt(limit, downloaded_bytes, 2, 6, interval=0.3)
+        for _ in range(2):  # Two videos, so a third slot can never be filled
+            scheduler.submit((3,))
+        time.sleep(2.5)
+        assert (limit.limit.value == 3)  # Raised once while both ran, then no interval was saturated
+    finally:
+        limit.set(6)  # Lets workers that wait for a slot see the shutdown
+        scheduler.shutdown()
+
+
+def test_adapt_finds_capacity_of_throttled_server(throttled_server):
+    limit = ConcurrencyLimit(1)
+    downloaded_bytes = Value('q', 0)
+    stop = threading.Event()
+
+    def stream():
+        while not stop.is_set():
+            limit.acquire()
+            try:
+                with requests.get(f"{throttled_server}/stream/video", stream=True) as response:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        with downloaded_bytes.get_lock():
+                            downloaded_bytes.value += len(chunk)
+            finally:
+                limit.release()
+
+    streams = [threading.Thread(target=stream, daemon=True) for _ in range(10)]
+    for thread in streams:
+        thread.start()
+    concurrency.adapt(limit, downloaded_bytes, 1, 10, interval=0.5)
+    time.sleep(8)
+    settled_limit = limit.limit.value
+    stop.set()
+    limit.set(10)  # Lets the waiting streams run into the stop
+    for thread in streams:
+        thread.join()
+
+    # 3 streams fill the link, more than a couple beyond that are backed off again
+    assert (2 <= settled_limit <= 5)
+
+
+def test_stalled_download_is_aborted(throttled_server, tmp_path):
+    playlist_url = f"{throttled_server}/playlist.m3u8"
+    segments = [(f"{throttled_server}/stall/segment_{index}.ts", 6.0) for index in range(4)]
+    progress = Progress(None)
+    start = time.monotonic()
+    with hls.create_session(4) as session, pytest.raises(hls.StalledError):
+        hls.fetch_segments(session, playlist_url, segments, tmp_path, 4, progress=progress, stall_timeout=1)
+    assert (time.monotonic() - start < 5)  # Long before the read timeout
+    assert (not Path(tmp_path, "00003.ts").exists())
+
+    ThrottledHandler.hanging.set()  # The retry finds the other segments in the journal
+    segments[3] = (f"{throttled_server}/stream/segment_3.ts", 6.0)
+    with hls.create_session(4) as session:
+        assert (hls.fetch_segments(session, playlist_url, segments, tmp_path, 4, stall_timeout=1) == 64 * CHUNK_SIZE)
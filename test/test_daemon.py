@@ -0,0 +1,125 @@
+import argparse
+import datetime
+import time
+from pathlib import Path
+
+import daemon
+from daemon import DaemonConfig, Poller, PollOptions, Schedule
+
+OPTIONS = PollOptions(interval=15 * 60, idle_interval=120 * 60, archive_interval=24 * 3600, lecture_hours=(8, 20))
+
+
+def daemon_config(destination_folder_path: Path, **subjects: str) -> DaemonConfig:
+    return DaemonConfig(tum_live_subjects={}, panopto_folders=subjects, default_quality="best", subject_qualities={},
+                        destination_folder_path=destination_folder_path, poll_options=OPTIONS, username=None,
+                        password=None, scrape_mode="browser", session_store=None, scrape_workers=1,
+                        worker_memory_limit=None)
+
+
+def timestamp(*args) -> float:
+    return datetime.datetime(*args).timestamp()
+
+
+def test_subjects_of_past_semesters_are_archived():
+    today = datetime.date(2025, 11, 3)  # Winter term 2025/26
+    assert (not daemon.is_archived("2025/W/AP", today))
+    assert (daemon.is_archived("2025/S/AP", today))
+    assert (daemon.is_archived("2024/W/AP", today))
+    assert (not daemon.is_archived("2025/W/AP", datetime.date(2026, 2, 1)))  # Still the winter term
+    assert (daemon.is_archived("2025/W/AP", datetime.date(2026, 4, 20)))
+    assert (not daemon.is_archived("AP", today))  # Can't tell, polled like a current subject
+
+
+def test_subjects_are_polled_often_during_lecture_hours():
+    schedule = Schedule(OPTIONS)
+    now = timestamp(2025, 11, 3, 10)  # A Monday morning
+    assert (schedule.due("Algorithmen", now))
+    schedule.polled("Algorithmen", True, False, now)
+    assert (not schedule.due("Algorithmen", now + 14 * 60))
+    assert (schedule.due("Algorithmen", now + 15 * 60))
+
+    schedule.polled("Archiv", False, True, now)
+    assert (schedule.next_poll["Archiv"] == now + 2 * 24 * 3600)  # Backed off from its daily poll
+
+
+def test_polls_back_off_without_new_videos():
+    schedule = Schedule(OPTIONS)
+    now = timestamp(2025, 11, 3, 10)
+    intervals = []
+    for _ in range(5):
+        schedule.polled("Analysis", False, False, now)
+        intervals.append(schedule.next_poll["Analysis"] - now)
+    assert (intervals == [30 * 60, 60 * 60, 120 * 60, 120 * 60, 120 * 60])  # At most 8x the interval
+    schedule.polled("Analysis", True, False, now)
+    assert (schedule.next_poll["Analysis"] - now == 15 * 60)
+
+
+def test_idle_polls_resume_with_the_lecture_hours():
+    schedule = Schedule(OPTIONS)
+    sunday_night = timestamp(2025, 11, 9, 23)
+    schedule.polled("Analysis", True, False, sunday_night)
+    assert (schedule.next_poll["Analysis"] == sunday_night + 120 * 60)
+    for _ in range(3):
+        schedule.polled("Analysis", False, False, sunday_night)
+    assert (schedule.next_poll["Analysis"] == timestamp(2025, 11, 10, 8))  # Monday morning, not later
+
+    schedule.forget({"Algorithmen"})
+    assert (schedule.next_poll == {} and schedule.next_due({"Algorithmen"}) == 0)
+
+
+def test_invalid_configs_are_not_applied(tmp_path):
+    poller = Poller(daemon_config(tmp_path, Analysis="folder-a", Algebra="folder-b"), None, None)
+    poller.schedule.polled("Algebra", True, False, timestamp(2025, 11, 3, 10))
+
+    def invalid_config() -> DaemonConfig:
+        raise argparse.ArgumentTypeError("Poll intervals must be positive")
+
+    poller.reload(invalid_config)
+    assert (poller.subjects() == {"Analysis", "Algebra"})
+    poller.reload(lambda: daemon_config(tmp_path, Analysis="folder-a"))
+    assert (poller.subjects() == {"Analysis"} and poller.schedule.next_poll == {})
+
+
+class FakeScrapers:
+    # Finds the same lecture in every poll
+    def scrape(self, site: str, subjects: dict):
+        for subject_name in subjects:
+            yield subject_name, "000_Vorlesung 1", "https://example.com/master.m3u8", "delivery-1"
+
+    def close(self):
+        pass
+
+
+class FakeScheduler:
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, job: tuple):
+        self.jobs.append(job)
+
+
+def test_videos_are_queued_again_until_their_download_succeeds(tmp_path):
+    scheduler = FakeScheduler()
+    poller = Poller(daemon_config(tmp_path, Analysis="folder"), scheduler, None)
+    poller.scrapers = FakeScrapers()
+    due = {"panopto": {"Analysis": "folder"}}
+
+    assert (poller.poll(due) == {"Analysis": 1})
+    assert (len(scheduler.jobs) == 1)  # Its download fails, the playlist isn't published yet
+    assert (poller.poll(due) == {"Analysis": 0})  # Not new anymore, but still missing
+    assert (len(scheduler.jobs) == 1)  # Not retried before its back-off has passed
+    attempts, due_again = poller.requeue["delivery-1"]
+    assert (attempts == 1 and due_again > time.time() + daemon.REQUEUE_BACKOFF - 60)
+
+    poller.requeue["delivery-1"] = (attempts, 0.0)  # The back-off has passed
+    poller.poll(due)
+    assert (len(scheduler.jobs) == 2)
+    assert (poller.requeue["delivery-1"][1] > time.time() + 2 * daemon.REQUEUE_BACKOFF - 60)  # Twice as long
+
+    output_file_path = scheduler.jobs[-1][3]
+    output_file_path.write_bytes(b"video")
+    poller.requeue["delivery-1"] = (2, 0.0)
+    poller.poll(due)
+    assert ("delivery-1" in poller.downloaded and "delivery-1" not in poller.requeue)
+    poller.poll(due)
+    assert (len(scheduler.jobs) == 2)
@@ -0,0 +1,32 @@
+import shutil
+import threading
+import time
+
+import disk_budget
+from disk_budget import DiskBudget
+
+
+def test_reservations_hold_back_jobs_that_do_not_fit(tmp_path, monkeypatch):
+    free = shutil.disk_usage(tmp_path).free
+    monkeypatch.setattr(disk_budget, "RECHECK_INTERVAL", 0.05)
+    budget = DiskBudget([tmp_path, tmp_path], headroom_bytes=free // 2)
+
+    first = budget.reserve([(tmp_path, free // 3)], "first")
+    started = threading.Event()
+
+    def second_job():
+        budget.release(budget.reserve([(tmp_path, free // 3)], "second"))
+        started.set()
+
+    threading.Thread(target=second_job, daemon=True).start()
+    time.sleep(0.2)
+    assert (not started.is_set())  # 1/2 headroom + 2/3 reserved would be more than the disk has
+    budget.release(first)
+    assert (started.wait(5))
+
+
+def test_a_single_job_is_never_held_back_forever(tmp_path):
+    budget = DiskBudget([tmp_path], headroom_bytes=0)
+    reservation = budget.reserve([(tmp_path, shutil.disk_usage(tmp_path).free * 2)], "huge")
+    budget.release(reservation)
+    assert (budget.reserved[next(iter(budget.reserved))].value == 0)
@@ -0,0 +1,77 @@
+import json
+import time
+from multiprocessing import Value
+from pathlib import Path
+
+import pytest
+
+import downloader
+from catalog import Catalog
+import locks
+import retry
+from disk_budget import DiskBudget
+
+
+def settings(tmp_path: Path, **overrides) -> downloader.DownloadSettings:
+    fields = dict(tmp_directory=tmp_path, keep_original=True, jump_cut=False, download_mode="native",
+                  segment_workers=2, run_start_time=time.time(), first_byte_time=Value('d', 0.0),
+                  jumpcut_engine="native", silent_threshold=0.04, silent_speed=8, jumpcut_margin=0.2,
+                  jumpcut_chunks=1, copied_bytes=Value('q', 0), disk_budget=DiskBudget([tmp_path], 0),
+                  retry_attempts=3, downloaded_bytes=Value('q', 0), stall_timeout=300)
+    fields.update(overrides)
+    return downloader.DownloadSettings(**fields)
+
+
+def test_failed_download_releases_its_lock(tmp_path, monkeypatch):
+    attempts = []
+    monkeypatch.setattr(downloader, "reserve_download_space", lambda *_: {})
+    monkeypatch.setattr(downloader, "download_native", lambda *_: attempts.append(1) or retry.PERMANENT)
+    output_file_path = Path(tmp_path, "000_Lecture.mp4")
+
+    assert (downloader.download("000_Lecture.mp4", "https://example.org/playlist.m3u8", "best",
+                                output_file_path, downloader.util.jump_cut_path(output_file_path),
+                                settings(tmp_path)) is None)
+    assert (len(attempts) == 1)  # Permanent failures aren't retried, the worker claimed the lock itself
+    assert (not locks.lock_path(output_file_path).exists())
+
+
+def test_failed_download_drops_its_catalog_entry(tmp_path, monkeypatch):
+    monkeypatch.setattr(downloader, "reserve_download_space", lambda *_: {})
+    monkeypatch.setattr(downloader, "download_native", lambda *_: retry.PERMANENT)  # 403, the token expired
+    catalog_path = Path(tmp_path, "catalog.sqlite")
+    catalog = Catalog(catalog_path, 3600)
+    catalog.store("2022/W/NetSec", "https://live.rbg.tum.de/w/NetSec/1/COMB", "000_Lecture",
+                  "https://example.org/playlist.m3u8")
+    output_file_path = Path(tmp_path, "000_Lecture.mp4")
+
+    downloader.download("000_Lecture.mp4", "https://example.org/playlist.m3u8", "best",
+                        output_file_path, downloader.util.jump_cut_path(output_file_path),
+                        settings(tmp_path, catalog_path=catalog_path))
+    assert (catalog.lookup("2022/W/NetSec", "https://live.rbg.tum.de/w/NetSec/1/COMB") is None)
+    catalog.close()
+
+
+def test_download_skips_videos_claimed_by_another_run(tmp_path, monkeypatch):
+    monkeypatch.setattr(downloader, "download_native", lambda *_: pytest.fail("Downloaded a claimed video"))
+    output_file_path = Path(tmp_path, "000_Lecture.mp4")
+    write_foreign_lock = locks.lock_path(output_file_path).write_text
+    write_foreign_lock(json.dumps({"host": "elsewhere", "pid": 1, "token": "other", "heartbeat": time.time()}))
+
+    downloader.download("000_Lecture.mp4", "https://example.org/playlist.m3u8", "best",
+                        output_file_path, downloader.util.jump_cut_path(output_file_path), settings(tmp_path))
+    assert (json.loads(locks.lock_path(output_file_path).read_text())["token"] == "other")
+
+
+def test_failed_conversion_releases_its_lock(tmp_path, monkeypatch):
+    monkeypatch.setattr(downloader, "cut_video_native", lambda *_: retry.PERMANENT)
+    output_file_path = Path(tmp_path, "000_Lecture.mp4")
+    input_path = Path(tmp_path, "000_Lecture.mp4.original")
+    input_path.write_bytes(b"video")
+    downloader.util.jump_cut_path(output_file_path).write_bytes(b"partial")
+    locks.acquire(output_file_path)
+
+    downloader.cut_video("000_Lecture.mp4", "https://example.org/playlist.m3u8", output_file_path,
+                         downloader.util.jump_cut_path(output_file_path), input_path, time.time(),
+                         locks.hand_over(output_file_path), settings(tmp_path, jump_cut=True))
+    assert (not locks.lock_path(output_file_path).exists())
+    assert (not downloader.util.jump_cut_path(output_file_path).exists())  # Would count as converted otherwise
@@ -0,0 +1,224 @@
+import shutil
+import subprocess
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+import requests
+
+import hls
+from progress import Progress
+
+SEGMENT_COUNT = 12
+
+
+def segment_payload(index: int) -> bytes:
+    return bytes([index]) * (1000 + index)
+
+
+class SyntheticPlaylistHandler(BaseHTTPRequestHandler):
+    requested_paths: [str] = []
+
+    def do_GET(self):
+        self.requested_paths.append(self.path)
+        if self.path == "/master.m3u8":
+            body = ("#EXTM3U\n"
+                    "#EXT-X-STREAM-INF:BANDWIDTH=400000,RESOLUTION=640x360\n"
+                    "low/playlist.m3u8\n"
+                    "#EXT-X-STREAM-INF:BANDWIDTH=2000000,RESOLUTION=1920x1080,CODECS=\"avc1.64002a,mp4a.40.2\"\n"
+                    "high/playlist.m3u8\n").encode()
+        elif self.path == "/demuxed.m3u8":
+            body = ("#EXTM3U\n"
+                    "#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID=\"aac\",NAME=\"English\",DEFAULT=NO,URI=\"dub/playlist.m3u8\"\n"
+                    "#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID=\"aac\",NAME=\"Deutsch\",DEFAULT=YES,URI=\"audio/playlist.m3u8\"\n"
+                    "#EXT-X-STREAM-INF:BANDWIDTH=2000000,RESOLUTION=1920x1080,AUDIO=\"aac\"\n"
+                    "high/playlist.m3u8\n").encode()
+        elif self.path.endswith("/playlist.m3u8"):
+            body = "#EXTM3U\n#EXT-X-TARGETDURATION:6\n#EXT-X-VERSION:3\n"
+            body += "".join(f"#EXTINF:6.000,\nsegment_{index}.ts\n" for index in range(SEGMENT_COUNT))
+            body = (body + "#EXT-X-ENDLIST\n").encode()
+        elif self.path.startswith(("/high/segment_", "/audio/segment_")):
+            body = segment_payload(int(self.path.rsplit("/segment_", 1)[1][:-len(".ts")]))
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        if self.path.startswith("/high/segment_"):
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(segment_payload(int(self.path[len("/high/segment_"):-3])))))
+            self.end_headers()
+        else:
+            self.send_error(404)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def playlist_server():
+    SyntheticPlaylistHandler.requested_paths = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SyntheticPlaylistHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_parse_media_playlist():
+    playlist = "#EXTM3U\n#EXTINF:4.5,\na.ts\n#EXTINF:3,title\nhttps://cdn.example/b.ts\n#EXT-X-ENDLIST\n"
+    segments = hls.parse_media_playlist("https://example.org/vod/playlist.m3u8", playlist)
+    assert (segments == [("https://example.org/vod/a.ts", 4.5), ("https://cdn.example/b.ts", 3.0)])
+
+
+def test_parse_media_playlist_rejects_encryption():
+    playlist = "#EXTM3U\n#EXT-X-KEY:METHOD=AES-128,URI=\"key\"\n#EXTINF:4,\na.ts\n"
+    with pytest.raises(hls.PlaylistError):
+        hls.parse_media_playlist("https://example.org/playlist.m3u8", playlist)
+
+
+def test_resolve_master_playlist(playlist_server):
+    with hls.create_session(2) as session:
+        media_playlist_url, media_playlist = hls.resolve_media_playlist(session, playlist_server + "/master.m3u8")
+    assert (media_playlist_url == playlist_server + "/high/playlist.m3u8")
+    assert (len(hls.parse_media_playlist(media_playlist_url, media_playlist)) == SEGMENT_COUNT)
+
+
+MASTER_PLAYLIST = ("#EXTM3U\n"
+                   "#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID=\"aac\",NAME=\"Deutsch\",DEFAULT=YES,URI=\"audio/playlist.m3u8\"\n"
+                   "#EXT-X-STREAM-INF:BANDWIDTH=400000,RESOLUTION=640x360\n"
+                   "360p/playlist.m3u8\n"
+                   "#EXT-X-STREAM-INF:BANDWIDTH=1200000,RESOLUTION=1280x720\n"
+                   "720p/playlist.m3u8\n"
+                   "#EXT-X-STREAM-INF:BANDWIDTH=3000000,RESOLUTION=1920x1080\n"
+                   "1080p/playlist.m3u8\n")
+
+
+@pytest.mark.parametrize("quality, variant", [
+    ("best", "1080p"),
+    ("max-height:720", "720p"),
+    ("max-height:240", "360p"),  # Nothing fits, smallest variant
+    ("max-bandwidth:1.5M", "720p"),
+    ("max-bandwidth:500k", "360p"),
+    ("audio-only", "audio"),
+])
+def test_select_variant(quality, variant):
+    selected = hls.select_variant("https://example.org/vod/master.m3u8", MASTER_PLAYLIST, quality)
+    assert (selected == f"https://example.org/vod/{variant}/playlist.m3u8")
+
+
+def test_select_variant_audio_only_without_rendition():
+    master_playlist = MASTER_PLAYLIST.split("\n", 2)[0] + "\n" + MASTER_PLAYLIST.split("\n", 2)[2]
+    selected = hls.select_variant("https://example.org/vod/master.m3u8", master_playlist, "audio-only")
+    assert (selected == "https://example.org/vod/360p/playlist.m3u8")
+
+
+@pytest.mark.parametrize("policy", ["worst", "max-height", "max-height:abc", "max-bandwidth:-1", "best:1"])
+def test_parse_quality_rejects_invalid_policies(policy):
+    with pytest.raises(ValueError):
+        hls.parse_quality(policy)
+
+
+def test_resolve_media_playlists_follows_the_audio_rendition(playlist_server):
+    with hls.create_session(1) as session:
+        media_playlists = hls.resolve_media_playlists(session, playlist_server + "/demuxed.m3u8")
+        assert ([url for url, _ in media_playlists] == [playlist_server + "/high/playlist.m3u8",
+                                                        playlist_server + "/audio/playlist.m3u8"])
+        # Muxed audio
+        assert (len(hls.resolve_media_playlists(session, playlist_server + "/master.m3u8")) == 1)
+
+
+def test_download_muxes_in_the_audio_rendition(playlist_server, tmp_path, monkeypatch):
+    remuxed = []
+    monkeypatch.setattr(hls, "remux", lambda *args: remuxed.append(args) or subprocess.CompletedProcess([], 0))
+    fetched_bytes = hls.download(playlist_server + "/demuxed.m3u8", Path(tmp_path, "segments"),
+                                 Path(tmp_path, "out.mp4"), 4)
+
+    assert (fetched_bytes == 2 * sum(len(segment_payload(index)) for index in range(SEGMENT_COUNT)))
+    assert (remuxed[0][3] == Path(tmp_path, "segments", "audio", "concat.txt"))
+    assert (Path(tmp_path, "segments", "audio", "00000.ts").read_bytes() == segment_payload(0))
+
+
+def test_estimate_size(playlist_server):
+    with hls.create_session(1) as session:
+        # 2 Mbit/s for 12 segments of 6 seconds
+        assert (hls.estimate_size(session, playlist_server + "/master.m3u8") == 2_000_000 // 8 * 6 * SEGMENT_COUNT)
+        # Without a master playlist the size of the first segment is extrapolated
+        assert (hls.estimate_size(session, playlist_server + "/high/playlist.m3u8") == 1000 * SEGMENT_COUNT)
+
+
+def test_fetch_segments(playlist_server, tmp_path):
+    with hls.create_session(4) as session:
+        media_playlist_url, media_playlist = hls.resolve_media_playlist(session, playlist_server + "/master.m3u8")
+        segments = hls.parse_media_playlist(media_playlist_url, media_playlist)
+        download_progress = Progress(None)
+        fetched_bytes = hls.fetch_segments(session, media_playlist_url, segments, tmp_path, 4,
+                                           progress=download_progress)
+
+    assert (fetched_bytes == sum(len(segment_payload(index)) for index in range(SEGMENT_COUNT)))
+    assert ((download_progress.size, download_progress.out_time) == (fetched_bytes, 6.0 * SEGMENT_COUNT))
+    for index in range(SEGMENT_COUNT):
+        assert (Path(tmp_path, f"{index:05d}.ts").read_bytes() == segment_payload(index))
+    assert (not list(tmp_path.glob("*.part")))
+
+
+def test_fetch_segments_missing_segment(playlist_server, tmp_path):
+    segments = [(playlist_server + "/high/segment_0.ts", 6.0), (playlist_server + "/missing.ts", 6.0)]
+    with hls.create_session(2) as session:
+        with pytest.raises(requests.HTTPError):
+            hls.fetch_segments(session, playlist_server + "/high/playlist.m3u8", segments, tmp_path, 2)
+
+
+def test_fetch_segments_stops_at_the_first_failed_segment(playlist_server, tmp_path):
+    segments = [(playlist_server + "/missing.ts", 6.0)]
+    segments += [(playlist_server + f"/high/segment_{index % SEGMENT_COUNT}.ts", 6.0) for index in range(200)]
+    with hls.create_session(2) as session:
+        with pytest.raises(requests.HTTPError):
+            hls.fetch_segments(session, playlist_server + "/high/playlist.m3u8", segments, tmp_path, 2)
+    assert (len(SyntheticPlaylistHandler.requested_paths) < 50)  # The queued segments were cancelled
+
+
+@pytest.mark.skipif(not shutil.which("ffmpeg"), reason="ffmpeg is not installed")
+def test_remux_concat_list(tmp_path):
+    for index in range(3):
+        subprocess.run(['ffmpeg', '-y', '-f', 'lavfi', '-i', f'sine=frequency={440 + index}:duration=1',
+                        '-c:a', 'aac', '-f', 'mpegts', Path(tmp_path, f"{index:05d}.ts")],
+                       capture_output=True, check=True)
+    concat_list_path = hls.write_concat_list(3, tmp_path)
+    assert (hls.remux(concat_list_path, Path(tmp_path, "out.mp4")).returncode == 0)
+
+
+def test_fetch_segments_resumes_from_journal(playlist_server, tmp_path):
+    with hls.create_session(4) as session:
+        media_playlist_url, media_playlist = hls.resolve_media_playlist(session, playlist_server + "/master.m3u8")
+        segments = hls.parse_media_playlist(media_playlist_url, media_playlist)
+        hls.fetch_segments(session, media_playlist_url, segments, tmp_path, 4)
+
+        Path(tmp_path, "00003.ts").unlink()  # Lost segment
+        Path(tmp_path, "00007.ts").write_bytes(b"corrupted")  # Damaged segment
+        SyntheticPlaylistHandler.requested_paths = []
+        fetched_bytes = hls.fetch_segments(session, media_playlist_url, segments, tmp_path, 4)
+
+    assert (sorted(SyntheticPlaylistHandler.requested_paths) == ["/high/segment_3.ts", "/high/segment_7.ts"])
+    assert (fetched_bytes == len(segment_payload(3)) + len(segment_payload(7)))
+    assert (Path(tmp_path, "00007.ts").read_bytes() == segment_payload(7))
+
+
+def test_journal_of_another_variant_is_not_resumed(playlist_server, tmp_path):
+    with hls.create_session(4) as session:
+        media_playlist_url, media_playlist = hls.resolve_media_playlist(session, playlist_server + "/master.m3u8")
+        segments = hls.parse_media_playlist(media_playlist_url, media_playlist)
+        hls.fetch_segments(session, media_playlist_url + "?token=1", segments, tmp_path, 4)
+
+    # Same segment names, but the quality policy picked the other variant
+    low_playlist_url = playlist_server + "/low/playlist.m3u8"
+    low_segments = hls.parse_media_playlist(low_playlist_url, media_playlist)
+    assert (hls.verified_segments(hls.Journal(tmp_path, low_playlist_url, low_segments), tmp_path) == set())
+    journal = hls.Journal(tmp_path, media_playlist_url + "?token=2", segments)  # A new token doesn't matter
+    assert (hls.verified_segments(journal, tmp_path) == set(range(SEGMENT_COUNT)))
@@ -0,0 +1,62 @@
+import shutil
+import subprocess
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import jumpcut
+from progress import Progress
+
+
+def test_cut_list_speeds_up_silence_with_margin():
+    frame_loudness = np.array([0.5] * 10 + [0.0] * 20 + [0.9] * 10)  # 1s speech, 2s silence, 1s speech at 10 fps
+    cuts = jumpcut.cut_list(frame_loudness, 10.0, threshold=0.04, margin=0.2, silent_speed=8)
+    assert (cuts == [(0.0, 1.0), (1.2, 8), (2.8, 1.0)])
+
+
+def test_cut_list_without_silence():
+    cuts = jumpcut.cut_list(np.full(50, 0.3), 25.0, threshold=0.04, margin=0.2, silent_speed=8)
+    assert (cuts == [(0.0, 1.0)])
+
+
+def test_filter_script_drops_cut_out_sections():
+    script = jumpcut.filter_script([(0.0, 1.0), (1.2, jumpcut.CUT_OUT_SPEED), (2.8, 1.0)], 25.0)
+    assert ("segment=timestamps=1.200000|2.800000[v0][v1][v2]" in script)
+    assert ("[v1]nullsink" in script and "[a1]anullsink" in script)
+    assert ("[vs0][as0][vs2][as2]concat=n=2:v=1:a=1" in script)
+
+
+@pytest.mark.skipif(not (shutil.which("ffmpeg") and shutil.which("ffprobe")), reason="ffmpeg is not installed")
+def test_cut_synthetic_clip(tmp_path):
+    clip = Path(tmp_path, "clip.mp4")
+    subprocess.run(['ffmpeg', '-y', '-f', 'lavfi', '-i', 'testsrc2=r=25:d=12:s=320x240',
+                    '-f', 'lavfi', '-i', 'aevalsrc=sin(440*2*PI*t)*lt(mod(t\\,6)\\,3):s=44100:d=12',
+                    '-c:v', 'libx264', '-c:a', 'aac', '-shortest', clip], capture_output=True, check=True)
+
+    assert (jumpcut.cut(clip, Path(tmp_path, "clip_jc.mp4"), 0.04, 0.2, jumpcut.CUT_OUT_SPEED).returncode == 0)
+    frames_per_second, has_video = jumpcut.probe(Path(tmp_path, "clip_jc.mp4"))
+    assert (has_video and frames_per_second == 25.0)
+
+    chunked_progress = Progress(None)
+    chunked = jumpcut.cut_chunked(clip, Path(tmp_path, "clip_chunked.mp4"), Path(tmp_path, "chunks"), 3,
+                                  0.04, 0.2, jumpcut.CUT_OUT_SPEED, chunked_progress)
+    assert (chunked.returncode == 0 and not Path(tmp_path, "chunks").exists())
+    assert (chunked_progress.out_time == pytest.approx(chunked_progress.duration, abs=0.5))
+
+
+def test_output_duration():
+    cuts = [(0.0, 1.0), (1.2, 8), (2.8, 1.0)]
+    assert (jumpcut.output_duration(cuts, 4.0) == pytest.approx(1.2 + 1.6 / 8 + 1.2))
+    assert (jumpcut.output_duration([(0.0, 1.0), (1.2, jumpcut.CUT_OUT_SPEED)], 4.0) == 1.2)
+
+
+def test_chunk_borders_snap_to_keyframes():
+    assert (jumpcut.chunk_borders([0.0, 2.0, 4.0, 6.0, 8.0, 10.0, 12.0], 3) == [0.0, 4.0, 8.0])
+    assert (jumpcut.chunk_borders([0.0], 4) == [0.0])
+
+
+def test_chunk_cuts_are_relative_to_the_chunk():
+    cuts = [(0.0, 1.0), (1.2, 8), (2.8, 1.0)]
+    assert (jumpcut.chunk_cuts(cuts, 0.0, 2.0) == [(0.0, 1.0), (1.2, 8)])
+    assert (jumpcut.chunk_cuts(cuts, 2.0, None) == [(0.0, 8), (pytest.approx(0.8), 1.0)])
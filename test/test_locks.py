@@ -0,0 +1,93 @@
+import json
+import multiprocessing
+import os
+import socket
+import time
+from pathlib import Path
+
+import pytest
+
+import locks
+
+
+def write_lock(output_file_path: Path, **owner):
+    locks.lock_path(output_file_path).write_text(json.dumps(owner))
+
+
+def test_own_locks_of_this_run_are_respected(tmp_path):
+    assert (locks.acquire(Path(tmp_path, "a.mp4")))
+    assert (locks.is_locked(Path(tmp_path, "a.mp4")) and not locks.acquire(Path(tmp_path, "a.mp4")))
+    locks.remove(Path(tmp_path, "a.mp4"))
+    assert (not locks.is_locked(Path(tmp_path, "a.mp4")))
+
+
+def test_handed_over_locks_are_only_renewed_and_removed_by_their_new_holder(tmp_path):
+    output_file_path = Path(tmp_path, "a.mp4")
+    assert (locks.acquire(output_file_path))
+    token = locks.hand_over(output_file_path)
+    assert (json.loads(locks.lock_path(output_file_path).read_text())["pid"] is None)  # In transit
+    assert (locks.is_locked(output_file_path) and not locks.acquire(output_file_path))
+
+    assert (locks.adopt(output_file_path, token))
+    locks.lock_path(output_file_path).unlink()  # Removed by the new holder, in another process
+    locks._renew()
+    assert (not locks.lock_path(output_file_path).exists())  # Not brought back by the heartbeat
+
+    write_lock(output_file_path, host="elsewhere", pid=1, token="other", heartbeat=time.time())
+    assert (not locks.adopt(output_file_path, token))  # Claimed by another run while it waited
+    locks.remove(output_file_path)
+    assert (json.loads(locks.lock_path(output_file_path).read_text())["token"] == "other")
+
+
+def test_locks_of_a_previous_run_with_our_pid_are_stale(tmp_path):
+    write_lock(Path(tmp_path, "a.mp4"), host=socket.gethostname(), pid=os.getpid(), heartbeat=time.time())
+    assert (locks.is_stale(Path(tmp_path, "a.mp4")))
+
+
+def test_locks_of_other_hosts_expire_without_heartbeat(tmp_path):
+    write_lock(Path(tmp_path, "fresh.mp4"), host="elsewhere", pid=1, heartbeat=time.time())
+    write_lock(Path(tmp_path, "old.mp4"), host="elsewhere", pid=1, heartbeat=time.time() - 2 * locks.LOCK_TIMEOUT)
+    write_lock(Path(tmp_path, "legacy.mp4"), host="elsewhere", pid=1)
+    assert (locks.is_locked(Path(tmp_path, "fresh.mp4")))
+    assert (not locks.is_locked(Path(tmp_path, "old.mp4")))
+    assert (locks.is_locked(Path(tmp_path, "legacy.mp4")))
+
+
+def test_user_locks_never_expire(tmp_path):
+    locks.lock_path(Path(tmp_path, "a.mp4")).touch()
+    assert (locks.is_user_lock(Path(tmp_path, "a.mp4")) and locks.is_locked(Path(tmp_path, "a.mp4")))
+
+
+def claim_all(output_file_paths: [Path], claims: multiprocessing.Queue, done: multiprocessing.Barrier):
+    for output_file_path in output_file_paths:
+        if locks.acquire(output_file_path):
+            claims.put(output_file_path.name)
+    done.wait()  # The locks of exited processes on this host are stale, so we stay alive until everybody is done
+
+
+def race_for_locks(output_file_paths: [Path], processes: int) -> [str]:
+    # Several processes (standing in for nodes sharing the output folder) try to claim every video
+    context = multiprocessing.get_context("fork")
+    claims = context.Queue()
+    done = context.Barrier(processes)
+    nodes = [context.Process(target=claim_all,
+                             args=(output_file_paths[index:] + output_file_paths[:index], claims, done))
+             for index in range(processes)]
+    for node in nodes:
+        node.start()
+    for node in nodes:
+        node.join()
+    return [claims.get() for _ in range(claims.qsize())]
+
+
+@pytest.mark.parametrize("stale", [False, True])
+def test_every_lock_is_claimed_exactly_once(tmp_path, stale):
+    output_file_paths = [Path(tmp_path, f"{index:03d}_Lecture.mp4") for index in range(100)]
+    if stale:  # Abandoned by a node that went down
+        for output_file_path in output_file_paths:
+            write_lock(output_file_path, host="elsewhere", pid=1, token="dead",
+                       heartbeat=time.time() - 2 * locks.LOCK_TIMEOUT)
+
+    claims = race_for_locks(output_file_paths, 8)
+    assert (sorted(claims) == sorted(output_file_path.name for output_file_path in output_file_paths))
+    assert (not [path for path in Path(tmp_path).iterdir() if not path.name.endswith(".lock")])
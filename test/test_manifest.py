@@ -0,0 +1,52 @@
+from pathlib import Path
+
+import locks
+from manifest import Manifest
+
+
+def test_inserted_lecture_renames_later_files(tmp_path):
+    manifest = Manifest(tmp_path)
+    for video_id, filename in [("w/1", "000_Intro.mp4"), ("w/2", "001_Sorting.mp4")]:
+        manifest.reconcile(video_id, filename)
+        Path(tmp_path, filename).write_text(video_id)
+    Path(tmp_path, "001_Sorting_jc.mp4").write_text("w/2 cut")
+    manifest.save()
+
+    manifest = Manifest(tmp_path)  # A lecture was inserted before "Sorting"
+    assert (manifest.reconcile("w/1", "000_Intro.mp4") == "000_Intro.mp4")
+    assert (manifest.reconcile("w/3", "001_Hashing.mp4") == "001_Hashing.mp4")
+    assert (manifest.reconcile("w/2", "002_Sorting.mp4") == "002_Sorting.mp4")
+
+    assert (Path(tmp_path, "002_Sorting.mp4").read_text() == "w/2")
+    assert (Path(tmp_path, "002_Sorting_jc.mp4").read_text() == "w/2 cut")
+    assert (not Path(tmp_path, "001_Sorting.mp4").exists())
+
+
+def test_swapped_lectures_with_identical_titles(tmp_path):
+    manifest = Manifest(tmp_path)
+    for video_id, filename in [("w/1", "000_NO LECTURE.mp4"), ("w/2", "001_NO LECTURE.mp4")]:
+        manifest.reconcile(video_id, filename)
+        Path(tmp_path, filename).write_text(video_id)
+
+    manifest.reconcile("w/2", "000_NO LECTURE.mp4")  # The order of both lectures flipped
+    manifest.reconcile("w/1", "001_NO LECTURE.mp4")
+
+    assert (Path(tmp_path, "000_NO LECTURE.mp4").read_text() == "w/2")
+    assert (Path(tmp_path, "001_NO LECTURE.mp4").read_text() == "w/1")
+    assert (len(list(tmp_path.glob("*.mp4"))) == 2)
+
+
+def test_files_of_a_video_being_downloaded_are_not_parked(tmp_path):
+    manifest = Manifest(tmp_path)
+    manifest.reconcile("w/1", "000_Intro.mp4")
+    Path(tmp_path, "000_Intro.mp4").write_text("w/1")
+    manifest.reconcile("w/2", "001_Sorting.mp4")
+    assert (locks.acquire(Path(tmp_path, "001_Sorting.mp4")))  # Its download just started
+    Path(tmp_path, "001_Sorting.mp4").write_text("partial")
+
+    try:  # The lectures swapped places
+        assert (manifest.reconcile("w/1", "001_Sorting.mp4") == "000_Intro.mp4")
+        assert (Path(tmp_path, "001_Sorting.mp4").read_text() == "partial")
+        assert (locks.is_locked(Path(tmp_path, "001_Sorting.mp4")))
+    finally:
+        locks.remove(Path(tmp_path, "001_Sorting.mp4"))
@@ -0,0 +1,82 @@
+import json
+import socket
+import time
+from pathlib import Path
+
+import requests
+
+import metrics
+from scheduler import Scheduler
+
+
+def test_exposition():
+    registry = metrics.Registry()
+    registry.record("counter", "attempts_total", 1, {"stage": "download", "outcome": "transient"})
+    registry.record("counter", "attempts_total", 2, {"stage": "download", "outcome": "transient"})
+    registry.record("gauge", "queue_depth", 4, {"stage": "cut_video"})
+    registry.record("histogram", "stage_seconds", 3, {"stage": "download"})
+    registry.record("histogram", "stage_seconds", 40, {"stage": "download"})
+    registry.record("counter", "catalog_hits_total", 1, {"site": 'say "hi"'})
+
+    lines = registry.exposition().splitlines()
+    assert ('tum_video_scraper_attempts_total{outcome="transient",stage="download"} 3' in lines)
+    assert ('tum_video_scraper_queue_depth{stage="cut_video"} 4' in lines)
+    assert ('tum_video_scraper_catalog_hits_total{site="say \\"hi\\""} 1' in lines)
+    assert ("# TYPE tum_video_scraper_stage_seconds histogram" in lines)
+    assert ('tum_video_scraper_stage_seconds_bucket{stage="download",le="2"} 0' in lines)
+    assert ('tum_video_scraper_stage_seconds_bucket{stage="download",le="5"} 1' in lines)  # Cumulative
+    assert ('tum_video_scraper_stage_seconds_bucket{stage="download",le="60"} 2' in lines)
+    assert ('tum_video_scraper_stage_seconds_bucket{stage="download",le="inf"} 2' in lines)
+    assert ('tum_video_scraper_stage_seconds_sum{stage="download"} 43' in lines)
+    assert ('tum_video_scraper_stage_seconds_count{stage="download"} 2' in lines)
+
+
+def test_timed_stream_leaves_out_the_consumer(monkeypatch):
+    observed = []
+    monkeypatch.setattr(metrics, "observe", lambda name, value, **labels: observed.append((name, value, labels)))
+
+    def produce():
+        for item in range(3):
+            time.sleep(0.05)
+            yield item
+
+    for _ in metrics.timed_stream(produce(), "scrape_seconds", subject="NumProg"):
+        time.sleep(0.2)  # Blocked by a full download queue
+    (name, value, labels), = observed
+    assert ((name, labels) == ("scrape_seconds", {"subject": "NumProg"}))
+    assert (0.15 <= value < 0.3)
+
+
+def download(name: str, seconds: float, settings):
+    metrics.observe("stage_seconds", seconds, stage="download")
+    metrics.count("videos_total", stage="download", result="completed")
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def test_collector_gathers_the_workers_measurements(monkeypatch, tmp_path):
+    monkeypatch.setattr(metrics, "_queue", None)
+    metrics.enable()
+    scheduler = Scheduler(3, download, None)
+    port = free_port()
+    collector = metrics.Collector(Path(tmp_path, "metrics.jsonl"), Path(tmp_path, "metrics.prom"), port)
+    for index in range(10):
+        scheduler.submit((f"{index:03d}", index))
+    scheduler.shutdown()
+    collector.close()
+    served = requests.get(f"http://127.0.0.1:{port}/metrics", timeout=5).text  # Up until we exit
+    collector.server.shutdown()
+
+    events = [json.loads(line) for line in Path(tmp_path, "metrics.jsonl").read_text().splitlines()]
+    observations = [event for event in events if event["name"] == "stage_seconds"]
+    assert (sorted(event["value"] for event in observations) == list(range(10)))
+    assert (len({event["pid"] for event in observations}) <= 3)
+    textfile = Path(tmp_path, "metrics.prom").read_text().splitlines()
+    assert ('tum_video_scraper_videos_total{result="completed",stage="download"} 10' in textfile)
+    assert ('tum_video_scraper_stage_seconds_sum{stage="download"} 45' in textfile)
+    assert ("# TYPE tum_video_scraper_queue_depth gauge" in textfile)
+    assert (served.splitlines() == textfile)
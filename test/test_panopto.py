@@ -0,0 +1,30 @@
+import uuid
+
+import panopto
+
+
+class FakeFolderDriver:
+    # Shows the sessions of a folder list, page by page as selected by the URL fragment
+    def __init__(self, video_ids: [str], page_size: int):
+        self.pages = [video_ids[start:start + page_size] for start in range(0, len(video_ids), page_size)] or [[]]
+        self.page = None
+        self.visited = []
+
+    def get(self, url: str):
+        self.page = int(url.rsplit("page=", 1)[1])
+        self.visited.append(self.page)
+
+    def execute_script(self, script: str, *args) -> dict:
+        video_ids = self.pages[self.page] if self.page < len(self.pages) else []
+        return {"title": "Analysis",
+                "links": [f"{panopto.BASE_URL}/Panopto/Pages/Viewer.aspx?id={video_id}" for video_id in video_ids]}
+
+
+def test_folders_with_several_pages_are_collected_completely(monkeypatch):
+    monkeypatch.setattr(panopto, "FOLDER_PAGE_SIZE", 2)
+    monkeypatch.setattr(panopto, "FOLDER_LOAD_TIMEOUT", 0.2)
+    video_ids = [str(uuid.uuid4()) for _ in range(5)]
+    driver = FakeFolderDriver(video_ids, 2)
+
+    assert (panopto._collect_video_ids(driver, "folder") == video_ids)
+    assert (driver.visited == [0, 1, 2])
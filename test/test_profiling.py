@@ -0,0 +1,83 @@
+import sys
+import time
+
+import pytest
+from selenium.webdriver.remote.webelement import WebElement
+
+import profiling
+import util
+
+
+class FakeElement(WebElement):
+    def __init__(self, href: str):
+        super().__init__(None, href)
+        self.href = href
+
+    @property
+    def text(self) -> str:
+        return self.href
+
+    def get_attribute(self, name: str) -> str:
+        time.sleep(0.01)  # A round trip to the browser
+        return self.href
+
+
+class FakeDriver:
+    title = "Course"
+
+    def find_elements(self, by: str, value: str) -> [WebElement]:
+        return [FakeElement(f"https://live.rbg.tum.de/w/course/{index}") for index in range(3)]
+
+
+@pytest.fixture
+def enabled_profiling(monkeypatch):
+    monkeypatch.setattr(profiling, "_enabled", True)
+    profiling.reset()
+    yield
+    profiling.reset()
+
+
+def qualified(*names: str) -> str:
+    # Callers are named with their enclosing functions from Python 3.11 on
+    return ".".join(names) if sys.version_info >= (3, 11) else names[-1]
+
+
+def collect_links(driver) -> [str]:
+    return [link.get_attribute("href") for link in driver.find_elements("xpath", ".//a")]
+
+
+def test_profiled_driver_is_the_driver_when_disabled(monkeypatch):
+    monkeypatch.setattr(profiling, "_enabled", False)
+    driver = FakeDriver()
+    assert (profiling.profiled(driver) is driver)
+
+
+def test_calls_are_recorded_by_caller_and_operation(enabled_profiling):
+    driver = profiling.profiled(FakeDriver())
+    assert (collect_links(driver) == [f"https://live.rbg.tum.de/w/course/{index}" for index in range(3)])
+    assert (driver.title == "Course")
+
+    calls = profiling._calls
+    assert (len(calls["collect_links", "find_elements"]) == 1)
+    assert (len(calls["collect_links", "element.get_attribute"]) == 3)
+    assert (all(seconds >= 0.01 for seconds in calls["collect_links", "element.get_attribute"]))
+    assert (len(calls["test_calls_are_recorded_by_caller_and_operation", "title"]) == 1)
+
+
+def test_waits_are_recorded_for_the_caller_of_the_helper(enabled_profiling):
+    driver = profiling.profiled(FakeDriver())
+
+    def links_if_ready(d) -> [WebElement]:
+        return d.find_elements("xpath", ".//a")
+
+    def wait_for_links():
+        return util.wait_until(driver, links_if_ready, 1)
+
+    assert (len(wait_for_links()) == 3)
+    calls = profiling._calls
+    assert (len(calls[qualified("test_waits_are_recorded_for_the_caller_of_the_helper", "wait_for_links"), "wait"]) == 1)
+    links_if_ready_caller = qualified("test_waits_are_recorded_for_the_caller_of_the_helper", "links_if_ready")
+    assert (len(calls[links_if_ready_caller, "find_elements"]) == 1)
+    summary = profiling.summary().splitlines()
+    assert (len(summary) == 3)
+    assert (any(line.split()[1] == "wait" for line in summary[1:]))
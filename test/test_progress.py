@@ -0,0 +1,79 @@
+import sys
+from pathlib import Path
+
+import progress
+from progress import Progress
+
+
+def fake_ffmpeg(tmp_path: Path, script: str) -> Path:
+    # Stands in for ffmpeg, gets called with -progress pipe:1 -nostats like the real one
+    path = Path(tmp_path, "ffmpeg")
+    path.write_text(f"#!{sys.executable}\nimport sys, time\n{script}")
+    path.chmod(0o755)
+    return path
+
+
+def test_run_ffmpeg_streams_progress_and_keeps_the_log_tail(tmp_path):
+    ffmpeg = fake_ffmpeg(tmp_path, """
+assert sys.argv[1:4] == ['-progress', 'pipe:1', '-nostats']
+for line in range(10000):
+    print(f"log line {line}", file=sys.stderr)
+for second in range(1, 4):
+    print(f"total_size={second * 1000}\\nout_time_us={second * 1000000}\\nspeed=2.5x\\nprogress=continue", flush=True)
+print("progress=end", flush=True)
+sys.exit(1)
+""")
+    job_progress = Progress(None, duration=10.0)
+    completed = progress.run_ffmpeg([ffmpeg, '-i', 'input'], job_progress)
+
+    assert (completed.returncode == 1)
+    assert (completed.stderr.decode().splitlines() == [f"log line {line}" for line in range(9800, 10000)])
+    assert ((job_progress.size, job_progress.out_time, job_progress.speed) == (3000, 3.0, 2.5))
+    assert (job_progress.eta() == 7.0 / 2.5)
+
+
+def test_run_ffmpeg_kills_stalled_processes(tmp_path):
+    ffmpeg = fake_ffmpeg(tmp_path, """
+print("total_size=1000\\nout_time_us=1000000\\nspeed=1x\\nprogress=continue", flush=True)
+time.sleep(60)
+""")
+    completed = progress.run_ffmpeg([ffmpeg], stall_timeout=1)
+    assert (completed.returncode < 0 and b"without progress" in completed.stderr)
+
+
+def test_progress_counts_bytes_for_the_whole_run():
+    from multiprocessing import Value
+    counter = Value('q', 0)
+    first, second = Progress(None, counter=counter), Progress(None, counter=counter)
+    first.add(size=100)
+    second.update(size=250, out_time=None, speed=None)
+    second.update(size=200, out_time=None, speed=None)  # Sizes never go backwards
+    assert (counter.value == 350)
+
+
+def test_chunks_add_their_progress_to_the_whole_video():
+    video = Progress(None, duration=20.0)
+    first, second = Progress(None, parent=video), Progress(None, parent=video)
+    first.update(size=None, out_time=4.0, speed=None)
+    second.update(size=None, out_time=3.0, speed=None)
+    first.update(size=None, out_time=6.0, speed=None)
+    first.update(size=None, out_time=5.0, speed=None)  # Out of order, doesn't go backwards
+    assert ((first.out_time, second.out_time, video.out_time) == (6.0, 3.0, 9.0))
+
+
+def test_run_logged_reports_machine_progress_and_bounds_its_log(tmp_path):
+    auto_editor = fake_ffmpeg(tmp_path, """
+for index in range(0, 101, 10):
+    print(f"Creating new video~{index}~100~{(100 - index) / 10}", end="\\r", flush=True)
+print("x" * 200000, end="\\r")  # A progress bar that never ends its line
+print("Error! Could not write the output")
+sys.exit(1)
+""")
+    job_progress = Progress(None)
+    completed = progress.run_logged([auto_editor], job_progress)
+
+    assert (completed.returncode == 1)
+    assert (len(completed.stdout) <= progress.LOG_TAIL_BYTES)
+    assert (completed.stdout.endswith(b"Error! Could not write the output\n"))
+    assert (job_progress.stage == ("Creating new video", 100.0, 100.0) and job_progress.eta() == 0.0)
+    assert (str(job_progress) == "Creating new video 100%, ETA 00:00:00")
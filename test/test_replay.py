@@ -0,0 +1,73 @@
+import shutil
+import sys
+from pathlib import Path
+from urllib.parse import quote
+
+import pytest
+import requests
+
+import panopto
+import profiling
+import tum_live
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "benchmark"))
+
+import replay  # noqa: E402
+
+RECORDING = Path(__file__).parent / "fixtures" / "replay"
+FOLDER_ID = "0f4c0d1e-7a2b-4c3d-9e8f-1a2b3c4d5e6f"
+VIDEO_ID = "7c9e6679-7425-40de-944b-e07fc1f90ae7"
+
+
+@pytest.fixture
+def replay_server():
+    server = replay.ReplayServer(RECORDING)
+    server.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_recorded_origins_are_replaced(replay_server):
+    response = requests.get(replay_server.url + "/?year=2025&term=W&slug=AP&view=3")
+    assert (response.status_code == 200)
+    assert (f'href="{replay_server.url}/w/AP/55124"' in response.text)
+    assert ("https://live.rbg.tum.de" not in response.text)
+
+
+def test_scrapers_parse_replayed_pages(replay_server, monkeypatch):
+    monkeypatch.setattr(panopto, "BASE_URL", replay_server.url)
+    with requests.Session() as session:
+        filename, playlist_url = tum_live.fetch_watch_page(session, replay_server.url + "/w/AP/55123/COMB")
+        assert (filename == "Lecture 1: Introduction")
+        assert (playlist_url.startswith("https://edge.live.rbg.tum.de/vod/"))  # Only the scraped sites are replaced
+        filename, playlist_url = panopto.fetch_m3u8_playlist(session, VIDEO_ID)
+        assert (filename == "Analysis Vorlesung 1")
+        assert (playlist_url.endswith("/5d2e1b9c-hls-1080/master.m3u8"))
+
+
+def test_pages_with_fragments_are_loaded_by_the_browser(replay_server):
+    response = requests.get(replay_server.url + "/Panopto/Pages/Sessions/List.aspx")
+    assert ("/__replay__?key=" in response.text)
+    key = f"GET /Panopto/Pages/Sessions/List.aspx#folderID=%22{FOLDER_ID}%22&maxResults=250&page=0"
+    response = requests.get(replay_server.url + "/__replay__?key=" + quote(key, safe=""))
+    assert (f"{replay_server.url}/Panopto/Pages/Viewer.aspx?id={VIDEO_ID}" in response.text)
+
+
+def test_missing_pages_are_reported(replay_server):
+    assert (requests.get(replay_server.url + "/w/AP/99999/COMB").status_code == 404)
+    assert (replay_server.missing == ["GET /w/AP/99999/COMB"])
+
+
+@pytest.mark.skipif(not shutil.which("geckodriver"), reason="Needs Firefox and geckodriver")
+@pytest.mark.parametrize("scrape_mode, scrape_workers", [("browser", 1), ("http", 2)])
+def test_scrapers_replay_a_recording(scrape_mode, scrape_workers, monkeypatch):
+    monkeypatch.setattr(tum_live, "BASE_URL", tum_live.BASE_URL)
+    monkeypatch.setattr(panopto, "BASE_URL", panopto.BASE_URL)
+    monkeypatch.setattr(profiling, "_enabled", False)
+    videos = replay.profile(RECORDING, scrape_mode=scrape_mode, scrape_workers=scrape_workers)
+    assert ([(filename, video_url.rsplit("/", 1)[1]) for filename, _, video_url in videos["Algorithmen"]] ==
+            [("000_Lecture 1: Introduction", "55123"), ("001_Lecture 2: Types", "55124")])
+    assert (videos["Analysis"] == [("000_Analysis Vorlesung 1", videos["Analysis"][0][1], VIDEO_ID)])
+    assert (("_collect_video_ids", "wait") in profiling._calls)
+    profiling.reset()
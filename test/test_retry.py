@@ -0,0 +1,40 @@
+import errno
+
+import requests
+
+import retry
+
+
+def http_error(status_code: int) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.HTTPError(response=response)
+
+
+def test_classify_exception():
+    assert (retry.classify_exception(http_error(503)) == retry.TRANSIENT)
+    assert (retry.classify_exception(http_error(429)) == retry.TRANSIENT)
+    assert (retry.classify_exception(http_error(403)) == retry.PERMANENT)  # Expired playlist token
+    assert (retry.classify_exception(requests.ConnectionError()) == retry.TRANSIENT)
+    assert (retry.classify_exception(OSError(errno.ENOSPC, "No space left on device")) == retry.TRANSIENT)
+    assert (retry.classify_exception(ValueError()) == retry.PERMANENT)
+
+
+def test_classify_process():
+    assert (retry.classify_process(1, "https://x/playlist.m3u8: Server returned 503 Service Unavailable")
+            == retry.TRANSIENT)
+    assert (retry.classify_process(1, "Server returned 403 Forbidden (access denied)") == retry.PERMANENT)
+    assert (retry.classify_process(-9, "") == retry.TRANSIENT)
+
+
+def test_run_retries_transient_failures_only(monkeypatch):
+    monkeypatch.setattr(retry.time, "sleep", lambda _: None)
+    outcomes = [retry.TRANSIENT, retry.TRANSIENT, retry.SUCCEEDED]
+    assert (retry.run(lambda: outcomes.pop(0), "test", 3))
+    outcomes = [retry.PERMANENT, retry.SUCCEEDED]
+    assert (not retry.run(lambda: outcomes.pop(0), "test", 3) and outcomes == [retry.SUCCEEDED])
+    assert (not retry.run(lambda: retry.TRANSIENT, "test", 2))
+
+
+def test_backoff_delay_is_capped():
+    assert (all(0 <= retry.backoff_delay(attempt) <= retry.BACKOFF_CAP for attempt in range(1, 20)))
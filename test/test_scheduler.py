@@ -0,0 +1,54 @@
+import os
+from pathlib import Path
+
+from scheduler import Scheduler
+
+
+def record_worker(name: str, directory: Path, settings):
+    Path(directory, name).write_text(str(os.getpid()))
+
+
+def failing_worker(name: str, directory: Path, settings):
+    if name == "fail":
+        raise RuntimeError("broken video")
+    Path(directory, name).write_text(str(os.getpid()))
+
+
+def test_fixed_pool_processes_all_jobs(tmp_path):
+    scheduler = Scheduler(3, record_worker, None)
+    for index in range(50):
+        scheduler.submit((f"{index:03d}", tmp_path))
+    scheduler.shutdown()
+
+    assert (len(list(tmp_path.iterdir())) == 50)
+    assert (len({file.read_text() for file in tmp_path.iterdir()}) <= 3)
+    assert (not any(worker.is_alive() for worker in scheduler.workers))
+
+
+def test_failed_job_keeps_worker_alive(tmp_path):
+    scheduler = Scheduler(1, failing_worker, None)
+    scheduler.submit(("fail", tmp_path))
+    scheduler.submit(("after", tmp_path))
+    scheduler.shutdown()
+
+    assert (Path(tmp_path, "after").exists())
+
+
+def download_stage(name: str, directory: Path, settings):
+    return name, directory
+
+
+def cut_stage(name: str, directory: Path, settings):
+    Path(directory, name).write_text(str(os.getpid()))
+
+
+def test_jobs_are_handed_off_to_next_stage(tmp_path):
+    conversions = Scheduler(2, cut_stage, None)
+    downloads = Scheduler(3, download_stage, None, next_stage=conversions)
+    for index in range(20):
+        downloads.submit((f"{index:03d}", tmp_path))
+    downloads.shutdown()
+    conversions.shutdown()
+
+    assert (len(list(tmp_path.iterdir())) == 20)
+    assert (len({file.read_text() for file in tmp_path.iterdir()}) <= 2)
@@ -0,0 +1,29 @@
+import time
+from pathlib import Path
+
+from session_store import SessionStore
+
+
+def test_session_round_trip_is_encrypted(tmp_path):
+    cookies = [{"name": "jwt", "value": "secret-token", "domain": "live.rbg.tum.de", "path": "/"}]
+    SessionStore(tmp_path, "go42tum", "hunter2").save("tum_live", cookies)
+
+    assert (b"secret-token" not in Path(tmp_path, "tum_live.session").read_bytes())
+    assert (SessionStore(tmp_path, "go42tum", "hunter2").load("tum_live") == cookies)
+
+
+def test_session_of_other_credentials_is_unusable(tmp_path):
+    SessionStore(tmp_path, "go42tum", "hunter2").save("tum_live", [{"name": "jwt", "value": "secret-token"}])
+
+    assert (SessionStore(tmp_path, "go42tum", "hunter3").load("tum_live") is None)
+    assert (SessionStore(tmp_path, "go42tum", "hunter2").load("panopto") is None)
+
+
+def test_expired_cookies_are_dropped(tmp_path):
+    session_store = SessionStore(tmp_path, "go42tum", "hunter2")
+    session_store.save("panopto", [{"name": ".ASPXAUTH", "value": "old", "expiry": int(time.time()) - 60}])
+    assert (session_store.load("panopto") is None)
+
+    session_store.save("panopto", [{"name": ".ASPXAUTH", "value": "old", "expiry": int(time.time()) - 60},
+                                   {"name": "csrfToken", "value": "new", "expiry": int(time.time()) + 3600}])
+    assert ([cookie["name"] for cookie in session_store.load("panopto")] == ["csrfToken"])
@@ -0,0 +1,66 @@
+import functools
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+import requests
+
+import tum_live
+
+FIXTURES = Path(__file__).parent / "fixtures" / "tum_live"
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def fixture_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(QuietHandler, directory=FIXTURES))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetch_recorded_watch_page(fixture_server):
+    with requests.Session() as session:
+        filename, playlist_url = tum_live.fetch_watch_page(session, fixture_server + "/watch_recorded.html")
+    assert (filename == "Lecture 1: Introduction")
+    assert (playlist_url == "https://edge.live.rbg.tum.de/vod/WiSe25_26_AP_2025_10_14_10_00COMB.mp4/playlist.m3u8"
+                            "?jwt=eyJhbGciOi.abc")
+
+
+def test_fetch_watch_page_with_playlist_in_script(fixture_server):
+    with requests.Session() as session:
+        filename, playlist_url = tum_live.fetch_watch_page(session, fixture_server + "/watch_script_player.html")
+    assert (filename == "Lecture 2: Types")
+    assert (playlist_url.endswith("WiSe25_26_AP_2025_10_21_10_00COMB.mp4/playlist.m3u8?jwt=eyJhbGciOi.def"))
+
+
+def test_fetch_upcoming_watch_page(fixture_server):
+    with requests.Session() as session:
+        assert (tum_live.fetch_watch_page(session, fixture_server + "/watch_upcoming.html")
+                == ("Lecture 14: Exam preparation", ""))
+
+
+def test_client_rendered_watch_page_falls_back_to_browser(fixture_server):
+    with requests.Session() as session:
+        assert (tum_live.fetch_watch_page(session, fixture_server + "/watch_client_rendered.html") is None)
+        assert (tum_live.fetch_watch_page(session, fixture_server + "/missing.html") is None)
+
+
+def test_watch_links_of_course_page():
+    links = ["https://live.rbg.tum.de/w/AP/55124", "https://live.rbg.tum.de/w/AP/55124/CAM",
+             "https://live.rbg.tum.de/w/AP/55123", "https://live.rbg.tum.de/w/AP/55123/chat",
+             "https://live.rbg.tum.de/about", "https://live.rbg.tum.de/w/AP/55124"]
+    assert (tum_live._watch_links(links) == ["https://live.rbg.tum.de/w/AP/55124", "https://live.rbg.tum.de/w/AP/55123"])
+
+
+def test_sort_order_of_course_page():
+    assert (tum_live._sort_is_ascending(["Oldest first"]))
+    assert (not tum_live._sort_is_ascending(["Newest first"]))
+    assert (not tum_live._sort_is_ascending([]))
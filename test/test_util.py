@@ -0,0 +1,51 @@
+import errno
+import os
+from pathlib import Path
+
+import util
+
+
+def test_publish_file_renames_when_the_source_is_not_needed(tmp_path):
+    source = Path(tmp_path, ".lecture.mp4.original")
+    source.write_bytes(b"video" * 100)
+    assert (util.publish_file(source, Path(tmp_path, "lecture.mp4"), keep_source=False) == 0)
+    assert (not source.exists() and Path(tmp_path, "lecture.mp4").read_bytes() == b"video" * 100)
+
+
+def test_publish_file_hardlinks_when_the_source_is_kept(tmp_path):
+    source = Path(tmp_path, ".lecture.mp4.original")
+    source.write_bytes(b"video" * 100)
+    assert (util.publish_file(source, Path(tmp_path, "lecture.mp4"), keep_source=True) == 0)
+    assert (os.path.samefile(source, Path(tmp_path, "lecture.mp4")))
+
+
+def test_publish_file_copies_across_file_systems(tmp_path, monkeypatch):
+    def cross_device_link(*_):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    monkeypatch.setattr(os, "link", cross_device_link)
+    monkeypatch.setattr(util, "_reflink", lambda *_: False)
+    source = Path(tmp_path, ".lecture.mp4.original")
+    source.write_bytes(b"video" * 100)
+    assert (util.publish_file(source, Path(tmp_path, "lecture.mp4"), keep_source=True) == 500)
+    assert (source.exists() and Path(tmp_path, "lecture.mp4").read_bytes() == b"video" * 100)
+    assert (not Path(tmp_path, "lecture.mp4.part").exists())
+
+
+class FakeBrowser:
+    def __init__(self):
+        self.visited = []
+        self.cookies = []
+
+    def get(self, url: str):
+        self.visited.append(url)
+
+    def add_cookie(self, cookie: dict):
+        self.cookies.append((self.visited[-1], cookie))
+
+
+def test_open_browser_logs_in_with_the_cookies_of_the_site():
+    cookies = [{"name": "jwt", "value": "token"}, {"name": "session", "value": "id"}]
+    driver = util.open_browser(FakeBrowser, "https://live.rbg.tum.de", cookies)
+    assert (driver.visited == ["https://live.rbg.tum.de/robots.txt"])
+    assert (driver.cookies == [("https://live.rbg.tum.de/robots.txt", cookie) for cookie in cookies])